@@ -1,18 +1,759 @@
 import re
 import json
 import argparse
+import base64
+import bz2
+import codecs
+import contextlib
+import fnmatch
+import gzip
+import hashlib
+import hmac
+import io
+import lzma
+import mmap
+import multiprocessing
+import multiprocessing.connection
 import os
+import shutil
+import socket
+import socketserver
+import stat
+import struct
+import tempfile
 import sys
-from typing import Dict, List, Tuple
+import tarfile
+import threading
+import time
+import tokenize
+import tracemalloc
+import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from html.parser import HTMLParser
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
+from itertools import chain, islice, zip_longest
+from typing import Dict, List, Optional, Tuple
 import csv
 
+try:
+    import tomllib
+except ImportError:  # Python 3.10及以下
+    tomllib = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import numpy as np
+except ImportError:  # 未安装NumPy时用正则查找数字串
+    np = None
+
+
+# Markdown块结构识别
+MARKDOWN_FENCE_PATTERN = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+MARKDOWN_HEADING_PATTERN = re.compile(r'^#{1,6}\s+')
+MARKDOWN_LIST_PATTERN = re.compile(r'^(?:[-*+]|\d+(?:\.\d+)*[.)）]?|[\(（]\d+[\)）])\s+')
+MARKDOWN_LEAD_TOKEN_PATTERN = re.compile(r'(\S+)\s')
+# 表格分隔行和表格数据行
+TABLE_SEPARATOR_PATTERN = re.compile(r'^\s*\|[-|\s:]+\|[-|\s:]*$')
+TABLE_DATA_PATTERN = re.compile(r'^\s*\|.*\|\s*$')
+MARKDOWN_FRONT_MATTER_MARKERS = {'---': ('---', '...'), '+++': ('+++',)}
+
+# 占位符（￥1￥ 或确定性占位符 ￥k3f...￥），结尾的￥用前瞻匹配，避免吞掉相邻占位符的开头
+PLACEHOLDER_PATTERN = re.compile(r'￥([0-9A-Za-z]+)(?=￥)')
+
+# 行分类结果：
+# kind - 行类型（heading/list/table_header/table_separator/table_row/code/front_matter/blank/paragraph）
+# heading_rest - 标题行中#号之后的文本，非标题行为None
+# lead_token - 行首第一个词（其后必须有空白），用于识别行首的章节/列表编号
+# star_body - 以***开头并以***结尾的行中间的文本，其他行为None
+MarkdownLine = namedtuple('MarkdownLine', ['kind', 'heading_rest', 'lead_token', 'star_body'])
+
+
+def describe_markdown_line(line: str) -> MarkdownLine:
+    """识别单独一行（不含换行符）的块类型和编号相关属性，不考虑代码块等跨行状态"""
+    stripped = line.strip()
+    heading_match = MARKDOWN_HEADING_PATTERN.match(stripped)
+    heading_rest = stripped[heading_match.end():] if heading_match else None
+    lead_match = MARKDOWN_LEAD_TOKEN_PATTERN.match(stripped)
+    lead_token = lead_match.group(1) if lead_match else None
+    star_body = stripped[3:-3] if stripped.startswith('***') and stripped.endswith('***') else None
+
+    if not stripped:
+        kind = 'blank'
+    elif heading_match:
+        kind = 'heading'
+    elif TABLE_SEPARATOR_PATTERN.match(line):
+        kind = 'table_separator'
+    elif TABLE_DATA_PATTERN.match(line):
+        kind = 'table_row'
+    elif MARKDOWN_LIST_PATTERN.match(stripped):
+        kind = 'list'
+    else:
+        kind = 'paragraph'
+    return MarkdownLine(kind, heading_rest, lead_token, star_body)
+
+
+class MarkdownBlockClassifier:
+    """逐行识别Markdown块结构，记录围栏代码块和front matter的跨行状态"""
+
+    def __init__(self):
+        self.line_number = 0
+        self.fence = None
+        self.front_matter_end = None
+
+    def classify(self, line: str) -> MarkdownLine:
+        """识别一行（不含换行符）的块类型"""
+        self.line_number += 1
+        # 行内编号规则所需的属性与块类型无关，对所有行都计算
+        info = describe_markdown_line(line)
+        stripped = line.strip()
+
+        fence_match = MARKDOWN_FENCE_PATTERN.match(line)
+        if self.front_matter_end is not None:
+            if stripped in self.front_matter_end:
+                self.front_matter_end = None
+            return info._replace(kind='front_matter')
+        if self.line_number == 1 and stripped in MARKDOWN_FRONT_MATTER_MARKERS:
+            self.front_matter_end = MARKDOWN_FRONT_MATTER_MARKERS[stripped]
+            return info._replace(kind='front_matter')
+        if self.fence is not None:
+            # 结束围栏：相同字符、长度不小于开始围栏且其后只有空白
+            if fence_match and fence_match.group(1)[0] == self.fence[0] and len(fence_match.group(1)) >= len(self.fence) \
+                    and not line[fence_match.end():].strip():
+                self.fence = None
+            return info._replace(kind='code')
+        if fence_match:
+            self.fence = fence_match.group(1)
+            return info._replace(kind='code')
+        return info
+
+
+def iter_markdown_lines(content: str):
+    """逐行产出(行起始位置, 行结束位置, 分类结果)，行结束位置不含换行符"""
+    classifier = MarkdownBlockClassifier()
+    pos = 0
+    length = len(content)
+    while pos <= length:
+        line_end = content.find('\n', pos)
+        if line_end == -1:
+            line_end = length
+        yield pos, line_end, classifier.classify(content[pos:line_end])
+        pos = line_end + 1
+
+
+def classify_markdown_lines(content: str) -> List[Tuple[int, MarkdownLine]]:
+    """对整段文本逐行分类，返回[(行起始位置, 分类结果)]
+
+    紧跟表格分隔行之前的表格行会被标记为表头（table_header）。
+    """
+    lines = []
+    for line_start, _, info in iter_markdown_lines(content):
+        if info.kind == 'table_separator' and lines and lines[-1][1].kind == 'table_row':
+            lines[-1] = (lines[-1][0], lines[-1][1]._replace(kind='table_header'))
+        lines.append((line_start, info))
+    return lines
+
+
+def substitute_placeholders(content: str, lookup: Dict[str, str]) -> str:
+    """单遍替换文本中的占位符，lookup为占位符->替换文本（字典或RestoreTable），不在其中的占位符保持不变"""
+    get_token = lookup.get_token if isinstance(lookup, RestoreTable) else None
+    parts = []
+    pos = 0
+    for match in PLACEHOLDER_PATTERN.finditer(content):
+        start = match.start()
+        if start < pos:
+            # 这个￥是上一个已替换占位符的结尾
+            continue
+        if get_token is not None:
+            replacement = get_token(match.group(1))
+        else:
+            replacement = lookup.get(match.group() + '￥')
+        if replacement is None:
+            continue
+        parts.append(content[pos:start])
+        parts.append(replacement)
+        pos = match.end() + 1
+    parts.append(content[pos:])
+    return ''.join(parts)
+
+
+class RestoreTable(Mapping):
+    """还原用的只读映射表（占位符->原始数字）
+
+    顺序占位符￥N￥的原始数字按序号存放在列表中，查找时直接按整数下标取值，
+    不保存占位符字符串；确定性占位符等其他占位符存放在字典中。
+    """
+
+    __slots__ = ('values', 'others', 'size')
+    # 序号比当前列表长度大出该值以上时存入字典，避免个别大序号使列表出现大量空位
+    MAX_GAP = 1024
+
+    def __init__(self, pairs=()):
+        pairs = list(pairs.items() if isinstance(pairs, Mapping) else pairs)
+        self.values = [None]
+        self.others = {}
+        self.size = 0
+        # 常见情况：映射文件中依次为￥1￥、￥2￥……，整体校验后直接取出原始数字
+        if [placeholder for placeholder, _ in pairs] == [f"￥{index}￥" for index in range(1, len(pairs) + 1)]:
+            self.values.extend(number for _, number in pairs)
+            self.size = len(pairs)
+            return
+        for placeholder, number in pairs:
+            self._add(placeholder, number)
+
+    @staticmethod
+    def _sequence_number(token: str) -> Optional[int]:
+        """顺序占位符的序号（不含前导零的ASCII数字），其他占位符返回None"""
+        if token.isascii() and token.isdigit() and token[0] != '0':
+            return int(token)
+        return None
+
+    def _add(self, placeholder: str, number: str):
+        index = None
+        if len(placeholder) > 2 and placeholder[0] == placeholder[-1] == '￥':
+            index = self._sequence_number(placeholder[1:-1])
+        if index is not None and index - len(self.values) <= self.MAX_GAP:
+            if index >= len(self.values):
+                self.values.extend([None] * (index + 1 - len(self.values)))
+            self.size += self.values[index] is None
+            self.values[index] = number
+        else:
+            self.size += placeholder not in self.others
+            self.others[placeholder] = number
+
+    def get_token(self, token: str) -> Optional[str]:
+        """按占位符两个￥之间的部分查找原始数字"""
+        index = self._sequence_number(token)
+        if index is not None and index < len(self.values):
+            number = self.values[index]
+            if number is not None:
+                return number
+        return self.others.get(f"￥{token}￥") if self.others else None
+
+    def __getitem__(self, placeholder: str) -> str:
+        number = None
+        if len(placeholder) > 2 and placeholder[0] == placeholder[-1] == '￥':
+            number = self.get_token(placeholder[1:-1])
+        if number is None:
+            raise KeyError(placeholder)
+        return number
+
+    def __iter__(self):
+        for index, number in enumerate(self.values):
+            if number is not None:
+                yield f"￥{index}￥"
+        yield from self.others
+
+    def __len__(self) -> int:
+        return self.size
+
+
+def _write_mapping_json(f, items):
+    """把(占位符, 原始数字)逐项写成JSON对象，格式与json.dump(..., ensure_ascii=False, indent=2)相同"""
+    encode = json.encoder.encode_basestring
+    items = iter(items)
+    separator = '{\n  '
+    while True:
+        chunk = [f"{encode(placeholder)}: {encode(number)}" for placeholder, number in islice(items, 4096)]
+        if not chunk:
+            break
+        f.write(separator + ',\n  '.join(chunk))
+        separator = ',\n  '
+    f.write('{}' if separator == '{\n  ' else '\n}')
+
+
+# 候选数字：整数或小数（与先分别匹配小数、整数再去掉重叠部分的结果相同）
+NUMBER_PATTERN = re.compile(r'\d+(?:\.\d+)?')
+# 文本不短于该长度且已安装NumPy时用向量化方式查找数字串（短文本上数组开销大于收益）
+NUMPY_MIN_LENGTH = 4096
+# 各码位是否为十进制数字（与正则的\d相同），首次使用时生成
+_digit_table = None
+
+
+def _unicode_digit_table():
+    """返回码位 -> 是否为十进制数字的布尔数组"""
+    global _digit_table
+    if _digit_table is None:
+        table = np.zeros(sys.maxunicode + 1, dtype=bool)
+        table[[code for code in range(sys.maxunicode + 1) if chr(code).isdecimal()]] = True
+        _digit_table = table
+    return _digit_table
+
+
+def _find_numbers_numpy(content: str) -> List[Tuple[str, int, int]]:
+    """用NumPy向量化查找数字串，结果与NUMBER_PATTERN逐个匹配相同
+
+    ASCII文本直接以uint8数组处理，其他文本转为UTF-32后按码位查表（数组下标即字符位置）。
+    """
+    if content.isascii():
+        codes = np.frombuffer(content.encode('ascii'), dtype=np.uint8)
+        digits = (codes - 48) < 10
+    else:
+        codes = np.frombuffer(content.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+        digits = _unicode_digit_table()[codes]
+    edges = np.diff(digits.view(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if not len(starts):
+        return []
+    # 数字串后紧跟小数点、小数点后紧跟下一个数字串时可以组成小数
+    pairs = (codes[ends[:-1]] == 46) & (starts[1:] == ends[:-1] + 1)
+    # 连续可组成小数时（如1.2.3.4）与正则一样从左到右两两组合：1.2、3.4
+    index = np.arange(len(pairs))
+    last_break = np.maximum.accumulate(np.where(pairs, -1, index))
+    decimals = pairs & ((index - last_break) % 2 == 1)
+    keep = np.ones(len(starts), dtype=bool)
+    keep[1:] = ~decimals
+    ends[:-1][decimals] = ends[1:][decimals]
+    return [(content[start:end], start, end) for start, end in zip(starts[keep].tolist(), ends[keep].tolist())]
+
+
+def _find_numbers(content: str) -> List[Tuple[str, int, int]]:
+    """查找文本中所有的整数和小数，返回按位置排序的(数字, 开始位置, 结束位置)"""
+    if np is not None and len(content) >= NUMPY_MIN_LENGTH:
+        return _find_numbers_numpy(content)
+    return [(match.group(), match.start(), match.end()) for match in NUMBER_PATTERN.finditer(content)]
+
+
+# 自定义规则：规则动作（preserve保留其中的数字，desensitize强制脱敏其中的数字）
+RULE_ACTIONS = ('preserve', 'desensitize')
+# 自定义规则编译缓存的格式版本，合并方式变化时递增使旧缓存失效
+RULES_CACHE_VERSION = 1
+# 规则正则开头的全局内联标志，如 (?i)
+RULE_INLINE_FLAGS_PATTERN = re.compile(r'\(\?([aiLmsux]+)\)')
+# 规则正则中的命名分组和命名反向引用
+RULE_GROUP_NAME_PATTERN = re.compile(r'\(\?P([<=])([A-Za-z_]\w*)')
+# 规则正则中的编号反向引用（合并后编号会变化，不支持）
+RULE_NUMBERED_BACKREF_PATTERN = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]')
+
+
+class RuleSet:
+    """用户自定义的保留/强制脱敏规则，合并编译为一个正则，每段文本只扫描一遍
+
+    同一位置同时命中多条规则时，优先级高的规则生效（优先级相同按规则文件中的顺序）。
+    """
+
+    def __init__(self, pattern: str, groups: Dict[str, Tuple[str, str]]):
+        self.source = pattern
+        self.pattern = re.compile(pattern) if pattern else None
+        # 分组名 -> (规则名, 动作)
+        self.groups = groups
+
+    @classmethod
+    def compile(cls, rules: List[dict]) -> 'RuleSet':
+        """按优先级合并规则；每条规则改写为独立的命名分组"""
+        ordered = sorted(enumerate(rules), key=lambda item: (-item[1]['priority'], item[0]))
+        alternatives = []
+        groups = {}
+        for index, (_, rule) in enumerate(ordered):
+            pattern = rule['pattern']
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f"规则 {rule['name']} 的正则无效: {e}")
+            if RULE_NUMBERED_BACKREF_PATTERN.search(pattern):
+                raise ValueError(f"规则 {rule['name']} 使用了编号反向引用，请改用命名分组 (?P<name>...)")
+            group = f"_r{index}"
+            # 规则自带的命名分组加上前缀，避免合并后重名
+            pattern = RULE_GROUP_NAME_PATTERN.sub(lambda m: f"(?P{m.group(1)}{group}_{m.group(2)}", pattern)
+            # 开头的全局标志(?i)改为只作用于本规则的(?i:...)
+            flags = RULE_INLINE_FLAGS_PATTERN.match(pattern)
+            if flags:
+                pattern = f"(?{flags.group(1)}:{pattern[flags.end():]})"
+            alternatives.append(f"(?P<{group}>{pattern})")
+            groups[group] = (rule['name'], rule['action'])
+        return cls('|'.join(alternatives), groups)
+
+    def scan(self, content: str) -> Tuple[List[Tuple[int, int]], List[Tuple[int, int]]]:
+        """扫描文本，返回(保留区域, 强制脱敏区域)"""
+        preserved = []
+        forced = []
+        if self.pattern is None:
+            return preserved, forced
+        for match in self.pattern.finditer(content):
+            if match.start() == match.end():
+                continue
+            # 外层的规则分组最后闭合，lastgroup总是规则分组
+            _, action = self.groups[match.lastgroup]
+            (preserved if action == 'preserve' else forced).append(match.span())
+        return preserved, forced
+
+
+def _normalize_rules(config: dict) -> List[dict]:
+    """把规则文件内容整理为[{name, action, pattern, priority}]，字符串形式的规则使用默认优先级0"""
+    rules = []
+    for action in RULE_ACTIONS:
+        for index, rule in enumerate(config.get(action) or []):
+            if isinstance(rule, str):
+                rule = {'pattern': rule}
+            if not isinstance(rule, dict) or not isinstance(rule.get('pattern'), str):
+                raise ValueError(f"规则文件中 {action} 的第{index + 1}条规则缺少pattern")
+            rules.append({
+                'name': str(rule.get('name') or f"{action}_{index + 1}"),
+                'action': action,
+                'pattern': rule['pattern'],
+                'priority': int(rule.get('priority', 0)),
+            })
+    return rules
+
+
+def load_rules(rules_file: str, cache_dir: Optional[str] = None) -> RuleSet:
+    """读取规则文件（.json或.toml）并编译为RuleSet
+
+    合并后的正则按规则内容的哈希缓存到cache_dir（默认~/.cache/desensitize），
+    规则不变时直接读取缓存，跳过校验和改写。
+    """
+    if not os.path.exists(rules_file):
+        raise FileNotFoundError(f"规则文件 {rules_file} 不存在")
+    with open(rules_file, 'rb') as f:
+        data = f.read()
+    if rules_file.lower().endswith('.toml'):
+        if tomllib is None:
+            raise ImportError("读取TOML规则文件需要Python 3.11及以上版本（tomllib），或改用JSON格式")
+        config = tomllib.loads(data.decode('utf-8'))
+    else:
+        config = json.loads(data.decode('utf-8'))
+    rules = _normalize_rules(config)
+
+    # 编译结果只缓存合并后的正则源码和分组信息：re的编译对象无法序列化，加载时重新编译一次
+    digest = hashlib.sha256(json.dumps([RULES_CACHE_VERSION, rules], ensure_ascii=False,
+                                       sort_keys=True).encode('utf-8')).hexdigest()
+    if cache_dir is None:
+        cache_dir = os.environ.get('DESENSITIZE_CACHE_DIR') or os.path.join(
+            os.path.expanduser('~'), '.cache', 'desensitize')
+    cache_path = os.path.join(cache_dir, f"rules-{digest[:32]}.json")
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        return RuleSet(cached['pattern'], {group: tuple(info) for group, info in cached['groups'].items()})
+    except (OSError, ValueError, KeyError, TypeError, re.error):
+        # 缓存损坏（如正则无法编译）时重新编译并覆盖
+        pass
+
+    rule_set = RuleSet.compile(rules)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'pattern': rule_set.source, 'groups': rule_set.groups}, f, ensure_ascii=False)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        # 缓存目录不可写时只是每次重新编译
+        pass
+    return rule_set
+
+
+# 关键词保留：关键词与数字之间允许的分隔字符及最大个数（如"GB 50215"、"工作面:1203"）
+KEYWORD_GAP_CHARS = frozenset(' \t:：#-')
+KEYWORD_MAX_GAP = 2
+# 关键词的作用窗口：prefix为关键词后紧跟的数字，suffix为关键词前紧挨的数字
+KEYWORD_WINDOWS = {'prefix': 1, 'suffix': 2, 'both': 3}
+
+
+class KeywordAutomaton:
+    """由关键词表构建的Aho-Corasick自动机，一遍扫描找出文本中所有关键词，耗时与词表大小无关
+
+    自动机只包含列表、字典和编译后的正则，可以直接pickle传给进程池，构建一次后在多个文件间复用。
+    """
+
+    def __init__(self, keywords):
+        # keywords: 关键词列表，或 关键词 -> 作用窗口('prefix'/'suffix'/'both') 的字典
+        if not isinstance(keywords, dict):
+            keywords = {keyword: 'prefix' for keyword in keywords}
+        self.goto = [{}]
+        self.fail = [0]
+        # 每个状态命中的关键词：[(长度, 窗口标志)]，已合并失败链上的输出
+        self.output = [[]]
+        for keyword, window in keywords.items():
+            if not keyword:
+                continue
+            if window not in KEYWORD_WINDOWS:
+                raise ValueError(f"关键词 {keyword} 的作用窗口无效: {window}（可选: {', '.join(KEYWORD_WINDOWS)}）")
+            state = 0
+            for char in keyword:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = next_state
+            self.output[state].append((len(keyword), KEYWORD_WINDOWS[window]))
+        self.size = sum(1 for keyword in keywords if keyword)
+
+        # 按广度优先顺序计算失败指针
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.output[next_state].extend(self.output[self.fail[next_state]])
+
+        # 处于初始状态时直接跳到下一个可能是关键词开头的字符
+        first_chars = ''.join(sorted(self.goto[0]))
+        self.first_pattern = re.compile('[' + re.escape(first_chars) + ']') if first_chars else None
+
+    def iter_matches(self, text: str):
+        """产出文本中所有关键词的(开始位置, 结束位置, 窗口标志)，包括相互重叠的关键词"""
+        if self.first_pattern is None:
+            return
+        goto, fail, output, first = self.goto, self.fail, self.output, self.first_pattern
+        state = 0
+        i = 0
+        length = len(text)
+        while i < length:
+            if state == 0:
+                match = first.search(text, i)
+                if match is None:
+                    return
+                i = match.start()
+            char = text[i]
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for keyword_length, windows in output[state]:
+                yield i + 1 - keyword_length, i + 1, windows
+            i += 1
+
+    def keyword_boundaries(self, text: str) -> Tuple[set, set]:
+        """返回(前缀关键词的结束位置集合, 后缀关键词的开始位置集合)"""
+        ends = set()
+        starts = set()
+        for start, end, windows in self.iter_matches(text):
+            if windows & KEYWORD_WINDOWS['prefix']:
+                ends.add(end)
+            if windows & KEYWORD_WINDOWS['suffix']:
+                starts.add(start)
+        return ends, starts
+
+
+def load_keywords(keywords_file: str) -> KeywordAutomaton:
+    """读取关键词表（每行一个，#开头为注释；可用制表符加prefix/suffix/both指定作用窗口）"""
+    if not os.path.exists(keywords_file):
+        raise FileNotFoundError(f"关键词文件 {keywords_file} 不存在")
+    keywords = {}
+    with open(keywords_file, 'r', encoding=_detect_encoding(keywords_file)) as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            keyword, _, window = line.partition('\t')
+            keywords[keyword.strip()] = window.strip() or 'prefix'
+    return KeywordAutomaton(keywords)
+
+
+def _is_near_keyword(content: str, start: int, end: int, keyword_ends: set, keyword_starts: set) -> bool:
+    """判断数字前面紧跟前缀关键词，或后面紧跟后缀关键词（中间最多隔KEYWORD_MAX_GAP个分隔字符）"""
+    if keyword_ends:
+        pos = start
+        for _ in range(KEYWORD_MAX_GAP + 1):
+            if pos in keyword_ends:
+                return True
+            if pos == 0 or content[pos - 1] not in KEYWORD_GAP_CHARS:
+                break
+            pos -= 1
+    if keyword_starts:
+        pos = end
+        for _ in range(KEYWORD_MAX_GAP + 1):
+            if pos in keyword_starts:
+                return True
+            if pos >= len(content) or content[pos] not in KEYWORD_GAP_CHARS:
+                break
+            pos += 1
+    return False
+
+
+# 取值名单的二进制格式：文件头（魔数、版本、布隆过滤器哈希个数、取值个数、布隆过滤器位数）
+VALUE_LIST_MAGIC = b'DSVL'
+VALUE_LIST_HEADER = struct.Struct('<4sBB2xQQ')
+# 构建布隆过滤器时每个取值占用的位数（约1%误判率，误判时再查有序哈希数组）
+VALUE_LIST_BITS_PER_VALUE = 10
+
+
+def _value_hashes(value: str) -> Tuple[int, int]:
+    """取值的两个64位哈希：第一个存入有序数组，两个组合生成布隆过滤器的各个位"""
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+
+class MappedValueList:
+    """内存映射的取值名单：布隆过滤器 + 排序后的64位哈希数组，按需分页读取
+
+    多个进程打开同一文件时共享操作系统页缓存，不复制数据；pickle时只传文件路径。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.hash_count, self.count, self.bloom_bits = VALUE_LIST_HEADER.unpack_from(self._mmap)
+        if magic != VALUE_LIST_MAGIC or version != 1:
+            raise ValueError(f"{path} 不是有效的取值名单文件")
+        view = memoryview(self._mmap)
+        offset = VALUE_LIST_HEADER.size
+        self._bloom = view[offset:offset + self.bloom_bits // 8]
+        offset += self.bloom_bits // 8
+        # 哈希按小端序存储，大端机器上逐个解码
+        data = view[offset:offset + self.count * 8]
+        self._hashes = data.cast('Q') if sys.byteorder == 'little' else _BigEndianHashes(data)
+
+    def __contains__(self, value) -> bool:
+        key, step = _value_hashes(value)
+        bloom, bits = self._bloom, self.bloom_bits
+        for i in range(self.hash_count):
+            bit = (key + i * step) % bits
+            if not bloom[bit >> 3] & (1 << (bit & 7)):
+                return False
+        index = bisect_left(self._hashes, key)
+        return index < self.count and self._hashes[index] == key
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def close(self):
+        self._bloom.release()
+        if isinstance(self._hashes, memoryview):
+            self._hashes.release()
+        self._mmap.close()
+        self._file.close()
+
+
+class _BigEndianHashes:
+    """大端机器上按小端序解码哈希数组，供bisect使用"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data) // 8
+
+    def __getitem__(self, index):
+        return int.from_bytes(self.data[index * 8:index * 8 + 8], 'little')
+
+
+def build_value_list(values, output_path: str, bits_per_value: int = VALUE_LIST_BITS_PER_VALUE) -> int:
+    """把取值写成内存映射名单文件，返回去重后的取值个数"""
+    hashes = {_value_hashes(value) for value in values}
+    count = len(hashes)
+    bloom_bits = max(64, (count * bits_per_value + 63) // 64 * 64)
+    hash_count = max(1, round(bits_per_value * 0.693))
+    bloom = bytearray(bloom_bits // 8)
+    for key, step in hashes:
+        for i in range(hash_count):
+            bit = (key + i * step) % bloom_bits
+            bloom[bit >> 3] |= 1 << (bit & 7)
+
+    # 两个取值的64位哈希相同的概率可以忽略，有序数组中只保留第一个哈希
+    keys = array('Q', sorted({key for key, _ in hashes}))
+    if sys.byteorder != 'little':
+        keys.byteswap()
+    with open(output_path, 'wb') as f:
+        f.write(VALUE_LIST_HEADER.pack(VALUE_LIST_MAGIC, 1, hash_count, len(keys), bloom_bits))
+        f.write(bloom)
+        keys.tofile(f)
+    return len(keys)
+
+
+def _iter_value_lines(file_path: str):
+    """逐行读取文本格式的取值名单（每行一个取值，#开头为注释）"""
+    with open(file_path, 'r', encoding=_detect_encoding(file_path)) as f:
+        for line in f:
+            value = line.strip()
+            if value and not value.startswith('#'):
+                yield value
+
+
+def load_value_list(file_path: str):
+    """读取取值名单：build-list生成的二进制文件使用内存映射，文本文件读入集合"""
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"名单文件 {file_path} 不存在")
+    with open(file_path, 'rb') as f:
+        magic = f.read(len(VALUE_LIST_MAGIC))
+    if magic == VALUE_LIST_MAGIC:
+        return MappedValueList(file_path)
+    return frozenset(_iter_value_lines(file_path))
+
+
+class NumberMappingView(Mapping):
+    """脱敏器映射关系（原始数字->占位符）的只读视图，顺序占位符在访问时才格式化"""
+
+    __slots__ = ('desensitizer',)
+
+    def __init__(self, desensitizer: 'TextDesensitizer'):
+        self.desensitizer = desensitizer
+
+    def __getitem__(self, number: str) -> str:
+        index = self.desensitizer.number_ids.get(number)
+        if index is not None:
+            return f"￥{index}￥"
+        return self.desensitizer.fixed_placeholders[number]
+
+    def __contains__(self, number) -> bool:
+        return number in self.desensitizer.number_ids or number in self.desensitizer.fixed_placeholders
+
+    def __iter__(self):
+        yield from self.desensitizer.values
+        yield from self.desensitizer.fixed_placeholders
+
+    def __len__(self) -> int:
+        return len(self.desensitizer.values) + len(self.desensitizer.fixed_placeholders)
+
 
 class TextDesensitizer:
     """通用文本脱敏器，支持多种文本文件格式"""
+
+    __slots__ = ('values', 'number_ids', 'placeholder_key', 'placeholder_length', 'placeholder_values',
+                 'fixed_placeholders', 'line_cache_size', 'line_cache', 'line_cache_hits', 'line_cache_misses',
+                 'skipped_kinds', 'rules', 'keywords', 'allowlist', 'denylist')
     
-    def __init__(self):
-        self.number_mapping = {}
-        self.placeholder_counter = 1
+    def __init__(self, skip_code_blocks: bool = False, skip_front_matter: bool = False,
+                 line_cache_size: int = 0, placeholder_key: Optional[bytes] = None,
+                 placeholder_length: int = 13, rules: Optional[RuleSet] = None,
+                 keywords: Optional[KeywordAutomaton] = None, allowlist=None, denylist=None):
+        # 顺序占位符：values[N-1]为占位符￥N￥对应的原始数字，number_ids为原始数字->N，占位符按需格式化
+        self.values = []
+        self.number_ids = {}
+        # 确定性占位符：用密钥对数字做HMAC，相同密钥下相同数字在任何进程中得到相同占位符
+        self.placeholder_key = placeholder_key
+        self.placeholder_length = placeholder_length
+        # 确定性占位符（以及合并映射时保留的其他占位符）的双向字典
+        self.placeholder_values = {}
+        self.fixed_placeholders = {}
+        # 逐行处理模式下的整行结果缓存（LRU）：行文本 -> 该行需要替换的数字位置
+        self.line_cache_size = line_cache_size
+        self.line_cache = OrderedDict()
+        self.line_cache_hits = 0
+        self.line_cache_misses = 0
+        # 不参与脱敏的Markdown块类型（围栏代码块、front matter）
+        self.skipped_kinds = set()
+        if skip_code_blocks:
+            self.skipped_kinds.add('code')
+        if skip_front_matter:
+            self.skipped_kinds.add('front_matter')
+        # 用户自定义的保留/强制脱敏规则（见load_rules）
+        self.rules = rules
+        # 关键词保留：紧跟在领域术语（如GB、煤层、工作面）前后的数字不脱敏（见load_keywords）
+        self.keywords = keywords
+        # 取值名单（集合或MappedValueList，见load_value_list）：白名单中的数字从不替换，黑名单中的数字总是替换
+        self.allowlist = allowlist
+        self.denylist = denylist
     
     def is_section_number(self, text: str, context: str = "") -> bool:
         """判断是否为章节编号"""
@@ -69,15 +810,19 @@ class TextDesensitizer:
     def is_table_separator(self, text: str) -> bool:
         """判断是否为表格分隔符"""
         # 表格分隔符模式
-        return bool(re.match(r'^\s*\|[-|\s:]+\|[-|\s:]*$', text))
+        return bool(TABLE_SEPARATOR_PATTERN.match(text))
         
     def is_table_data(self, text: str) -> bool:
         """判断是否为表格数据行"""
         # 表格数据行通常以|开头和结尾，且包含多个|
-        return bool(re.match(r'^\s*\|.*\|\s*$', text))
+        return bool(TABLE_DATA_PATTERN.match(text))
     
-    def extract_numbers(self, content: str) -> List[Tuple[str, int, int]]:
-        """提取文本中的所有数字（排除章节编号、IP地址、邮箱、日期等）"""
+    def extract_numbers(self, content: str, fragment: bool = False) -> List[Tuple[str, int, int]]:
+        """提取文本中的所有数字（排除章节编号、IP地址、邮箱、日期等）
+
+        fragment为True时content是结构化格式中的值片段而不是Markdown文本：
+        不按行分类，标题、行首编号、***标题行和代码块等规则都不适用。
+        """
         numbers = []
         
         # 先找出需要保留的内容位置（IP地址、邮箱、日期等）
@@ -131,233 +876,1482 @@ class TextDesensitizer:
             preserved_positions.append((match.start(), match.end()))
         
         # 表格和图片编号格式 (表4-1-1, 图3-2-1)
-        table_figure_pattern = r'(?:表|图)\s*[A-Za-z0-9]+(?:-[A-Za-z0-9]+)+'
+        # 编号与表/图之间只允许同一行内的空白，保证逐行处理与整段处理结果一致
+        table_figure_pattern = r'(?:表|图)[^\S\n]*[A-Za-z0-9]+(?:-[A-Za-z0-9]+)+'
         for match in re.finditer(table_figure_pattern, content):
             preserved_positions.append((match.start(), match.end()))
+
+        # 用户自定义规则：所有规则合并为一个正则，只扫描一遍
+        forced_positions = []
+        if self.rules is not None:
+            user_preserved, forced_positions = self.rules.scan(content)
+            preserved_positions.extend(user_preserved)
+
+        # 关键词前后的数字：自动机一遍扫描得到所有关键词边界
+        keyword_ends = keyword_starts = None
+        if self.keywords is not None:
+            keyword_ends, keyword_starts = self.keywords.keyword_boundaries(content)
         
-        # 直接匹配所有连续的数字（整数和小数）
-        # 使用更简单的模式，匹配所有数字序列
-        digit_patterns = [
-            r'\d+\.\d+',  # 小数
-            r'\d+'  # 整数
-        ]
-        
-        all_matches = []
-        for pattern in digit_patterns:
-            for match in re.finditer(pattern, content):
-                number = match.group()
-                start, end = match.span()
-                all_matches.append((number, start, end))
-                
-        # 按位置排序
-        all_matches.sort(key=lambda x: x[1])
-        
-        # 简化去重逻辑 - 只保留不重叠的匹配
-        filtered_matches = []
-        if all_matches:
-            filtered_matches.append(all_matches[0])
-            for i in range(1, len(all_matches)):
-                current_match = all_matches[i]
-                last_match = filtered_matches[-1]
-                
-                # 如果当前匹配与上一个匹配不重叠，则添加
-                if current_match[1] >= last_match[2]:
-                    filtered_matches.append(current_match)
-                # 否则，选择更长的匹配
-                elif (current_match[2] - current_match[1]) > (last_match[2] - last_match[1]):
-                    filtered_matches[-1] = current_match
-                    
-        # 过滤掉保留区域和章节编号
+        # 所有连续的数字（整数和小数），已按位置排序且互不重叠
+        filtered_matches = _find_numbers(content)
+
+        # 保留区域按位置排序并合并，之后与按位置排序的候选数字双指针比对
+        preserved_positions.sort()
+        merged_preserved = []
+        for pres_start, pres_end in preserved_positions:
+            if merged_preserved and pres_start <= merged_preserved[-1][1]:
+                if pres_end > merged_preserved[-1][1]:
+                    merged_preserved[-1][1] = pres_end
+            else:
+                merged_preserved.append([pres_start, pres_end])
+
+        # 需要跳过代码块等跨行结构时按顺序对所有行分类，否则只对含候选数字的行分类
+        lines = iter_markdown_lines(content) if self.skipped_kinds and not fragment else None
+
+        # 候选数字按行分组：同一行的数字共用一次行分类结果
         final_numbers = []
+        pres_index = 0
+        line_end = -1
+        line = None
+        force_index = 0
         for number, start, end in filtered_matches:
+            if self.allowlist is not None and number in self.allowlist:
+                continue
+
+            # 落在强制脱敏区域内的数字（以及黑名单中的数字）不受保留规则和章节编号规则限制
+            while force_index < len(forced_positions) and forced_positions[force_index][1] <= start:
+                force_index += 1
+            forced = force_index < len(forced_positions) and forced_positions[force_index][0] < end
+            if not forced and self.denylist is not None:
+                forced = number in self.denylist
+
             # 检查是否在保留区域内
-            is_preserved = False
-            for pres_start, pres_end in preserved_positions:
-                if start < pres_end and end > pres_start:
-                    is_preserved = True
-                    break
-            
-            if is_preserved:
+            while pres_index < len(merged_preserved) and merged_preserved[pres_index][1] <= start:
+                pres_index += 1
+            if not forced and pres_index < len(merged_preserved) and merged_preserved[pres_index][0] < end:
                 continue
-            
-            # 获取数字所在的行上下文
-            line_start = content.rfind('\n', 0, start)
-            if line_start == -1:
-                line_start = 0
-            else:
-                line_start += 1
-                
-            line_end = content.find('\n', start)
-            if line_end == -1:
-                line_end = len(content)
-                
-            context = content[line_start:line_end]
-        
-            # 检查数字前后是否有括号，如果是则作为列表编号处理
-            # 获取数字前后的字符
-            before_char = content[start-1] if start > 0 else ''
+            if (not forced and keyword_ends is not None
+                    and _is_near_keyword(content, start, end, keyword_ends, keyword_starts)):
+                continue
+
+            if fragment:
+                if forced or not (content[end:end + 1] in (')', '）') and number.isdigit()):
+                    final_numbers.append((number, start, end))
+                continue
+
+            # 进入新的一行时才重新获取行分类结果
+            if start > line_end:
+                if lines is not None:
+                    for _, line_end, line in lines:
+                        if line_end >= start:
+                            break
+                else:
+                    line_start = content.rfind('\n', 0, start) + 1
+                    line_end = content.find('\n', start)
+                    if line_end == -1:
+                        line_end = len(content)
+                    line = describe_markdown_line(content[line_start:line_end])
+
+            if line.kind in self.skipped_kinds:
+                continue
+            if forced:
+                final_numbers.append((number, start, end))
+                continue
+            if line.kind == 'table_separator':
+                continue
+
+            # 列表编号 1) 1） (1) （1）：纯数字且紧跟右括号
             after_char = content[end] if end < len(content) else ''
-            
-            # 构造可能的列表编号格式用于检查
-            possible_list_formats = []
-            if before_char and after_char:
-                possible_list_formats.append(before_char + number + after_char)
-            if after_char:
-                possible_list_formats.append(number + after_char)
-            if before_char:
-                possible_list_formats.append(before_char + number)
-                
-            # 检查是否为列表编号
-            is_list_number = False
-            for fmt in possible_list_formats:
-                if re.match(r'^[\(（]\d+[\)）]$|^\d+[\)）]$', fmt.strip()):
-                    is_list_number = True
-                    break
-            
-            # 如果不是章节编号且不在表格分隔行中，则添加到列表中
-            is_section = self.is_section_number(number, context) or is_list_number
-            is_table_sep = self.is_table_separator(context)
-            
-            if not is_section and not is_table_sep:
+            is_list_number = after_char in (')', '）') and number.isdigit()
+
+            if not is_list_number and not self.is_line_section_number(number, line):
                 final_numbers.append((number, start, end))
                 
         return final_numbers
+
+    def is_line_section_number(self, number: str, line: MarkdownLine) -> bool:
+        """根据数字所在行的分类结果判断是否为章节编号（标题、行首编号、***标题行）"""
+        if line.heading_rest is not None and line.heading_rest.startswith(number):
+            return True
+        if line.lead_token == number:
+            return True
+        if line.star_body is not None and number in line.star_body:
+            return True
+        return False
     
+    @property
+    def number_mapping(self) -> NumberMappingView:
+        """映射关系（原始数字->占位符）的只读视图"""
+        return NumberMappingView(self)
+
+    @property
+    def placeholder_counter(self) -> int:
+        """下一个顺序占位符的序号"""
+        return len(self.values) + 1
+
     def add_to_mapping(self, number: str) -> str:
-        """将数字添加到映射中，返回占位符"""
-        if number not in self.number_mapping:
-            placeholder = f"￥{self.placeholder_counter}￥"
-            self.number_mapping[number] = placeholder
-            self.placeholder_counter += 1
-        return self.number_mapping[number]
+        """将数字添加到映射中，返回占位符（白名单中的数字原样返回）"""
+        index = self.number_ids.get(number)
+        if index is not None:
+            return f"￥{index}￥"
+        placeholder = self.fixed_placeholders.get(number)
+        if placeholder is not None:
+            return placeholder
+        if self.allowlist is not None and number in self.allowlist:
+            return number
+        return self._allocate_placeholder(number)
+
+    def _allocate_placeholder(self, number: str) -> str:
+        """为新数字分配占位符"""
+        if self.placeholder_key is not None:
+            placeholder = self.keyed_placeholder(number)
+            existing = self.placeholder_values.setdefault(placeholder, number)
+            if existing != number:
+                raise ValueError(f"占位符冲突：{existing} 和 {number} 生成了相同的占位符 {placeholder}，请增大占位符长度")
+            self.fixed_placeholders[number] = placeholder
+            return placeholder
+        self.values.append(number)
+        index = self.number_ids[number] = len(self.values)
+        return f"￥{index}￥"
+
+    def placeholder_items(self):
+        """按分配顺序逐个产出(占位符, 原始数字)：先顺序占位符，再确定性占位符"""
+        for index, number in enumerate(self.values, 1):
+            yield f"￥{index}￥", number
+        yield from self.placeholder_values.items()
+
+    def keyed_placeholder(self, number: str) -> str:
+        """根据密钥生成确定性占位符（HMAC-SHA256的base32编码前缀）"""
+        digest = hmac.new(self.placeholder_key, number.encode('utf-8'), hashlib.sha256).digest()
+        token = base64.b32encode(digest).decode('ascii').lower()[:self.placeholder_length]
+        return f"￥{token}￥"
     
     def desensitize_content(self, content: str) -> str:
         """对内容进行脱敏处理"""
-        # 提取所有数字
+        # 提取所有数字（已按位置排序）
         numbers = self.extract_numbers(content)
-        
-        # 按位置从后往前排序，避免位置偏移
-        numbers.sort(key=lambda x: x[1], reverse=True)
-        
-        # 执行替换
-        result = content
+        return self._apply_numbers(content, numbers)
+
+    def desensitize_fragment(self, text: str) -> str:
+        """对结构化格式中的值片段脱敏（CSV单元格、JSON字符串、HTML文本节点、代码中的字符串和注释等）
+
+        片段不是Markdown中的一行，开头的数字不会被当作标题或行首编号保留。
+        """
+        return self._apply_numbers(text, self.extract_numbers(text, fragment=True))
+
+    def _apply_numbers(self, content: str, numbers: List[Tuple[str, int, int]]) -> str:
+        """按位置从前往后替换数字，占位符按首次出现的顺序分配"""
+        parts = []
+        pos = 0
         for number, start, end in numbers:
-            placeholder = self.add_to_mapping(number)
-            result = result[:start] + placeholder + result[end:]
-            
-        return result
+            parts.append(content[pos:start])
+            parts.append(self.add_to_mapping(number))
+            pos = end
+        parts.append(content[pos:])
+        return ''.join(parts)
+
+    def desensitize_line(self, line: str) -> str:
+        """对单行内容进行脱敏，完全相同的行直接复用缓存的数字位置，跳过正则匹配"""
+        if self.line_cache_size <= 0:
+            return self.desensitize_content(line)
+
+        numbers = self.line_cache.get(line)
+        if numbers is None:
+            self.line_cache_misses += 1
+            numbers = tuple(self.extract_numbers(line))
+            self.line_cache[line] = numbers
+            if len(self.line_cache) > self.line_cache_size:
+                self.line_cache.popitem(last=False)
+        else:
+            self.line_cache_hits += 1
+            self.line_cache.move_to_end(line)
+        return self._apply_numbers(line, numbers)
+
+    def desensitize_lines(self, lines):
+        """逐行脱敏的生成器，输入和输出的每一行都保留各自的换行符
+
+        数字规则都在单行内判断，逐行结果与整段脱敏一致；
+        围栏代码块等跨行结构由块分类器记录状态。
+        """
+        classifier = MarkdownBlockClassifier() if self.skipped_kinds else None
+        for line in lines:
+            if classifier is not None and classifier.classify(line.rstrip('\n')).kind in self.skipped_kinds:
+                yield line
+            else:
+                yield self.desensitize_line(line)
+
+    def line_cache_info(self) -> Dict[str, float]:
+        """返回行缓存的命中统计"""
+        total = self.line_cache_hits + self.line_cache_misses
+        return {
+            'hits': self.line_cache_hits,
+            'misses': self.line_cache_misses,
+            'size': len(self.line_cache),
+            'max_size': self.line_cache_size,
+            'hit_rate': self.line_cache_hits / total if total else 0.0,
+        }
     
     def save_mapping(self, mapping_file_path: str):
-        """保存映射关系到JSON文件"""
-        # 创建反向映射（占位符->原始数字）
-        reverse_mapping = {v: k for k, v in self.number_mapping.items()}
-        
+        """保存映射关系（占位符->原始数字）到JSON文件，逐项写出，不另建反向字典"""
         with open(mapping_file_path, 'w', encoding='utf-8') as f:
-            json.dump(reverse_mapping, f, ensure_ascii=False, indent=2)
+            _write_mapping_json(f, self.placeholder_items())
             
-    def load_mapping(self, mapping_file_path: str) -> Dict[str, str]:
-        """从JSON文件加载映射关系"""
+    def load_mapping(self, mapping_file_path: str) -> RestoreTable:
+        """从JSON文件加载映射关系（占位符->原始数字），用于还原"""
         if not os.path.exists(mapping_file_path):
-            return {}
+            return RestoreTable()
             
         with open(mapping_file_path, 'r', encoding='utf-8') as f:
-            reverse_mapping = json.load(f)
-            
-        # 返回原始的反向映射（占位符->原始数字），用于还原
-        return reverse_mapping
+            # 解析时直接构建按序号存放的还原表，不保留中间字典
+            return json.load(f, object_pairs_hook=RestoreTable)
         
     def restore_content(self, content: str, mapping: Dict[str, str]) -> str:
-        """根据映射关系还原内容"""
-        result = content
-        
-        for placeholder, number in mapping.items():
-            result = result.replace(placeholder, number)
-        
-        return result
+        """根据映射关系还原内容（单遍替换，耗时与映射大小无关）"""
+        return substitute_placeholders(content, mapping)
 
 
-def desensitize_text_file(file_path: str, output_path=None):
-    """对通用文本文件进行脱敏处理"""
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"文件 {file_path} 不存在")
-        
-    if output_path is None:
-        base_name = os.path.splitext(file_path)[0]
-        ext = os.path.splitext(file_path)[1]
-        output_path = f"{base_name}_desensitized{ext}"
-        
-    # 生成映射文件路径
-    mapping_file_path = f"{os.path.splitext(output_path)[0]}_map.json"
+class ThreadSafeTextDesensitizer(TextDesensitizer):
+    """可在多个线程间共享的脱敏器（如Streamlit各会话或多线程服务共用一个实例和映射关系）
 
-    # 创建脱敏器实例
-    desensitizer = TextDesensitizer()
-    
-    # 读取文件内容
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-    except UnicodeDecodeError:
-        # 尝试其他编码
-        with open(file_path, 'r', encoding='gbk') as f:
-            content = f.read()
+    已有数字的占位符查找不加锁；新数字按哈希分到若干把锁之一，在锁内再次检查后分配占位符，
+    同一数字只会分配一次，序号计数器另用一把锁保护。行缓存的读写也加锁，正则匹配在锁外进行。
+    多线程同时处理时占位符序号按实际分配的先后顺序，不再等同于某个文件中首次出现的顺序。
+    """
 
-    # 执行脱敏
-    desensitized_content = desensitizer.desensitize_content(content)
-    
-    # 保存脱敏后的内容
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(desensitized_content)
-        
-    # 保存映射关系
-    desensitizer.save_mapping(mapping_file_path)
-    
-    print(f"脱敏完成！")
-    print(f"结果已保存至: {output_path}")
-    print(f"映射关系已保存至: {mapping_file_path}")
-    print(f"共脱敏 {len(desensitizer.number_mapping)} 个数字")
+    __slots__ = ('_mapping_locks', '_counter_lock', '_line_cache_lock')
 
+    def __init__(self, *args, lock_stripes: int = 64, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._mapping_locks = [threading.Lock() for _ in range(lock_stripes)]
+        self._counter_lock = threading.Lock()
+        self._line_cache_lock = threading.Lock()
 
-def restore_text_file(file_path: str, mapping_file_path: str, output_path=None):
-    """根据映射文件还原文本文件"""
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"文件 {file_path} 不存在")
-        
-    if not os.path.exists(mapping_file_path):
-        raise FileNotFoundError(f"映射文件 {mapping_file_path} 不存在")
-        
-    if output_path is None:
-        base_name = os.path.splitext(file_path)[0]
-        ext = os.path.splitext(file_path)[1]
-        output_path = f"{base_name}_restored{ext}"
+    def add_to_mapping(self, number: str) -> str:
+        """将数字添加到映射中，返回占位符（检查和分配是原子的）"""
+        index = self.number_ids.get(number)
+        if index is not None:
+            return f"￥{index}￥"
+        placeholder = self.fixed_placeholders.get(number)
+        if placeholder is not None:
+            return placeholder
+        if self.allowlist is not None and number in self.allowlist:
+            return number
+        with self._mapping_locks[hash(number) % len(self._mapping_locks)]:
+            index = self.number_ids.get(number)
+            if index is not None:
+                return f"￥{index}￥"
+            placeholder = self.fixed_placeholders.get(number)
+            if placeholder is not None:
+                return placeholder
+            return self._allocate_placeholder(number)
 
-    # 创建脱敏器实例
-    desensitizer = TextDesensitizer()
-    
-    # 加载映射关系
-    mapping = desensitizer.load_mapping(mapping_file_path)
-    
-    # 读取脱敏后的内容
+    def _allocate_placeholder(self, number: str) -> str:
+        """为新数字分配占位符，顺序序号在计数器锁内取得"""
+        if self.placeholder_key is not None:
+            return super()._allocate_placeholder(number)
+        with self._counter_lock:
+            self.values.append(number)
+            index = len(self.values)
+        self.number_ids[number] = index
+        return f"￥{index}￥"
+
+    def desensitize_line(self, line: str) -> str:
+        """对单行内容进行脱敏，行缓存的读写加锁，缓存未命中时的匹配在锁外进行"""
+        if self.line_cache_size <= 0:
+            return self.desensitize_content(line)
+
+        with self._line_cache_lock:
+            numbers = self.line_cache.get(line)
+            if numbers is not None:
+                self.line_cache_hits += 1
+                self.line_cache.move_to_end(line)
+        if numbers is None:
+            numbers = tuple(self.extract_numbers(line))
+            with self._line_cache_lock:
+                self.line_cache_misses += 1
+                self.line_cache[line] = numbers
+                if len(self.line_cache) > self.line_cache_size:
+                    self.line_cache.popitem(last=False)
+        return self._apply_numbers(line, numbers)
+
+    def placeholder_items(self):
+        """逐个产出映射关系快照中的(占位符, 原始数字)（其他线程可继续分配占位符）"""
+        # 列表和字典的copy在C层完成，不会因其他线程插入而报“迭代时大小改变”
+        values = self.values.copy()
+        fixed = self.placeholder_values.copy()
+        for index, number in enumerate(values, 1):
+            yield f"￥{index}￥", number
+        yield from fixed.items()
+
+
+# CSV模式：整列保留的编号类列名（如 id、user_id、工号、编号）
+CSV_ID_COLUMN_PATTERN = re.compile(r'(?i:(?:^|[_\s-])(?:id|code)$)|(?<=[a-z])Id$|编号|工号|学号|序号|代码|编码')
+# CSV模式：整列保留的日期类列名（按完整词匹配，避免candidate、runtime等列名误判）
+CSV_DATE_COLUMN_PATTERN = re.compile(
+    r'(?i:(?:^|[_\s-])(?:date|time|datetime|timestamp)(?:[_\s-]|$))'
+    r'|(?<=[a-z])(?:Date|Time|Timestamp)(?=[A-Z_\s-]|$)'
+    r'|(?i:[_\s-]at$)|(?<=[a-z])At$|日期|时间')
+# CSV模式：单元格是否为纯数值（允许正负号和首尾空白）
+CSV_NUMERIC_PATTERN = re.compile(r'(\s*[+-]?)(\d+(?:\.\d+)?)(\s*)')
+# CSV模式：单元格是否为日期值
+CSV_DATE_VALUE_PATTERN = re.compile(r'\s*(?:\d{4}[-/]\d{1,2}[-/]\d{1,2}(?:[ T]\d{1,2}:\d{2}(?::\d{2})?)?|\d{1,2}/\d{1,2}/\d{4})\s*')
+DIGIT_PATTERN = re.compile(r'\d')
+# CSV模式：带引号的字段（""为转义的引号，引号内可以换行）
+CSV_QUOTED_FIELD_PATTERN = re.compile(r'"(?:[^"]|"")*"')
+
+
+# 透明读写的压缩格式：后缀 -> 打开函数（标准库）
+COMPRESSION_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+
+def _compression_suffix(file_path: str) -> Optional[str]:
+    """返回压缩文件的后缀（如.gz），未压缩时返回None"""
+    suffix = os.path.splitext(file_path)[1].lower()
+    return suffix if suffix in COMPRESSION_OPENERS else None
+
+
+def _strip_compression(file_path: str) -> str:
+    """去掉压缩后缀，如 app.log.gz -> app.log，用于按扩展名识别文件类型"""
+    return file_path[:-len(_compression_suffix(file_path))] if _compression_suffix(file_path) else file_path
+
+
+def _is_supported_file(filename: str) -> bool:
+    """是否为批量处理时识别的文本文件（包括压缩后的文本文件，如 .log.gz）"""
+    return _strip_compression(filename).lower().endswith(SUPPORTED_EXTENSIONS)
+
+
+def open_compressed(file_path: str, mode: str = 'r', **kwargs):
+    """打开文件，.gz/.bz2/.xz文件透明地解压读取或压缩写入，其他文件与open相同"""
+    suffix = _compression_suffix(file_path)
+    if suffix is None:
+        return open(file_path, mode, **kwargs)
+    # 压缩文件的打开函数默认是二进制模式
+    if 'b' not in mode and 't' not in mode:
+        mode += 't'
+    return COMPRESSION_OPENERS[suffix](file_path, mode, **kwargs)
+
+
+def _detect_encoding(file_path: str, sample_size: int = 65536) -> str:
+    """探测文件编码（优先utf-8，失败时回退gbk），压缩文件按解压后的内容探测"""
+    with open_compressed(file_path, 'rb') as f:
+        return _sample_encoding(f.read(sample_size))
+
+
+def _sample_encoding(sample: bytes) -> str:
+    """根据开头的字节样本探测编码（优先utf-8，失败时回退gbk）"""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        # 采样可能截断在多字节字符中间，使用增量解码器忽略末尾不完整字符
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
     except UnicodeDecodeError:
-        # 尝试其他编码
-        with open(file_path, 'r', encoding='gbk') as f:
-            content = f.read()
+        return 'gbk'
 
-    # 执行还原
-    restored_content = desensitizer.restore_content(content, mapping)
-    
-    # 保存还原后的内容
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(restored_content)
-        
-    print(f"还原完成！")
-    print(f"结果已保存至: {output_path}")
 
+def _classify_csv_columns(header: List[str], sample: List[List[str]],
+                          include_columns=None, exclude_columns=None) -> List[str]:
+    """根据表头和采样行判断每一列的处理方式：numeric（整列数值）、text（按文本处理）、keep（原样保留）"""
+    include = set(include_columns or [])
+    exclude = set(exclude_columns or [])
+    width = max([len(header)] + [len(row) for row in sample])
+    kinds = []
+    for index in range(width):
+        name = header[index].strip() if index < len(header) else ''
+        values = [row[index] for row in sample if index < len(row) and row[index].strip()]
+        all_numeric = bool(values) and all(CSV_NUMERIC_PATTERN.fullmatch(v) for v in values)
 
-def process_directory(input_dir: str, output_dir=None):
-    """处理目录中的所有文本文件"""
+        if name in exclude or (include and name not in include):
+            kinds.append('keep')
+        elif name in include:
+            # 显式指定的列不做编号/日期列的自动识别
+            kinds.append('numeric' if all_numeric else 'text')
+        elif CSV_ID_COLUMN_PATTERN.search(name) or CSV_DATE_COLUMN_PATTERN.search(name):
+            kinds.append('keep')
+        elif values and all(CSV_DATE_VALUE_PATTERN.fullmatch(v) for v in values):
+            kinds.append('keep')
+        elif all_numeric:
+            kinds.append('numeric')
+        else:
+            kinds.append('text')
+    return kinds
+
+
+def _iter_csv_raw_rows(lines, delimiter: str):
+    """将CSV按记录切分为原始字段文本，返回(字段列表, 行尾换行符)
+
+    字段保留原有的引号和转义，输出时按原样拼接即可逐字节还原；
+    引号内的换行会继续读取后续行，直到引号闭合。
+    """
+    lines = iter(lines)
+    for line in lines:
+        fields = []
+        pos = 0
+        while True:
+            end = pos
+            if line.startswith('"', pos):
+                match = CSV_QUOTED_FIELD_PATTERN.match(line, pos)
+                while match is None:
+                    extra = next(lines, None)
+                    if extra is None:
+                        break
+                    line += extra
+                    match = CSV_QUOTED_FIELD_PATTERN.match(line, pos)
+                if match:
+                    end = match.end()
+            body_end = len(line.rstrip('\r\n'))
+            if end > body_end:
+                # 引号未闭合直到文件结尾
+                body_end = len(line)
+            index = line.find(delimiter, end, body_end)
+            if index < 0:
+                fields.append(line[pos:body_end])
+                yield fields, line[body_end:]
+                break
+            fields.append(line[pos:index])
+            pos = index + len(delimiter)
+
+
+def _split_csv_field(raw: str):
+    """拆分原始字段为(前缀, 值, 后缀)：规范的引号字段去掉引号并反转义，其他字段原样作为值"""
+    if len(raw) >= 2 and raw[0] == '"' and raw[-1] == '"' and '"' not in raw[1:-1].replace('""', ''):
+        return '"', raw[1:-1].replace('""', '"'), '"'
+    return '', raw, ''
+
+
+def desensitize_csv_stream(desensitizer: 'TextDesensitizer', src, dst, include_columns=None,
+                           exclude_columns=None, sample_rows: int = 100, **_options):
+    """按列对CSV进行流式脱敏（src需以newline=''打开）
+
+    先读取少量采样行识别数值列、编号列和日期列，之后逐行处理：
+    数值列直接整格替换为占位符，不再执行正则规则；编号列和日期列原样保留；
+    其他列仅在包含数字时交给通用文本规则处理。
+    字段的引号和换行符保持原样；用csv.Sniffer判断首行是否为表头，无表头时首行也按数据处理。
+    """
+    head_lines = list(islice(src, 20))
+    if not head_lines:
+        return
+    head_text = ''.join(head_lines)
+    sniffer = csv.Sniffer()
+    try:
+        delimiter = sniffer.sniff(head_text, delimiters=',;\t|').delimiter
+    except csv.Error:
+        delimiter = ','
+
+    rows = _iter_csv_raw_rows(chain(head_lines, src), delimiter)
+    first = next(rows, None)
+    if first is None:
+        return
+    first_values = [_split_csv_field(raw)[1] for raw in first[0]]
+    try:
+        has_header = sniffer.has_header(head_text)
+    except csv.Error:
+        # 无法判断时，首行不含纯数值单元格才视为表头
+        has_header = not any(CSV_NUMERIC_PATTERN.fullmatch(value) for value in first_values)
+
+    if has_header:
+        header = first_values
+        sample = list(islice(rows, sample_rows))
+    else:
+        header = []
+        sample = [first] + list(islice(rows, sample_rows - 1))
+    kinds = _classify_csv_columns(header, [[_split_csv_field(raw)[1] for raw in fields] for fields, _ in sample],
+                                  include_columns, exclude_columns)
+
+    def convert(index: int, raw: str) -> str:
+        kind = kinds[index] if index < len(kinds) else 'text'
+        if kind == 'keep' or not DIGIT_PATTERN.search(raw):
+            return raw
+        prefix, cell, suffix = _split_csv_field(raw)
+        if kind == 'numeric':
+            match = CSV_NUMERIC_PATTERN.fullmatch(cell)
+            if match:
+                cell = match.group(1) + desensitizer.add_to_mapping(match.group(2)) + match.group(3)
+            else:
+                cell = desensitizer.desensitize_fragment(cell)
+        else:
+            cell = desensitizer.desensitize_fragment(cell)
+        if prefix:
+            cell = cell.replace('"', '""')
+        return prefix + cell + suffix
+
+    if has_header:
+        fields, ending = first
+        dst.write(delimiter.join(fields) + ending)
+    for fields, ending in chain(sample, rows):
+        dst.write(delimiter.join([convert(index, raw) for index, raw in enumerate(fields)]) + ending)
+
+
+# JSON模式：词法单元（空白、字符串、数字、标点、字面量）
+JSON_TOKEN_PATTERN = re.compile(r'''
+    (?P<ws>\s+)
+    |(?P<string>"[^"\\]*(?:\\.[^"\\]*)*")
+    |(?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+    |(?P<punct>[{}\[\]:,])
+    |(?P<literal>true|false|null)
+''', re.VERBOSE)
+# JSON字符串中的转义序列（其中的数字不能被脱敏）
+JSON_ESCAPE_PATTERN = re.compile(r'\\(?:u[0-9a-fA-F]{4}|.)')
+# 纯数值（可带负号），用于跳过正则规则直接替换
+PLAIN_NUMBER_PATTERN = re.compile(r'(-?)(\d+(?:\.\d+)?)')
+
+
+def _desensitize_escaped(desensitizer: 'TextDesensitizer', text: str, escape_pattern) -> str:
+    """对含转义序列的字符串内容按值片段脱敏，转义序列本身保持不变"""
+    parts = []
+    pos = 0
+    for match in escape_pattern.finditer(text):
+        parts.append(desensitizer.desensitize_fragment(text[pos:match.start()]))
+        parts.append(match.group())
+        pos = match.end()
+    parts.append(desensitizer.desensitize_fragment(text[pos:]))
+    return ''.join(parts)
+
+
+def _match_key_path(path: str, rules) -> bool:
+    """判断键路径是否命中规则（支持通配符，规则命中父路径时子路径同样命中）"""
+    for rule in rules:
+        if fnmatch.fnmatchcase(path, rule) or path.startswith(rule + '.'):
+            return True
+    return False
+
+
+def _iter_json_tokens(src, chunk_size: int = 65536):
+    """增量读取JSON文本并逐个产出(类型, 原文)词法单元，不加载整个文档"""
+    return _iter_lexer_tokens(src, JSON_TOKEN_PATTERN, chunk_size, 'JSON')
+
+
+def _iter_lexer_tokens(src, pattern, chunk_size: int = 65536, label: str = '', incomplete=None,
+                       lookahead: int = 256):
+    """按正则增量切分词法单元
+
+    pattern可为函数，每个单元之前调用以按上下文选择正则；incomplete(match)返回True
+    表示该单元可能因缓冲区截断而识别错误（如未闭合的字符串），需要读取更多内容后重试。
+    """
+    buf = src.read(chunk_size)
+    eof = not buf
+    pos = 0
+    while True:
+        match = (pattern() if callable(pattern) else pattern).match(buf, pos)
+        if match is None or not eof and (len(buf) - match.end() < lookahead
+                                         or incomplete is not None and incomplete(match)):
+            # 词法单元可能被截断在缓冲区末尾，继续读取
+            if eof:
+                if pos < len(buf):
+                    raise ValueError(f"{label}格式错误，无法解析: {buf[pos:pos + 50]!r}")
+                return
+            # 超长字符串跨越多个分块时按缓冲区大小成倍读取，避免反复扫描
+            more = src.read(max(chunk_size, len(buf) - pos))
+            eof = not more
+            buf = buf[pos:] + more
+            pos = 0
+            continue
+        yield match.lastgroup, match.group()
+        pos = match.end()
+
+
+def desensitize_json_stream(desensitizer: 'TextDesensitizer', src, dst, include_keys=None,
+                            exclude_keys=None, **_options):
+    """按JSON结构流式脱敏（同样适用于每行一个JSON的NDJSON）
+
+    只处理数值和字符串值，键名和标点原样输出。键路径用点号连接（数组层级不计入），
+    include_keys/exclude_keys支持通配符，如 users.phone、*.id。
+    """
+    include = list(include_keys or [])
+    exclude = list(exclude_keys or [])
+    selected_cache = {}
+
+    def is_selected(path: str) -> bool:
+        if path not in selected_cache:
+            selected_cache[path] = not _match_key_path(path, exclude) and (
+                not include or _match_key_path(path, include))
+        return selected_cache[path]
+
+    # 每层容器: [是否为对象, 容器路径, 当前值路径, 是否等待键名]
+    stack = []
+    out = []
+    for kind, text in _iter_json_tokens(src):
+        top = stack[-1] if stack else None
+        if kind == 'punct':
+            value_path = '' if top is None else top[2]
+            if text == '{':
+                stack.append([True, value_path, value_path, True])
+            elif text == '[':
+                stack.append([False, value_path, value_path, False])
+            elif text in '}]':
+                if stack:
+                    stack.pop()
+            elif text == ',' and top is not None and top[0]:
+                top[3] = True
+        elif kind == 'string' and top is not None and top[0] and top[3]:
+            # 对象的键名：记录路径，原样输出
+            key = json.loads(text)
+            top[2] = f"{top[1]}.{key}" if top[1] else key
+            top[3] = False
+        elif kind in ('string', 'number') and DIGIT_PATTERN.search(text):
+            if is_selected('' if top is None else top[2]):
+                if kind == 'number':
+                    match = PLAIN_NUMBER_PATTERN.fullmatch(text)
+                    if match:
+                        text = match.group(1) + desensitizer.add_to_mapping(match.group(2))
+                    else:
+                        text = desensitizer.desensitize_fragment(text)
+                else:
+                    text = '"' + _desensitize_escaped(desensitizer, text[1:-1], JSON_ESCAPE_PATTERN) + '"'
+        out.append(text)
+        if len(out) >= 4096:
+            dst.write(''.join(out))
+            out = []
+    dst.write(''.join(out))
+
+
+# HTML/XML模式：标签中的属性（属性名、等号、取值）
+MARKUP_ATTRIBUTE_PATTERN = re.compile(r'''([^\s/>"'=]+)(\s*=\s*)("[^"]*"|'[^']*'|[^\s"'>]+)''')
+# HTML/XML模式：属性值中的字符引用和实体引用（其中的数字不能被脱敏）
+MARKUP_REFERENCE_PATTERN = re.compile(r'&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);?')
+
+
+class _MarkupTextParser(HTMLParser):
+    """只对文本节点（及白名单属性值）脱敏、其余标记原样输出的增量解析器
+
+    HTMLParser每消费一段原始输入都会调用updatepos(i, j)，借此取得该段的原文：
+    文本节点和CDATA段交给脱敏器处理，标签、注释、实体引用、script/style内容等原样写出。
+    updatepos是标准库未公开的内部接口：consumed记录各段长度之和，
+    desensitize_markup_stream据此校验输入被完整、不重复地输出，标准库行为变化时报错而不是静默丢失内容。
+    """
+
+    def __init__(self, desensitizer: 'TextDesensitizer', attributes=None):
+        super().__init__(convert_charrefs=False)
+        self.desensitizer = desensitizer
+        self.attributes = {name.lower() for name in (attributes or [])}
+        self.output = []
+        self.consumed = 0
+        self._pending_text = False
+        self._pending_tag = False
+        self._pending_cdata = False
+
+    def handle_data(self, data):
+        # script/style内容不是文本节点
+        self._pending_text = not self.cdata_elem
+
+    def handle_starttag(self, tag, attrs):
+        self._pending_tag = bool(self.attributes) and any(name in self.attributes for name, _ in attrs)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def parse_html_declaration(self, i):
+        # CDATA段自行解析：不同Python版本的HTMLParser对HTML中的CDATA处理不同（声明或伪注释）
+        if self.rawdata.startswith('<![CDATA[', i):
+            j = self.rawdata.find(']]>', i + 9)
+            if j < 0:
+                return -1
+            self._pending_cdata = True
+            return j + 3
+        return super().parse_html_declaration(i)
+
+    def updatepos(self, i, j):
+        if i < j:
+            raw = self.rawdata[i:j]
+            if self._pending_text and DIGIT_PATTERN.search(raw):
+                raw = self.desensitizer.desensitize_fragment(raw)
+            elif self._pending_cdata and DIGIT_PATTERN.search(raw):
+                raw = raw[:9] + self.desensitizer.desensitize_fragment(raw[9:-3]) + raw[-3:]
+            elif self._pending_tag:
+                raw = MARKUP_ATTRIBUTE_PATTERN.sub(self._replace_attribute, raw)
+            self.output.append(raw)
+            self.consumed += j - i
+        self._pending_text = False
+        self._pending_tag = False
+        self._pending_cdata = False
+        return super().updatepos(i, j)
+
+    def _replace_attribute(self, match) -> str:
+        name, equals, value = match.groups()
+        if name.lower() not in self.attributes or not DIGIT_PATTERN.search(value):
+            return match.group()
+        if value[0] in '"\'':
+            value = value[0] + _desensitize_escaped(self.desensitizer, value[1:-1], MARKUP_REFERENCE_PATTERN) + value[-1]
+        else:
+            value = _desensitize_escaped(self.desensitizer, value, MARKUP_REFERENCE_PATTERN)
+        return name + equals + value
+
+
+def desensitize_markup_stream(desensitizer: 'TextDesensitizer', src, dst, attributes=None,
+                              chunk_size: int = 65536, **_options):
+    """对HTML/XML流式脱敏：只处理文本节点和白名单中的属性值，标记原样输出
+
+    每次只把缓冲区中最后一个"<"或换行之前的部分交给解析器，
+    保证文本节点不会在读取分块的边界处被截断。
+    """
+    parser = _MarkupTextParser(desensitizer, attributes)
+    pending = ''
+    total = 0
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        pending += chunk
+        cut = max(pending.rfind('<'), pending.rfind('\n') + 1)
+        if cut > 0:
+            parser.feed(pending[:cut])
+            pending = pending[cut:]
+            dst.write(''.join(parser.output))
+            parser.output = []
+    parser.feed(pending)
+    parser.close()
+    if parser.consumed + len(parser.rawdata) != total:
+        raise RuntimeError("HTMLParser报告的解析位置与输入不一致（标准库实现可能已变化），无法保证原样输出")
+    # 未闭合的script/style等内容解析器不会消费，原样输出
+    parser.output.append(parser.rawdata)
+    dst.write(''.join(parser.output))
+
+
+# 源代码模式：可选的处理对象（数值字面量、字符串字面量、注释）
+CODE_TARGETS = ('numbers', 'strings', 'comments')
+# Python字符串字面量：前缀、引号、内容
+PYTHON_STRING_PATTERN = re.compile(r'''([A-Za-z]*)(\'\'\'|"""|'|")(.*)\2\Z''', re.S)
+# Python字符串中的转义序列（其中的数字不能被脱敏）
+PYTHON_ESCAPE_PATTERN = re.compile(r'\\(?:N\{[^}]*\}|x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|[0-7]{1,3}|[\s\S])')
+# f-string中的转义序列、花括号转义和替换字段（替换字段是代码，不能被脱敏）
+PYTHON_FSTRING_ESCAPE_PATTERN = re.compile(PYTHON_ESCAPE_PATTERN.pattern + r'|\{\{|\}\}|\{[^{}]*\}')
+# JavaScript/TypeScript词法单元；正则字面量只在允许出现的位置匹配（见_script_token_pattern）
+_SCRIPT_TOKEN_SOURCE = r'''(?P<ws>\s+)
+    |(?P<comment>//[^\r\n]*|/\*[\s\S]*?\*/)
+    |(?P<string>'(?:[^'\\\r\n]|\\[\s\S])*'|"(?:[^"\\\r\n]|\\[\s\S])*")
+    |(?P<template>`(?:[^`\\]|\\[\s\S])*`)
+    |(?P<number>0[xXbBoO][0-9a-fA-F_]+n?|(?:\d[\d_]*(?:\.[\d_]*)?|\.\d[\d_]*)(?:[eE][+-]?\d+)?n?)
+    |(?P<name>(?:[^\W\d]|\$)(?:\w|\$)*)
+    %s
+    |(?P<punct>[\s\S])'''
+SCRIPT_TOKEN_PATTERN = re.compile(_SCRIPT_TOKEN_SOURCE % '', re.X)
+SCRIPT_REGEX_TOKEN_PATTERN = re.compile(
+    _SCRIPT_TOKEN_SOURCE % r'|(?P<regex>/(?![*/])(?:[^/\\\r\n\[]|\\.|\[(?:[^\]\\\r\n]|\\.)*\])+/[A-Za-z]*)', re.X)
+# JavaScript字符串中的转义序列
+SCRIPT_ESCAPE_PATTERN = re.compile(r'\\(?:x[0-9a-fA-F]{2}|u\{[0-9a-fA-F]+\}|u[0-9a-fA-F]{4}|[\s\S])')
+# 模板字符串中的转义序列和${}表达式
+SCRIPT_TEMPLATE_ESCAPE_PATTERN = re.compile(SCRIPT_ESCAPE_PATTERN.pattern + r'|\$\{[^}]*\}')
+# 其后出现"/"时应按正则字面量（而非除号）解析的关键字
+SCRIPT_REGEX_KEYWORDS = {'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void', 'throw',
+                         'case', 'do', 'else', 'yield', 'await'}
+
+
+def _parse_code_targets(code_targets) -> set:
+    """解析源代码模式的处理对象，默认处理数值、字符串和注释"""
+    targets = set(CODE_TARGETS if code_targets is None else code_targets)
+    unknown = targets - set(CODE_TARGETS)
+    if unknown:
+        raise ValueError(f"不支持的处理对象: {', '.join(sorted(unknown))}（可选: {', '.join(CODE_TARGETS)}）")
+    return targets
+
+
+def _desensitize_number_literal(desensitizer: 'TextDesensitizer', text: str) -> str:
+    """只替换普通十进制数值字面量，十六进制、科学计数法、带下划线等写法保持原样"""
+    if PLAIN_NUMBER_PATTERN.fullmatch(text):
+        return desensitizer.add_to_mapping(text)
+    return text
+
+
+def _python_source_slice(lines: Dict[int, str], start, end) -> str:
+    """按tokenize的(行, 列)位置从已读取的源代码行中截取原文"""
+    (start_row, start_col), (end_row, end_col) = start, end
+    if (start_row, start_col) >= (end_row, end_col):
+        return ''
+    if start_row == end_row:
+        return lines.get(start_row, '')[start_col:end_col]
+    middle = ''.join(lines.get(row, '') for row in range(start_row + 1, end_row))
+    return lines.get(start_row, '')[start_col:] + middle + lines.get(end_row, '')[:end_col]
+
+
+def desensitize_python_stream(desensitizer: 'TextDesensitizer', src, dst, code_targets=None, **_options):
+    """基于tokenize逐个词法单元处理Python源代码，只脱敏数值、字符串和注释，其余代码原样输出"""
+    targets = _parse_code_targets(code_targets)
+    fstring_middle = getattr(tokenize, 'FSTRING_MIDDLE', None)
+    fstring_start = getattr(tokenize, 'FSTRING_START', None)
+    fstring_end = getattr(tokenize, 'FSTRING_END', None)
+    # 已读取的源代码行（行号 -> 原文），输出位置之前的行会被释放
+    lines = {}
+    dropped = [0]
+
+    def readline():
+        line = src.readline()
+        lines[len(lines) + dropped[0] + 1] = line
+        return line
+
+    # f-string嵌套时每层的花括号深度，深度为0时FSTRING_MIDDLE才是字面文本（3.12+）
+    fstring_depth = []
+    prev_end = (1, 0)
+    out = []
+    try:
+        for token in tokenize.generate_tokens(readline):
+            start = max(token.start, prev_end)
+            end = max(token.end, start)
+            out.append(_python_source_slice(lines, prev_end, start))
+            text = _python_source_slice(lines, start, end)
+            kind = token.type
+            if kind == tokenize.NUMBER and 'numbers' in targets:
+                text = _desensitize_number_literal(desensitizer, text)
+            elif kind == tokenize.STRING and 'strings' in targets and DIGIT_PATTERN.search(text):
+                match = PYTHON_STRING_PATTERN.match(text)
+                # bytes字面量只能包含ASCII字符，不能写入占位符
+                if match and 'b' not in match.group(1).lower():
+                    pattern = PYTHON_FSTRING_ESCAPE_PATTERN if 'f' in match.group(1).lower() else PYTHON_ESCAPE_PATTERN
+                    text = (match.group(1) + match.group(2) + _desensitize_escaped(desensitizer, match.group(3), pattern)
+                            + match.group(2))
+            elif kind == tokenize.COMMENT and 'comments' in targets and not (start == (1, 0) and text.startswith('#!')):
+                # 首行的shebang保持原样
+                text = desensitizer.desensitize_fragment(text)
+            elif kind == fstring_start:
+                fstring_depth.append(0)
+            elif kind == fstring_end and fstring_depth:
+                fstring_depth.pop()
+            elif kind == tokenize.OP and fstring_depth and text in ('{', '}'):
+                fstring_depth[-1] += 1 if text == '{' else -1
+            elif kind == fstring_middle and 'strings' in targets and fstring_depth and fstring_depth[-1] == 0:
+                text = _desensitize_escaped(desensitizer, text, PYTHON_FSTRING_ESCAPE_PATTERN)
+            out.append(text)
+            prev_end = end
+            # 释放已输出的行
+            while dropped[0] + 1 < prev_end[0]:
+                dropped[0] += 1
+                lines.pop(dropped[0], None)
+            if len(out) >= 4096:
+                dst.write(''.join(out))
+                out = []
+    except (tokenize.TokenError, SyntaxError) as e:
+        # 无法继续解析（如缩进错误、未闭合的括号），其余内容原样输出
+        print(f"警告：Python源代码解析失败，第{prev_end[0]}行之后的内容保持原样: {e}")
+        last_row = max(lines) if lines else prev_end[0]
+        out.append(_python_source_slice(lines, prev_end, (last_row + 1, 0)))
+        out.append(src.read())
+    dst.write(''.join(out))
+
+
+def desensitize_script_stream(desensitizer: 'TextDesensitizer', src, dst, code_targets=None,
+                              chunk_size: int = 65536, **_options):
+    """用轻量词法分析器处理JavaScript/TypeScript源代码，只脱敏数值、字符串和注释"""
+    targets = _parse_code_targets(code_targets)
+    # 上一个有效词法单元决定"/"是除号还是正则字面量的开始
+    state = {'regex_allowed': True}
+
+    def token_pattern():
+        return SCRIPT_REGEX_TOKEN_PATTERN if state['regex_allowed'] else SCRIPT_TOKEN_PATTERN
+
+    def incomplete(match):
+        # 未闭合的字符串、正则（不能跨行）和块注释、模板字符串（可以跨行）会退化为单个标点
+        text = match.group()
+        if match.lastgroup != 'punct' or text not in '/\'"`':
+            return False
+        if text == '`' or match.string.startswith('*', match.end()):
+            return True
+        return match.string.find('\n', match.end()) < 0
+
+    out = []
+    for kind, text in _iter_lexer_tokens(src, token_pattern, chunk_size, 'JavaScript', incomplete):
+        if kind == 'number' and 'numbers' in targets:
+            text = _desensitize_number_literal(desensitizer, text)
+        elif kind == 'string' and 'strings' in targets and DIGIT_PATTERN.search(text):
+            text = text[0] + _desensitize_escaped(desensitizer, text[1:-1], SCRIPT_ESCAPE_PATTERN) + text[-1]
+        elif kind == 'template' and 'strings' in targets and DIGIT_PATTERN.search(text):
+            text = '`' + _desensitize_escaped(desensitizer, text[1:-1], SCRIPT_TEMPLATE_ESCAPE_PATTERN) + '`'
+        elif kind == 'comment' and 'comments' in targets:
+            text = desensitizer.desensitize_fragment(text)
+        if kind == 'name':
+            state['regex_allowed'] = text in SCRIPT_REGEX_KEYWORDS
+        elif kind == 'punct':
+            state['regex_allowed'] = text not in ')]'
+        elif kind not in ('ws', 'comment'):
+            state['regex_allowed'] = False
+        out.append(text)
+        if len(out) >= 4096:
+            dst.write(''.join(out))
+            out = []
+    dst.write(''.join(out))
+
+
+# SQL导出模式：词法单元（字符串同时支持反斜杠转义和''转义）
+SQL_TOKEN_PATTERN = re.compile(r'''(?P<ws>\s+)
+    |(?P<comment>--[^\n]*|\#[^\n]*|/\*[\s\S]*?\*/)
+    |(?P<string>'(?:[^'\\]|\\[\s\S]|'')*'|"(?:[^"\\]|\\[\s\S]|"")*")
+    |(?P<quoted>`(?:[^`]|``)*`|\[[^\]\r\n]*\])
+    |(?P<number>0[xX][0-9a-fA-F]+|(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+    |(?P<word>(?:[^\W\d]|\$)(?:\w|\$)*)
+    |(?P<punct>[\s\S])''', re.X)
+# SQL字符串中的转义序列
+SQL_ESCAPE_PATTERN = re.compile(r"\\[\s\S]|''|\"\"")
+# CREATE TABLE中不是列定义的子句
+SQL_CONSTRAINT_KEYWORDS = {'PRIMARY', 'KEY', 'UNIQUE', 'INDEX', 'CONSTRAINT', 'FOREIGN', 'FULLTEXT',
+                           'SPATIAL', 'CHECK', 'PERIOD'}
+
+
+def _sql_identifier(text: str) -> str:
+    """去掉标识符的引号（`name`、[name]、"name"），用于匹配列名和表名"""
+    if text[:1] in '`["' and len(text) >= 2:
+        text = text[1:-1]
+    return text.lower()
+
+
+def _sql_column_selected(index: int, name: Optional[str], include: set, exclude: set) -> bool:
+    """判断INSERT中第index列（从0开始）是否需要脱敏；列可以按列名或从1开始的序号指定"""
+    keys = {str(index + 1)}
+    if name:
+        keys.add(name)
+    if keys & exclude:
+        return False
+    if include:
+        return bool(keys & include)
+    # 未指定时与CSV模式一致：编号列和日期列保持原样
+    return not (name and (CSV_ID_COLUMN_PATTERN.search(name) or CSV_DATE_COLUMN_PATTERN.search(name)))
+
+
+def desensitize_sql_stream(desensitizer: 'TextDesensitizer', src, dst, include_columns=None,
+                           exclude_columns=None, chunk_size: int = 65536, **_options):
+    """流式处理SQL导出文件：只脱敏INSERT语句VALUES中的数值和字符串，DDL、标识符和注释原样输出
+
+    列名取自INSERT的列清单或此前CREATE TABLE的列定义，内存占用只与单条语句的状态有关。
+    """
+    include = {name.lower() for name in (include_columns or [])}
+    exclude = {name.lower() for name in (exclude_columns or [])}
+    # 表名 -> CREATE TABLE中定义的列名
+    table_columns = {}
+
+    def incomplete(match):
+        # 未闭合的字符串、标识符或块注释会退化为单个标点
+        text = match.group()
+        if match.lastgroup != 'punct':
+            return False
+        return text in '\'"`[' or (text == '/' and match.string.startswith('*', match.end()))
+
+    # 当前语句的状态
+    statement = None     # 'insert' / 'create' / 'create_table' / 'other'
+    depth = 0
+    table = None
+    expect_table = False
+    columns = []         # INSERT列清单或CREATE TABLE列定义
+    expect_column = False
+    in_values = False
+    column_index = 0
+    selected = []        # VALUES中各列是否需要脱敏（按需扩展）
+    previous = ''        # 上一个有效词法单元，用于识别X'..'等十六进制/二进制字符串
+    string_cache = {}
+    out = []
+    for kind, text in _iter_lexer_tokens(src, SQL_TOKEN_PATTERN, chunk_size, 'SQL', incomplete):
+        if kind in ('ws', 'comment'):
+            out.append(text)
+            continue
+
+        if kind == 'punct':
+            if text == ';' and depth == 0:
+                if statement == 'create_table' and table:
+                    table_columns[table] = columns
+                statement, table, expect_table, columns = None, None, False, []
+                expect_column = in_values = False
+            elif text == '(':
+                depth += 1
+                expect_table = False
+                if in_values and depth == 1:
+                    column_index = 0
+                expect_column = statement == 'create_table' and depth == 1
+            elif text == ')':
+                depth = max(depth - 1, 0)
+            elif text == ',' and depth == 1:
+                column_index += 1
+                expect_column = statement == 'create_table'
+        elif kind in ('word', 'quoted') and depth == 0:
+            word = text.upper()
+            if statement is None:
+                statement = {'INSERT': 'insert', 'REPLACE': 'insert', 'CREATE': 'create'}.get(word, 'other')
+            elif in_values:
+                # VALUES之后的ON DUPLICATE KEY UPDATE等子句不再处理
+                in_values = False
+                statement = 'other'
+            elif statement == 'insert' and word in ('VALUES', 'VALUE') and kind == 'word':
+                in_values = True
+                names = columns or table_columns.get(table, [])
+                selected = [_sql_column_selected(i, name, include, exclude) for i, name in enumerate(names)]
+            elif statement == 'insert' and word == 'INTO' and kind == 'word':
+                expect_table = True
+            elif statement == 'create' and word == 'TABLE' and kind == 'word':
+                statement = 'create_table'
+                expect_table = True
+            elif expect_table and word not in ('IF', 'NOT', 'EXISTS'):
+                table = _sql_identifier(text)
+        elif kind in ('word', 'quoted') and depth == 1 and not in_values:
+            if statement == 'insert':
+                columns.append(_sql_identifier(text))
+            elif expect_column and text.upper() not in SQL_CONSTRAINT_KEYWORDS:
+                columns.append(_sql_identifier(text))
+            expect_column = False
+        elif in_values and depth == 1 and kind in ('number', 'string'):
+            while len(selected) <= column_index:
+                selected.append(_sql_column_selected(len(selected), None, include, exclude))
+            if selected[column_index]:
+                if kind == 'number':
+                    text = _desensitize_number_literal(desensitizer, text)
+                elif DIGIT_PATTERN.search(text) and previous.lower() not in ('x', 'b'):
+                    # 导出文件中大量重复的字符串值直接复用结果（映射确定后结果不会变化）
+                    cached = string_cache.get(text)
+                    if cached is None:
+                        if len(string_cache) >= 65536:
+                            string_cache.clear()
+                        cached = string_cache[text] = (
+                            text[0] + _desensitize_escaped(desensitizer, text[1:-1], SQL_ESCAPE_PATTERN) + text[-1])
+                    text = cached
+        elif kind in ('word', 'quoted'):
+            expect_column = False
+        previous = text
+        out.append(text)
+        if len(out) >= 4096:
+            dst.write(''.join(out))
+            out = []
+    dst.write(''.join(out))
+
+
+# 结构化处理模式：扩展名 -> 流式处理函数(desensitizer, src, dst, **options)
+STRUCTURED_HANDLERS = {
+    '.csv': desensitize_csv_stream,
+    '.json': desensitize_json_stream,
+    '.jsonl': desensitize_json_stream,
+    '.ndjson': desensitize_json_stream,
+    '.html': desensitize_markup_stream,
+    '.htm': desensitize_markup_stream,
+    '.xml': desensitize_markup_stream,
+    '.py': desensitize_python_stream,
+    '.js': desensitize_script_stream,
+    '.ts': desensitize_script_stream,
+    '.sql': desensitize_sql_stream,
+}
+
+# 目录批量处理时识别的文本文件扩展名
+SUPPORTED_EXTENSIONS = ('.md', '.txt', '.csv', '.json', '.jsonl', '.ndjson', '.xml', '.html', '.htm',
+                        '.py', '.js', '.ts', '.css', '.sql', '.log')
+
+
+# 单个大文件并行处理：文件不小于该大小时才拆分（更小的文件进程启动开销大于收益）
+PARALLEL_MIN_SIZE = 32 * 1024 * 1024
+# 并行处理时每个工作进程一次解码和扫描的块大小（按行对齐）
+PARALLEL_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def _split_line_ranges(file_path: str, count: int) -> List[Tuple[int, int]]:
+    """把文件拆分为count个左右、起止都在行首的字节范围"""
+    size = os.path.getsize(file_path)
+    boundaries = [0]
+    with open(file_path, 'rb') as f:
+        for i in range(1, count):
+            target = size * i // count
+            if target <= boundaries[-1]:
+                continue
+            f.seek(target - 1)
+            # target-1处若正好是换行符，target本身就是行首
+            f.readline()
+            position = f.tell()
+            if boundaries[-1] < position < size:
+                boundaries.append(position)
+    boundaries.append(size)
+    return [(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1) if boundaries[i] < boundaries[i + 1]]
+
+
+def _iter_line_aligned_blocks(f, start: int, end: int, block_size: int):
+    """读取[start, end)范围内的字节，按行对齐切成约block_size大小的块（end须为行首或文件末尾）"""
+    f.seek(start)
+    position = start
+    while position < end:
+        data = f.read(min(block_size, end - position))
+        if not data:
+            break
+        position += len(data)
+        if position < end and not data.endswith(b'\n'):
+            rest = f.readline()
+            data += rest
+            position += len(rest)
+        yield data
+
+
+def _scan_range_task(task) -> List[str]:
+    """并行处理的工作进程：扫描一个字节范围，把数字位置写入位置文件，返回按首次出现顺序排列的不同数字
+
+    位置文件中每块依次为：数字个数，然后每个数字的(块内开始位置, 块内结束位置, 本范围内的编号)，均为uint32。
+    """
+    file_path, start, end, encoding, desensitizer_options, span_path, block_size = task
+    desensitizer = TextDesensitizer(**desensitizer_options)
+    local_ids = {}
+    numbers = []
+    with open(file_path, 'rb') as f, open(span_path, 'wb') as out:
+        for block in _iter_line_aligned_blocks(f, start, end, block_size):
+            text = block.decode(encoding)
+            spans = array('I')
+            for number, number_start, number_end in desensitizer.extract_numbers(text):
+                local_id = local_ids.get(number)
+                if local_id is None:
+                    local_id = local_ids[number] = len(numbers)
+                    numbers.append(number)
+                spans.extend((number_start, number_end, local_id))
+            array('I', [len(spans) // 3]).tofile(out)
+            spans.tofile(out)
+    return numbers
+
+
+def _is_line_local(desensitizer: 'TextDesensitizer') -> bool:
+    """脱敏结果是否只取决于每行自身：跳过代码块等需要跨行记录状态，
+    用户自定义规则的正则可能跨行匹配（如 编号\\s+x\\d+），这两种情况都不能按行拆分处理"""
+    rules = desensitizer.rules
+    return not desensitizer.skipped_kinds and (rules is None or rules.pattern is None)
+
+
+def desensitize_file_parallel(file_path: str, output_path: str, workers: Optional[int] = None,
+                              desensitizer_options: Optional[dict] = None,
+                              block_size: int = PARALLEL_BLOCK_SIZE) -> TextDesensitizer:
+    """多进程处理单个大文本文件，输出与串行处理逐字节一致
+
+    文件按行拆分为多个字节范围，各工作进程只负责找出数字位置（内置规则都在单行内判断，
+    范围起止都在行首，不会有跨范围的匹配）；主进程按范围顺序依次分配占位符
+    （即全文首次出现的顺序），再把各范围的原文和占位符拼接写出。返回持有映射关系的脱敏器。
+    指定了自定义规则或跳过代码块等时（见_is_line_local）不拆分，整段串行处理。
+    """
+    desensitizer_options = dict(desensitizer_options or {})
+    desensitizer_options.pop('line_cache_size', None)
+    desensitizer = TextDesensitizer(**desensitizer_options)
+    workers = workers or os.cpu_count() or 1
+    encoding = _detect_encoding(file_path)
+    if not _is_line_local(desensitizer):
+        with open(file_path, 'r', encoding=encoding, newline='') as src:
+            content = src.read()
+        with open(output_path, 'w', encoding='utf-8', newline='') as dst:
+            dst.write(desensitizer.desensitize_content(content))
+        return desensitizer
+    # 范围数多于进程数，各进程的负载更均衡
+    ranges = _split_line_ranges(file_path, workers * 4)
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_path))) as temp_dir:
+        tasks = [(file_path, start, end, encoding, desensitizer_options,
+                  os.path.join(temp_dir, f"{index}.spans"), block_size)
+                 for index, (start, end) in enumerate(ranges)]
+        with ProcessPoolExecutor(max_workers=workers) as executor, \
+                open(file_path, 'rb') as src, open(output_path, 'w', encoding='utf-8', newline='') as dst:
+            # 按范围顺序取回结果，前面的范围拼接写出时后面的范围仍在并行扫描
+            for task, numbers in zip(tasks, executor.map(_scan_range_task, tasks)):
+                _, start, end, _, _, span_path, _ = task
+                placeholders = [desensitizer.add_to_mapping(number) for number in numbers]
+                with open(span_path, 'rb') as spans_file:
+                    for block in _iter_line_aligned_blocks(src, start, end, block_size):
+                        text = block.decode(encoding)
+                        count = array('I')
+                        count.fromfile(spans_file, 1)
+                        spans = array('I')
+                        spans.fromfile(spans_file, count[0] * 3)
+                        parts = []
+                        pos = 0
+                        for i in range(0, len(spans), 3):
+                            parts.append(text[pos:spans[i]])
+                            parts.append(placeholders[spans[i + 2]])
+                            pos = spans[i + 1]
+                        parts.append(text[pos:])
+                        dst.write(''.join(parts))
+                os.remove(span_path)
+    return desensitizer
+
+
+# 内存预算估算：整段处理时每处数字（位置元组和替换片段）、每个不同数字（映射关系）的大致内存占用（字节）
+MEMORY_PER_NUMBER = 250
+MEMORY_PER_UNIQUE_NUMBER = 650
+# 估算内存时抽样读取的数据量
+MEMORY_SAMPLE_BYTES = 1 << 20
+# bz2/xz文件无法直接读出解压后的大小，按该压缩比估计
+ASSUMED_COMPRESSION_RATIO = 10
+
+
+def _uncompressed_size(file_path: str) -> int:
+    """返回文件解压后的大小；gzip读取尾部记录的大小，其他压缩格式按ASSUMED_COMPRESSION_RATIO估计"""
+    size = os.path.getsize(file_path)
+    suffix = _compression_suffix(file_path)
+    if suffix is None:
+        return size
+    if suffix == '.gz' and size >= 4:
+        with open(file_path, 'rb') as f:
+            f.seek(-4, os.SEEK_END)
+            isize = struct.unpack('<I', f.read(4))[0]
+        # 尾部大小对2^32取模，小于压缩后大小说明已回绕（或是多段gzip），改用估计值
+        if isize >= size:
+            return isize
+    return size * ASSUMED_COMPRESSION_RATIO
+
+
+def estimate_memory(file_path: str, desensitizer_options: Optional[dict] = None,
+                    sample_bytes: int = MEMORY_SAMPLE_BYTES) -> int:
+    """估算整个文件读入内存处理时的内存峰值（字节）
+
+    包括原文和结果字符串、读取时的字节串、数字位置和替换片段以及映射关系；
+    数字密度和不同数字个数由scan_file抽样得到，结果只是粗略值。
+    """
+    size = _uncompressed_size(file_path)
+    if not size:
+        return 0
+    with open_compressed(file_path, 'rb') as f:
+        head = f.read(65536)
+    text = head.decode(_sample_encoding(head), errors='replace')
+    highest = max(text, default='\0')
+    # CPython字符串按最大码位每字符占1、2或4字节；占位符含全角符号，结果至少每字符2字节
+    kind = 1 if highest <= '\xff' else 2 if highest <= '\uffff' else 4
+    chars = size * len(text) / len(head) if head else size
+    stats = scan_file(file_path, desensitizer_options, min(1.0, sample_bytes / size), structured=False)
+    if not stats['numbers']:
+        return int(size + chars * kind)
+    working = chars * max(kind, 2) + chars * kind + stats['numbers'] * MEMORY_PER_NUMBER
+    return int(chars * kind + max(size, working) + stats['unique_numbers'] * MEMORY_PER_UNIQUE_NUMBER)
+
+
+def _reset_peak_rss() -> bool:
+    """重置进程的峰值RSS（Linux：向/proc/self/clear_refs写入5，VmHWM回到当前RSS），不支持时返回False"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _read_peak_rss() -> Optional[int]:
+    """读取/proc/self/status中的VmHWM（字节），不支持时返回None"""
+    try:
+        with open('/proc/self/status', 'rb') as f:
+            for line in f:
+                if line.startswith(b'VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+@contextlib.contextmanager
+def _measure_peak_memory(enabled: bool):
+    """测量with块内的内存峰值（字节），结果写入产出字典的'peak'和'source'键
+
+    tracemalloc已在跟踪时重置并读取其峰值（tracemalloc）；否则enabled为True时读取进程的峰值RSS：
+    能重置VmHWM时为本段处理期间的峰值（rss），否则为进程启动以来的峰值（max_rss）。
+    这里不主动启动tracemalloc：跟踪每次内存分配会让处理慢一个数量级。
+    """
+    result = {'peak': None, 'source': None}
+    tracing = tracemalloc.is_tracing()
+    reset = False
+    if tracing:
+        tracemalloc.reset_peak()
+    elif enabled:
+        reset = _reset_peak_rss()
+    yield result
+    if tracing:
+        result['peak'], result['source'] = tracemalloc.get_traced_memory()[1], 'tracemalloc'
+    elif enabled:
+        peak = _read_peak_rss() if reset else None
+        if peak is not None:
+            result['peak'], result['source'] = peak, 'rss'
+        elif resource is not None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Linux以KB为单位，macOS以字节为单位
+            result['peak'] = peak if sys.platform == 'darwin' else peak * 1024
+            result['source'] = 'max_rss'
+
+
+def desensitize_text_file(file_path: str, output_path=None, structured: bool = True,
+                          desensitizer_options: Optional[dict] = None, stream: bool = False,
+                          workers: Optional[int] = None, memory_budget: Optional[int] = None, **options):
+    """对通用文本文件进行脱敏处理
+
+    structured为True时，CSV等结构化格式使用对应的流式处理模式，
+    其余关键字参数（如include_columns、exclude_columns）传给该模式。
+    desensitizer_options为创建TextDesensitizer时的参数（如skip_code_blocks）。
+    stream为True时其他文本文件逐行读写，内存占用与文件大小无关。
+    workers大于1且文件不小于PARALLEL_MIN_SIZE时用多个进程并行处理，结果与串行一致。
+    .gz/.bz2/.xz文件透明解压读取；输出路径以这些后缀结尾时压缩写入（默认与输入的压缩方式相同）。
+    memory_budget为内存预算（字节）：整段处理前先估算内存峰值，超出预算时改为逐行流式处理。
+    返回输出文件、映射文件路径、脱敏的数字个数和内存统计（估算值、是否改为流式处理、实际峰值）。
+    峰值在tracemalloc已跟踪时为其记录的本文件峰值，否则指定memory_budget时为峰值RSS
+    （Linux上每个文件重新计算，见_measure_peak_memory），都不满足时为None；并行处理时只统计主进程。
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"文件 {file_path} 不存在")
+        
+    if output_path is None:
+        base_name, ext = os.path.splitext(_strip_compression(file_path))
+        output_path = f"{base_name}_desensitized{ext}{_compression_suffix(file_path) or ''}"
+        
+    # 生成映射文件路径（不含压缩后缀）
+    mapping_file_path = f"{os.path.splitext(_strip_compression(output_path))[0]}_map.json"
+
+    # 创建脱敏器实例
+    desensitizer = TextDesensitizer(**(desensitizer_options or {}))
+
+    handler = STRUCTURED_HANDLERS.get(os.path.splitext(_strip_compression(file_path))[1].lower()) if structured else None
+    # 并行拆分要求各行相互独立：结构化模式、需要跨行记录状态的代码块跳过和可能跨行匹配的
+    # 自定义规则等情况仍串行处理；压缩文件无法按字节范围拆分，也串行处理
+    parallel = (handler is None and workers is not None and workers > 1 and _is_line_local(desensitizer)
+                and _compression_suffix(file_path) is None and _compression_suffix(output_path) is None
+                and os.path.getsize(file_path) >= PARALLEL_MIN_SIZE)
+    estimated_memory = None
+    fallback = False
+    if memory_budget and not (parallel or handler is not None or stream):
+        estimated_memory = estimate_memory(file_path, desensitizer_options)
+        if estimated_memory > memory_budget:
+            # 逐行处理的结果与整段处理一致，只有映射关系随文件增长
+            stream = fallback = True
+            print(f"预计内存占用 {_format_size(estimated_memory)} 超出预算 {_format_size(memory_budget)}，改用流式处理")
+    with _measure_peak_memory(bool(memory_budget)) as memory:
+        if parallel:
+            desensitizer = desensitize_file_parallel(file_path, output_path, workers, desensitizer_options)
+        elif handler is not None:
+            # 结构化模式：逐行流式读写，内存占用与文件大小无关
+            encoding = _detect_encoding(file_path)
+            with open_compressed(file_path, 'r', encoding=encoding, newline='') as src, \
+                    open_compressed(output_path, 'w', encoding='utf-8', newline='') as dst:
+                handler(desensitizer, src, dst, **options)
+        elif stream:
+            # 逐行模式：相同的行复用缓存结果
+            encoding = _detect_encoding(file_path)
+            with open_compressed(file_path, 'r', encoding=encoding, newline='') as src, \
+                    open_compressed(output_path, 'w', encoding='utf-8', newline='') as dst:
+                dst.writelines(desensitizer.desensitize_lines(src))
+        else:
+            # 读取文件内容（保留原换行符，输出才能与原文逐行校验）
+            try:
+                with open_compressed(file_path, 'r', encoding='utf-8', newline='') as f:
+                    content = f.read()
+            except UnicodeDecodeError:
+                # 尝试其他编码
+                with open_compressed(file_path, 'r', encoding='gbk', newline='') as f:
+                    content = f.read()
+
+            # 执行脱敏
+            desensitized_content = desensitizer.desensitize_content(content)
+
+            # 保存脱敏后的内容
+            with open_compressed(output_path, 'w', encoding='utf-8', newline='') as f:
+                f.write(desensitized_content)
+        
+    # 保存映射关系
+    desensitizer.save_mapping(mapping_file_path)
+    
+    print(f"脱敏完成！")
+    print(f"结果已保存至: {output_path}")
+    print(f"映射关系已保存至: {mapping_file_path}")
+    print(f"共脱敏 {len(desensitizer.number_mapping)} 个数字")
+    if stream and desensitizer.line_cache_size > 0:
+        info = desensitizer.line_cache_info()
+        print(f"行缓存命中率: {info['hit_rate']:.1%}（命中 {info['hits']} 行，未命中 {info['misses']} 行）")
+    peak_memory, peak_memory_source = memory['peak'], memory['source']
+    if memory_budget and peak_memory is not None:
+        print(f"内存峰值: {_format_size(peak_memory)}")
+    return {'output': output_path, 'mapping': mapping_file_path, 'numbers': len(desensitizer.number_mapping),
+            'estimated_memory': estimated_memory, 'streamed': fallback,
+            'peak_memory': peak_memory, 'peak_memory_source': peak_memory_source}
+
+
+def restore_text_file(file_path: str, mapping_file_path: str, output_path=None):
+    """根据映射文件还原文本文件"""
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"文件 {file_path} 不存在")
+        
+    if not os.path.exists(mapping_file_path):
+        raise FileNotFoundError(f"映射文件 {mapping_file_path} 不存在")
+        
+    if output_path is None:
+        base_name, ext = os.path.splitext(_strip_compression(file_path))
+        output_path = f"{base_name}_restored{ext}{_compression_suffix(file_path) or ''}"
+
+    # 创建脱敏器实例
+    desensitizer = TextDesensitizer()
+    
+    # 加载映射关系
+    mapping = desensitizer.load_mapping(mapping_file_path)
+    
+    # 读取脱敏后的内容
+    try:
+        with open_compressed(file_path, 'r', encoding='utf-8', newline='') as f:
+            content = f.read()
+    except UnicodeDecodeError:
+        # 尝试其他编码
+        with open_compressed(file_path, 'r', encoding='gbk', newline='') as f:
+            content = f.read()
+
+    # 执行还原
+    restored_content = desensitizer.restore_content(content, mapping)
+    
+    # 保存还原后的内容
+    with open_compressed(output_path, 'w', encoding='utf-8', newline='') as f:
+        f.write(restored_content)
+        
+    print(f"还原完成！")
+    print(f"结果已保存至: {output_path}")
+
+
+def _run_file_task(conn, args, kwargs):
+    """批量处理的子进程：处理单个文件，把结果和提示信息通过管道发回主进程"""
+    messages = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(messages):
+            result = desensitize_text_file(*args, **kwargs)
+        conn.send((True, result, messages.getvalue()))
+    except Exception as e:
+        conn.send((False, str(e), messages.getvalue()))
+    finally:
+        conn.close()
+
+
+def _run_file_tasks(tasks, workers: int, timeout: Optional[float] = None) -> Dict[str, tuple]:
+    """用最多workers个子进程按顺序处理文件，超过timeout秒的子进程被终止
+
+    tasks为[(文件名, 位置参数, 关键字参数)]，返回 文件名 -> (状态, 结果或错误信息, 提示信息)，
+    状态为ok、error或timeout。每个文件一个子进程，超时只影响该文件。
+    """
+    pending = list(tasks)
+    running = {}
+    results = {}
+    while pending or running:
+        while pending and len(running) < workers:
+            name, args, kwargs = pending.pop(0)
+            reader, writer = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_run_file_task, args=(writer, args, kwargs), daemon=True)
+            process.start()
+            writer.close()
+            deadline = time.monotonic() + timeout if timeout else None
+            running[reader] = (name, process, deadline)
+
+        deadlines = [deadline for _, _, deadline in running.values() if deadline is not None]
+        wait_time = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+        for reader in multiprocessing.connection.wait(list(running), timeout=wait_time):
+            name, process, _ = running.pop(reader)
+            try:
+                ok, result, messages = reader.recv()
+                results[name] = ('ok' if ok else 'error', result, messages)
+            except EOFError:
+                results[name] = ('error', '子进程异常退出', '')
+            reader.close()
+            process.join()
+
+        now = time.monotonic()
+        for reader, (name, process, deadline) in list(running.items()):
+            if deadline is not None and now >= deadline:
+                process.terminate()
+                process.join()
+                reader.close()
+                del running[reader]
+                results[name] = ('timeout', f"超过 {timeout:g} 秒未完成", '')
+    return results
+
+
+def process_directory(input_dir: str, output_dir=None, structured: bool = True,
+                      desensitizer_options: Optional[dict] = None, stream: bool = False,
+                      workers: Optional[int] = None, timeout: Optional[float] = None,
+                      memory_budget: Optional[int] = None, **options) -> dict:
+    """处理目录中的所有文本文件
+
+    文件按大小从大到小调度，避免大文件排在最后拖长整批的耗时。指定workers或timeout时
+    每个文件在独立的子进程中处理（最多workers个同时进行），超过timeout秒的文件被终止，
+    之后改用逐行流式模式重试一次。memory_budget为每个文件的内存预算（字节），见desensitize_text_file。
+    返回处理报告（成功、出错和超时的文件，以及每个成功文件的统计信息）。
+    """
     if not os.path.exists(input_dir):
         raise FileNotFoundError(f"目录 {input_dir} 不存在")
         
@@ -367,20 +2361,61 @@ def process_directory(input_dir: str, output_dir=None):
     # 创建输出目录
     os.makedirs(output_dir, exist_ok=True)
 
-    # 遍历目录中的所有文本文件
-    processed_count = 0
-    for filename in os.listdir(input_dir):
-        if filename.lower().endswith(('.md', '.txt', '.csv', '.json', '.xml', '.html', '.htm', '.py', '.js', '.ts', '.css', '.sql', '.log')):
+    # 遍历目录中的所有文本文件，从大到小处理
+    filenames = [filename for filename in os.listdir(input_dir) if _is_supported_file(filename)]
+    filenames.sort(key=lambda filename: os.path.getsize(os.path.join(input_dir, filename)), reverse=True)
+    report = {'processed': [], 'failed': [], 'timed_out': [], 'stats': {}}
+
+    if not workers and not timeout:
+        for filename in filenames:
             input_path = os.path.join(input_dir, filename)
             output_path = os.path.join(output_dir, filename)
-            
+
             try:
-                desensitize_text_file(input_path, output_path)
-                processed_count += 1
+                report['stats'][filename] = desensitize_text_file(input_path, output_path, structured,
+                                                                  desensitizer_options, stream,
+                                                                  memory_budget=memory_budget, **options)
+                report['processed'].append(filename)
             except Exception as e:
                 print(f"处理文件 {filename} 时出错: {str(e)}")
+                report['failed'].append(filename)
+    else:
+        workers = workers or os.cpu_count() or 1
+        tasks = [(filename, (os.path.join(input_dir, filename), os.path.join(output_dir, filename), structured,
+                             desensitizer_options, stream), dict(options, memory_budget=memory_budget))
+                 for filename in filenames]
+        results = _run_file_tasks(tasks, workers, timeout)
+
+        # 超时的文件改用逐行流式模式重试（不使用结构化模式）
+        timed_out = [filename for filename in filenames if results[filename][0] == 'timeout']
+        retry_options = dict(desensitizer_options or {})
+        retry_options.setdefault('line_cache_size', 10000)
+        retry_tasks = [(filename, (os.path.join(input_dir, filename), os.path.join(output_dir, filename), False,
+                                   retry_options, True), {})
+                       for filename in timed_out]
+        retry_results = _run_file_tasks(retry_tasks, workers, timeout) if retry_tasks else {}
+
+        for filename in filenames:
+            status, result, messages = results[filename]
+            if status == 'timeout':
+                report['timed_out'].append(filename)
+                status, result, messages = retry_results[filename]
+            print(messages, end='')
+            if status == 'ok':
+                report['processed'].append(filename)
+                report['stats'][filename] = result
+            else:
+                print(f"处理文件 {filename} 时出错: {result}")
+                report['failed'].append(filename)
 
-    print(f"已完成 {processed_count} 个文件的脱敏处理")
+        if timed_out:
+            print(f"以下 {len(timed_out)} 个文件超过 {timeout:g} 秒未完成，已改用流式模式重试：")
+            for filename in timed_out:
+                retry_status = retry_results[filename][0]
+                print(f"  {filename}: {'重试成功' if retry_status == 'ok' else '重试失败' if retry_status == 'error' else '重试仍然超时'}")
+
+    print(f"已完成 {len(report['processed'])} 个文件的脱敏处理")
+    return report
 
 
 def process_directory_restore(input_dir: str, mapping_file_path: str, output_dir=None):
@@ -404,25 +2439,25 @@ def process_directory_restore(input_dir: str, mapping_file_path: str, output_dir
     # 遍历目录中的所有文本文件
     processed_count = 0
     for filename in os.listdir(input_dir):
-        if filename.lower().endswith(('.md', '.txt', '.csv', '.json', '.xml', '.html', '.htm', '.py', '.js', '.ts', '.css', '.sql', '.log')):
+        if _is_supported_file(filename):
             input_path = os.path.join(input_dir, filename)
             output_path = os.path.join(output_dir, filename)
             
             try:
                 # 读取脱敏后的内容
                 try:
-                    with open(input_path, 'r', encoding='utf-8') as f:
+                    with open_compressed(input_path, 'r', encoding='utf-8', newline='') as f:
                         content = f.read()
                 except UnicodeDecodeError:
                     # 尝试其他编码
-                    with open(input_path, 'r', encoding='gbk') as f:
+                    with open_compressed(input_path, 'r', encoding='gbk', newline='') as f:
                         content = f.read()
                 
                 # 执行还原
                 restored_content = desensitizer.restore_content(content, mapping)
                 
                 # 保存还原后的内容
-                with open(output_path, 'w', encoding='utf-8') as f:
+                with open_compressed(output_path, 'w', encoding='utf-8', newline='') as f:
                     f.write(restored_content)
                 
                 processed_count += 1
@@ -433,22 +2468,1010 @@ def process_directory_restore(input_dir: str, mapping_file_path: str, output_dir
     print(f"已完成 {processed_count} 个文件的还原处理，使用映射文件: {mapping_file_path}")
 
 
-def main():
-    parser = argparse.ArgumentParser(description='对文本文件进行数字脱敏处理')
-    parser.add_argument('input', help='输入文件或目录路径')
+# 归档文件：后缀 -> 格式（zip或tarfile的压缩方式）
+ARCHIVE_FORMATS = {
+    '.zip': 'zip',
+    '.tar': 'tar',
+    '.tar.gz': 'tar:gz',
+    '.tgz': 'tar:gz',
+    '.tar.bz2': 'tar:bz2',
+    '.tbz2': 'tar:bz2',
+    '.tar.xz': 'tar:xz',
+    '.txz': 'tar:xz',
+}
+# 归档中合并映射文件的成员名
+ARCHIVE_MAPPING_MEMBER = 'desensitize_map.json'
+# 写入tar时成员需先确定大小：不超过该大小的成员在内存中暂存，更大的暂存到临时文件
+ARCHIVE_SPOOL_SIZE = 16 * 1024 * 1024
+
+
+def _archive_suffix(file_path: str) -> Optional[str]:
+    """返回归档文件的后缀（如.tar.gz），不是归档文件时返回None"""
+    name = os.path.basename(file_path).lower()
+    for suffix in sorted(ARCHIVE_FORMATS, key=len, reverse=True):
+        if name.endswith(suffix):
+            return suffix
+    return None
+
+
+def _archive_output_path(file_path: str, tag: str) -> str:
+    """生成归档文件的默认输出路径，如 data.tar.gz -> data_desensitized.tar.gz"""
+    suffix = _archive_suffix(file_path)
+    return f"{file_path[:-len(suffix)]}_{tag}{suffix}"
+
+
+@contextlib.contextmanager
+def _member_streams(name: str, raw, out):
+    """成员为压缩的文本文件（如 app.log.gz）时透明地解压读取、按原格式压缩写入，否则直接使用原始流"""
+    suffix = _compression_suffix(name)
+    if suffix is None:
+        yield raw, out
+        return
+    # 传入文件对象时关闭压缩流不会关闭底层的成员流
+    with COMPRESSION_OPENERS[suffix](raw, 'rb') as member_src, COMPRESSION_OPENERS[suffix](out, 'wb') as member_dst:
+        yield member_src, member_dst
+
+
+def _rewrite_archive(src, dst, archive_format: str, process_member, extra_members=None, skip=()):
+    """逐个成员读取归档src，写入同格式（同压缩方式）的归档dst，不需要先解压到目录
+
+    文本成员（见_is_supported_file，包括 .log.gz 等压缩的文本文件）交给process_member(name, raw, out)处理：
+    raw为可定位的成员读取流，out为二进制写入流，压缩的成员已透明解压/压缩；
+    其他成员原样复制，skip中的成员不写出。
+    全部成员处理完后调用extra_members()，把返回的(成员名, 内容)追加到归档末尾。
+    """
+    if archive_format == 'zip':
+        with zipfile.ZipFile(src) as zin, zipfile.ZipFile(dst, 'w', zipfile.ZIP_DEFLATED) as zout:
+            for info in zin.infolist():
+                if info.filename in skip:
+                    continue
+                target = zipfile.ZipInfo(info.filename, info.date_time)
+                target.compress_type = zipfile.ZIP_DEFLATED
+                target.external_attr = info.external_attr
+                if info.is_dir():
+                    zout.writestr(target, b'')
+                    continue
+                # 脱敏后的大小事先未知，总是允许写入超过4GB的成员
+                with zin.open(info) as raw, zout.open(target, 'w', force_zip64=True) as out:
+                    if _is_supported_file(info.filename):
+                        with _member_streams(info.filename, raw, out) as (member_src, member_dst):
+                            process_member(info.filename, member_src, member_dst)
+                    else:
+                        shutil.copyfileobj(raw, out)
+            for name, data in (extra_members() if extra_members else ()):
+                zout.writestr(name, data)
+        return
+
+    compression = archive_format.partition(':')[2]
+    with tarfile.open(fileobj=src, mode=f"r:{compression or '*'}") as tin, \
+            tarfile.open(fileobj=dst, mode=f"w:{compression}" if compression else 'w', format=tin.format) as tout:
+        for info in tin:
+            if info.name in skip:
+                continue
+            if not info.isfile() or not _is_supported_file(info.name):
+                tout.addfile(info, tin.extractfile(info) if info.isfile() else None)
+                continue
+            with tin.extractfile(info) as raw, tempfile.SpooledTemporaryFile(ARCHIVE_SPOOL_SIZE) as out:
+                with _member_streams(info.name, raw, out) as (member_src, member_dst):
+                    process_member(info.name, member_src, member_dst)
+                info.size = out.tell()
+                out.seek(0)
+                tout.addfile(info, out)
+        for name, data in (extra_members() if extra_members else ()):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            tout.addfile(info, io.BytesIO(data))
+
+
+def _read_archive_member(src, archive_format: str, name: str) -> Optional[bytes]:
+    """读取归档中指定成员的内容，成员不存在时返回None"""
+    if archive_format == 'zip':
+        with zipfile.ZipFile(src) as archive:
+            return archive.read(name) if name in archive.namelist() else None
+    compression = archive_format.partition(':')[2]
+    with tarfile.open(fileobj=src, mode=f"r:{compression or '*'}") as archive:
+        try:
+            member = archive.extractfile(name)
+        except KeyError:
+            return None
+        return member.read() if member is not None else None
+
+
+def _open_member_text(raw):
+    """探测成员编码后包装为文本读取流（读取样本后回到开头，不转换换行符）"""
+    encoding = _sample_encoding(raw.read(65536))
+    raw.seek(0)
+    return io.TextIOWrapper(raw, encoding=encoding, newline='')
+
+
+def desensitize_archive_stream(desensitizer: 'TextDesensitizer', src, dst, archive_format: str,
+                               structured: bool = True, **options) -> int:
+    """对二进制流src中的归档逐个成员脱敏，写入dst（同格式），末尾追加合并的映射文件成员
+
+    所有成员共用同一个脱敏器，相同数字在各成员中得到相同的占位符；每个成员逐行
+    （结构化格式按对应的流式处理模式）处理，内存占用与成员大小无关。返回处理的文本成员个数。
+    """
+    processed = []
+
+    def process_member(name, raw, out):
+        handler = STRUCTURED_HANDLERS.get(os.path.splitext(_strip_compression(name))[1].lower()) if structured else None
+        text_src = _open_member_text(raw)
+        text_dst = io.TextIOWrapper(out, encoding='utf-8', newline='')
+        try:
+            if handler is not None:
+                handler(desensitizer, text_src, text_dst, **options)
+            else:
+                text_dst.writelines(desensitizer.desensitize_lines(text_src))
+            text_dst.flush()
+        finally:
+            # 只释放包装层，底层的成员流由_rewrite_archive关闭
+            text_dst.detach()
+            text_src.detach()
+        processed.append(name)
+
+    def mapping_member():
+        mapping = io.StringIO()
+        _write_mapping_json(mapping, desensitizer.placeholder_items())
+        return [(ARCHIVE_MAPPING_MEMBER, mapping.getvalue().encode('utf-8'))]
+
+    _rewrite_archive(src, dst, archive_format, process_member, mapping_member, skip=(ARCHIVE_MAPPING_MEMBER,))
+    return len(processed)
+
+
+def restore_archive_stream(src, dst, archive_format: str, mapping: Optional[Dict[str, str]] = None) -> int:
+    """还原二进制流src中的归档，写入dst（同格式）
+
+    mapping为占位符->原始数字，未提供时使用归档中的映射文件成员；还原后的归档不再包含映射文件成员。
+    返回还原的文本成员个数。
+    """
+    if mapping is None:
+        data = _read_archive_member(src, archive_format, ARCHIVE_MAPPING_MEMBER)
+        if data is None:
+            raise ValueError(f"归档中没有映射文件成员 {ARCHIVE_MAPPING_MEMBER}，请用 -m 指定映射文件")
+        mapping = json.loads(data)
+        src.seek(0)
+    processed = []
+
+    def process_member(name, raw, out):
+        text_src = _open_member_text(raw)
+        text_dst = io.TextIOWrapper(out, encoding='utf-8', newline='')
+        try:
+            text_dst.writelines(iter_restore(text_src, mapping))
+            text_dst.flush()
+        finally:
+            text_dst.detach()
+            text_src.detach()
+        processed.append(name)
+
+    _rewrite_archive(src, dst, archive_format, process_member, skip=(ARCHIVE_MAPPING_MEMBER,))
+    return len(processed)
+
+
+def desensitize_archive(file_path: str, output_path=None, structured: bool = True,
+                        desensitizer_options: Optional[dict] = None, **options) -> dict:
+    """对ZIP/tar归档中的文本文件脱敏，不解压：输出同格式的归档，成员名不变，并包含合并的映射文件成员"""
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"文件 {file_path} 不存在")
+    suffix = _archive_suffix(file_path)
+    if suffix is None:
+        raise ValueError(f"不支持的归档格式: {file_path}")
+    if output_path is None:
+        output_path = _archive_output_path(file_path, 'desensitized')
+    archive_format = ARCHIVE_FORMATS[suffix]
+
+    desensitizer = TextDesensitizer(**(desensitizer_options or {}))
+    with open(file_path, 'rb') as src, open(output_path, 'wb') as dst:
+        members = desensitize_archive_stream(desensitizer, src, dst, archive_format, structured, **options)
+
+    print("脱敏完成！")
+    print(f"结果已保存至: {output_path}（映射关系保存在归档成员 {ARCHIVE_MAPPING_MEMBER} 中）")
+    print(f"共处理 {members} 个文件，脱敏 {len(desensitizer.number_mapping)} 个数字")
+    return {'output': output_path, 'members': members, 'numbers': len(desensitizer.number_mapping)}
+
+
+def restore_archive(file_path: str, mapping_file_path: Optional[str] = None, output_path=None) -> dict:
+    """还原脱敏后的ZIP/tar归档；未指定映射文件时使用归档中的映射文件成员"""
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"文件 {file_path} 不存在")
+    if mapping_file_path is not None and not os.path.exists(mapping_file_path):
+        raise FileNotFoundError(f"映射文件 {mapping_file_path} 不存在")
+    suffix = _archive_suffix(file_path)
+    if suffix is None:
+        raise ValueError(f"不支持的归档格式: {file_path}")
+    if output_path is None:
+        output_path = _archive_output_path(file_path, 'restored')
+    archive_format = ARCHIVE_FORMATS[suffix]
+
+    mapping = TextDesensitizer().load_mapping(mapping_file_path) if mapping_file_path else None
+    with open(file_path, 'rb') as src, open(output_path, 'wb') as dst:
+        members = restore_archive_stream(src, dst, archive_format, mapping)
+
+    print("还原完成！")
+    print(f"结果已保存至: {output_path}")
+    print(f"共还原 {members} 个文件")
+    return {'output': output_path, 'members': members}
+
+
+# 试运行抽样时每个文件至少读取的块数
+SAMPLE_CHUNKS = 8
+
+
+def _format_size(size: float) -> str:
+    """把字节数格式化为便于阅读的形式"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def _estimate_mapping_bytes(unique_count: int, average_value_length: float,
+                            placeholder_length: Optional[int] = None) -> int:
+    """估算映射文件（indent=2的JSON）的字节数：每条约为 '  "￥N￥": "数字",\\n'"""
+    if placeholder_length is not None:
+        placeholder_digits = unique_count * placeholder_length
+    else:
+        # 顺序占位符的编号位数之和
+        placeholder_digits = 0
+        digits = 1
+        while 10 ** (digits - 1) <= unique_count:
+            placeholder_digits += (min(unique_count, 10 ** digits - 1) - 10 ** (digits - 1) + 1) * digits
+            digits += 1
+    return int(3 + unique_count * (16 + average_value_length) + placeholder_digits)
+
+
+class _CountingDesensitizer(TextDesensitizer):
+    """试运行用的脱敏器：记录每个数字被替换的次数（即add_to_mapping的调用次数）"""
+
+    __slots__ = ('counts',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.counts = {}
+
+    def add_to_mapping(self, number: str) -> str:
+        self.counts[number] = self.counts.get(number, 0) + 1
+        return super().add_to_mapping(number)
+
+
+def scan_file(file_path: str, desensitizer_options: Optional[dict] = None, sample: Optional[float] = None,
+              chunk_size: int = 1 << 20, structured: bool = True, **options) -> dict:
+    """只扫描不输出：统计文件中将被替换的数字个数、不同数字个数，估算映射文件大小和处理耗时
+
+    sample为0~1之间的比例时只读取均匀分布的若干块（按行对齐）并按比例外推，
+    外推的不同数字个数按只出现一次的数字比例估计，只是粗略值。压缩文件无法按偏移随机读取，
+    抽样时只读取开头部分，解压后的大小也是估计值。
+    structured和其余关键字参数同desensitize_text_file：CSV等结构化格式用实际处理时的流式模式
+    完整扫描（输出丢弃，统计实际的替换次数，不抽样），其余文件使用纯文本脱敏引擎。
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"文件 {file_path} 不存在")
+    desensitizer = _CountingDesensitizer(**(desensitizer_options or {}))
+    encoding = _detect_encoding(file_path)
+    size = _uncompressed_size(file_path)
+    if sample is not None and not 0 < sample <= 1:
+        raise ValueError(f"抽样比例必须在0到1之间: {sample}")
+    handler = STRUCTURED_HANDLERS.get(os.path.splitext(_strip_compression(file_path))[1].lower()) if structured else None
+    if handler is not None:
+        # 结构化模式依赖表头、JSON嵌套等上下文，不能从中间截取片段抽样
+        sample = None
+
+    # 抽样时的各块起始偏移（至少分成SAMPLE_CHUNKS块）；不抽样或抽样已覆盖整个文件时从头顺序读完
+    compressed = _compression_suffix(file_path) is not None
+    offsets = None
+    if sample and sample < 1 and compressed:
+        chunk_size = max(4096, int(size * sample))
+        if chunk_size < size:
+            offsets = [0]
+    elif sample and sample < 1:
+        target = size * sample
+        chunk_size = max(4096, min(chunk_size, int(target / SAMPLE_CHUNKS)))
+        chunk_count = max(1, int(target / chunk_size + 0.5))
+        if chunk_count * chunk_size < size:
+            offsets = [size * i // chunk_count for i in range(chunk_count)]
+
+    counts = {}
+    total = 0
+    scanned = 0
+    start_time = time.time()
+    if handler is not None:
+        # 按实际处理时的模式扫描，输出丢弃，统计实际替换的次数
+        with open_compressed(file_path, 'r', encoding=encoding, newline='') as src, \
+                open(os.devnull, 'w', encoding='utf-8', newline='') as dst:
+            handler(desensitizer, src, dst, **options)
+        counts = desensitizer.counts
+        total = sum(counts.values())
+        scanned = size
+    else:
+        with open_compressed(file_path, 'rb') as f:
+            for offset in offsets or [0]:
+                f.seek(offset)
+                if offset:
+                    # 跳过被截断的行
+                    f.readline()
+                while True:
+                    data = b''.join(f.readlines(chunk_size))
+                    if not data:
+                        break
+                    scanned += len(data)
+                    content = data.decode(encoding, errors='replace').replace('\r\n', '\n')
+                    for number, _, _ in desensitizer.extract_numbers(content):
+                        counts[number] = counts.get(number, 0) + 1
+                        total += 1
+                    if offsets:
+                        break
+    seconds = time.time() - start_time
+    if compressed and (not offsets or scanned >= size):
+        # 完整扫描了压缩文件，得到准确的解压后大小
+        size = scanned
+
+    scale = size / scanned if scanned else 1.0
+    unique = len(counts)
+    if scale > 1:
+        # 只出现一次的数字越多，未读到的部分中出现新数字的可能越大；
+        # 同时用Chao1估计量（unique + f1²/2f2）限制上界，避免取值范围有限时高估
+        singletons = sum(1 for count in counts.values() if count == 1)
+        doubletons = sum(1 for count in counts.values() if count == 2)
+        chao1 = unique + singletons * singletons / (2 * doubletons) if doubletons else float('inf')
+        projected_unique = int(min(unique + singletons * (scale - 1), chao1, total * scale))
+    else:
+        projected_unique = unique
+    average_value_length = sum(len(number) for number in counts) / unique if unique else 0
+    placeholder_length = (desensitizer.placeholder_length
+                          if desensitizer.placeholder_key is not None else None)
+    return {
+        'file': file_path,
+        'size': size,
+        'scanned_bytes': scanned,
+        'sampled': scale > 1,
+        'numbers': int(total * scale),
+        'unique_numbers': projected_unique,
+        'mapping_bytes': _estimate_mapping_bytes(projected_unique, average_value_length, placeholder_length),
+        'seconds': seconds * scale,
+    }
+
+
+def dry_run(input_path: str, desensitizer_options: Optional[dict] = None, sample: Optional[float] = None,
+            structured: bool = True, **options) -> List[dict]:
+    """试运行：对文件或目录中的所有文本文件只做统计，不生成任何输出文件，打印每个文件和合计的估算结果
+
+    structured和其余关键字参数（如include_columns）同desensitize_text_file，统计结果与实际处理一致。
+    """
+    if os.path.isdir(input_path):
+        paths = [os.path.join(input_path, filename) for filename in sorted(os.listdir(input_path))
+                 if _is_supported_file(filename)]
+    elif os.path.exists(input_path):
+        paths = [input_path]
+    else:
+        raise FileNotFoundError(f"路径 {input_path} 不存在")
+
+    results = []
+    for path in paths:
+        try:
+            result = scan_file(path, desensitizer_options, sample, structured=structured, **options)
+        except Exception as e:
+            print(f"扫描文件 {path} 时出错: {str(e)}")
+            continue
+        results.append(result)
+        note = f"（抽样 {result['scanned_bytes'] / result['size']:.1%}，为估算值）" if result['sampled'] else ''
+        print(f"{os.path.basename(path)}: {result['numbers']} 个数字（{result['unique_numbers']} 个不同），"
+              f"映射文件约 {_format_size(result['mapping_bytes'])}，预计耗时 {result['seconds']:.1f} 秒{note}")
+
+    print(f"试运行完成：共 {len(results)} 个文件（{_format_size(sum(r['size'] for r in results))}），"
+          f"预计脱敏 {sum(r['numbers'] for r in results)} 个数字，"
+          f"映射文件合计约 {_format_size(sum(r['mapping_bytes'] for r in results))}，"
+          f"预计耗时 {sum(r['seconds'] for r in results):.1f} 秒")
+    return results
+
+
+def iter_desensitize(lines, desensitizer: Optional[TextDesensitizer] = None):
+    """逐行脱敏的生成器：每处理完一行立即产出，内存占用与输入长度无关
+
+    传入desensitizer可在处理结束后取得映射关系（desensitizer.number_mapping），
+    未传入时使用带行缓存的默认实例。
+    """
+    if desensitizer is None:
+        desensitizer = TextDesensitizer(line_cache_size=10000)
+    yield from desensitizer.desensitize_lines(lines)
+
+
+def iter_restore(lines, mapping: Dict[str, str]):
+    """逐行还原的生成器，mapping为占位符->原始数字"""
+    for line in lines:
+        yield substitute_placeholders(line, mapping)
+
+
+def _write_lines(lines, dst, line_buffered: bool = False, flush_interval: float = 0.05):
+    """写出逐行结果：逐行刷新，或至少每隔flush_interval秒刷新一次"""
+    last_flush = time.monotonic()
+    for line in lines:
+        dst.write(line)
+        if line_buffered:
+            dst.flush()
+        else:
+            now = time.monotonic()
+            if now - last_flush >= flush_interval:
+                dst.flush()
+                last_flush = now
+    dst.flush()
+
+
+def desensitize_stream(src, dst, mapping_file_path: str, desensitizer: Optional[TextDesensitizer] = None,
+                       line_buffered: bool = False) -> TextDesensitizer:
+    """对文本流（如标准输入）逐行脱敏并写入输出流，结束后将映射关系保存到mapping_file_path"""
+    if desensitizer is None:
+        desensitizer = TextDesensitizer(line_cache_size=10000)
+    _write_lines(iter_desensitize(src, desensitizer), dst, line_buffered)
+    desensitizer.save_mapping(mapping_file_path)
+    return desensitizer
+
+
+def restore_stream(src, dst, mapping_file_path: str, line_buffered: bool = False):
+    """根据映射文件对文本流逐行还原并写入输出流"""
+    if not os.path.exists(mapping_file_path):
+        raise FileNotFoundError(f"映射文件 {mapping_file_path} 不存在")
+    mapping = TextDesensitizer().load_mapping(mapping_file_path)
+    _write_lines(iter_restore(src, mapping), dst, line_buffered)
+
+
+def iter_mapping_file(mapping_file_path: str):
+    """流式读取映射文件，逐个产出(占位符, 原始数字)，不一次性加载整个文件"""
+    with open(mapping_file_path, 'r', encoding='utf-8') as f:
+        key = None
+        for kind, text in _iter_json_tokens(f):
+            if kind != 'string':
+                continue
+            if key is None:
+                key = json.loads(text)
+            else:
+                yield key, json.loads(text)
+                key = None
+
+
+def _find_mapped_files(mapping_file_path: str) -> List[str]:
+    """查找映射文件对应的脱敏文件（xxx_map.json 对应同目录下的 xxx.* 和压缩后的 xxx.*.gz 等）"""
+    directory = os.path.dirname(mapping_file_path) or '.'
+    map_name = os.path.basename(mapping_file_path)
+    prefix = map_name[:-len('_map.json')] if map_name.endswith('_map.json') else os.path.splitext(map_name)[0]
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name != map_name and os.path.splitext(_strip_compression(name))[0] == prefix)
+
+
+def _rewrite_placeholders_file(task: Tuple[str, str, Dict[str, str]]) -> str:
+    """按重编号表单遍替换文件中的占位符（供进程池调用）"""
+    src_path, dst_path, table = task
+    encoding = _detect_encoding(src_path)
+    with open_compressed(src_path, 'r', encoding=encoding, newline='') as src, \
+            open_compressed(dst_path, 'w', encoding='utf-8', newline='') as dst:
+        for line in src:
+            dst.write(substitute_placeholders(line, table))
+    return dst_path
+
+
+def merge_mapping_files(mapping_files: List[str], output_path: str, rewrite_dir: Optional[str] = None,
+                        workers: Optional[int] = None) -> Dict[str, Dict[str, str]]:
+    """合并多个映射文件为一个去重后的映射，返回每个源映射的重编号表（旧占位符->新占位符）
+
+    相同的原始数字合并为同一个占位符，顺序占位符（￥1￥）按出现顺序重新编号，
+    确定性占位符保持不变。指定rewrite_dir时，每个映射文件对应的脱敏文件
+    按重编号表单遍替换后写入该目录，多个文件并行处理。
+    """
+    merged = TextDesensitizer()
+    renumber_tables = {}
+    for mapping_file in mapping_files:
+        if not os.path.exists(mapping_file):
+            raise FileNotFoundError(f"映射文件 {mapping_file} 不存在")
+        table = {}
+        for placeholder, number in iter_mapping_file(mapping_file):
+            if number not in merged.number_mapping and not re.fullmatch(r'￥\d+￥', placeholder):
+                # 确定性占位符原样保留，只检查是否与其他数字冲突
+                existing = merged.placeholder_values.setdefault(placeholder, number)
+                if existing != number:
+                    raise ValueError(f"占位符冲突：{placeholder} 在不同映射中对应 {existing} 和 {number}")
+                merged.fixed_placeholders[number] = placeholder
+            table[placeholder] = merged.add_to_mapping(number)
+        renumber_tables[mapping_file] = table
+
+    merged.save_mapping(output_path)
+    # 重编号表：merged_map.json -> merged_renumber.json
+    renumber_base = os.path.splitext(output_path)[0]
+    if renumber_base.endswith('_map'):
+        renumber_base = renumber_base[:-len('_map')]
+    with open(f"{renumber_base}_renumber.json", 'w', encoding='utf-8') as f:
+        json.dump(renumber_tables, f, ensure_ascii=False, indent=2)
+
+    if rewrite_dir is not None:
+        os.makedirs(rewrite_dir, exist_ok=True)
+        tasks = []
+        for mapping_file, table in renumber_tables.items():
+            # 只需要替换编号发生变化的占位符
+            changed = {old: new for old, new in table.items() if old != new}
+            for src_path in _find_mapped_files(mapping_file):
+                tasks.append((src_path, os.path.join(rewrite_dir, os.path.basename(src_path)), changed))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for dst_path in executor.map(_rewrite_placeholders_file, tasks):
+                print(f"已重写文件: {dst_path}")
+
+    print(f"已合并 {len(mapping_files)} 个映射文件，共 {len(merged.number_mapping)} 个数字")
+    print(f"合并后的映射已保存至: {output_path}")
+    return renumber_tables
+
+
+def merge_maps_main(argv: List[str]):
+    """merge-maps子命令：合并映射文件"""
+    parser = argparse.ArgumentParser(prog='advanced_desensitize_markdown.py merge-maps',
+                                     description='合并多个映射文件并重新编号占位符')
+    parser.add_argument('inputs', nargs='+', help='映射文件或包含*_map.json的目录')
+    parser.add_argument('-o', '--output', required=True, help='合并后的映射文件路径')
+    parser.add_argument('--rewrite-dir', help='按新编号重写对应脱敏文件的输出目录')
+    parser.add_argument('--workers', type=int, help='重写文件时的并行进程数（默认为CPU核数）')
+    args = parser.parse_args(argv)
+
+    mapping_files = []
+    for path in args.inputs:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                mapping_files.extend(os.path.join(root, name) for name in sorted(files) if name.endswith('_map.json'))
+        else:
+            mapping_files.append(path)
+    merge_mapping_files(mapping_files, args.output, args.rewrite_dir, args.workers)
+
+
+def _iter_fixed_chunks(pieces, size: int):
+    """把任意长度的文本片段重新切分为固定长度的块（最后一块可能较短）"""
+    buf = []
+    length = 0
+    for piece in pieces:
+        buf.append(piece)
+        length += len(piece)
+        if length >= size:
+            data = ''.join(buf)
+            end = len(data) - len(data) % size
+            for start in range(0, end, size):
+                yield data[start:start + size]
+            buf = [data[end:]]
+            length = len(buf[0])
+    if length:
+        yield ''.join(buf)
+
+
+def verify_file(original_path: str, desensitized_path: str, mapping_file_path: Optional[str] = None,
+                chunk_size: int = 1 << 20) -> dict:
+    """校验脱敏文件还原后与原文件一致：两边都流式读取并按固定长度分块比较，不加载整个文件
+
+    未指定映射文件时使用脱敏文件旁的<文件名>_map.json。两边都不转换换行符（newline=''），CRLF和LF视为不同，
+    返回的offset为第一处不一致的字符偏移（一致时为None），digest为原文件内容的SHA-256。
+    """
+    if mapping_file_path is None:
+        mapping_file_path = f"{os.path.splitext(_strip_compression(desensitized_path))[0]}_map.json"
+    result = {'file': original_path, 'ok': False, 'offset': None, 'line': None, 'digest': None, 'error': None}
+    try:
+        for path in (original_path, desensitized_path, mapping_file_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"文件 {path} 不存在")
+        mapping = TextDesensitizer().load_mapping(mapping_file_path)
+        digest = hashlib.sha256()
+        offset = 0
+        line = 1
+        with open_compressed(original_path, 'r', encoding=_detect_encoding(original_path), newline='') as original, \
+                open_compressed(desensitized_path, 'r', encoding=_detect_encoding(desensitized_path),
+                                newline='') as desensitized:
+            original_chunks = _iter_fixed_chunks(iter(lambda: original.read(chunk_size), ''), chunk_size)
+            restored_chunks = _iter_fixed_chunks(iter_restore(desensitized, mapping), chunk_size)
+            for expected, actual in zip_longest(original_chunks, restored_chunks, fillvalue=''):
+                if expected != actual:
+                    # 在不一致的块内定位第一个不同的字符
+                    index = next((i for i, (a, b) in enumerate(zip(expected, actual)) if a != b),
+                                 min(len(expected), len(actual)))
+                    result['offset'] = offset + index
+                    result['line'] = line + expected.count('\n', 0, index)
+                    return result
+                digest.update(expected.encode('utf-8'))
+                offset += len(expected)
+                line += expected.count('\n')
+        result['ok'] = True
+        result['digest'] = digest.hexdigest()
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+def _verify_task(task) -> dict:
+    """进程池任务：校验单个文件"""
+    return verify_file(*task)
+
+
+def verify_directory(original_dir: str, desensitized_dir: str, mapping_file_path: Optional[str] = None,
+                     workers: Optional[int] = None) -> List[dict]:
+    """并行校验目录树中所有文件的还原结果，返回每个文件的校验结果"""
+    if not os.path.exists(original_dir):
+        raise FileNotFoundError(f"目录 {original_dir} 不存在")
+    if not os.path.exists(desensitized_dir):
+        raise FileNotFoundError(f"目录 {desensitized_dir} 不存在")
+
+    tasks = []
+    for root, _, files in os.walk(original_dir):
+        for filename in sorted(files):
+            if _is_supported_file(filename):
+                original_path = os.path.join(root, filename)
+                relative_path = os.path.relpath(original_path, original_dir)
+                tasks.append((original_path, os.path.join(desensitized_dir, relative_path), mapping_file_path))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_verify_task, tasks))
+
+
+def verify_main(argv: List[str]):
+    """verify子命令：校验脱敏结果能否无损还原"""
+    parser = argparse.ArgumentParser(prog='advanced_desensitize_markdown.py verify',
+                                     description='校验脱敏文件还原后与原文件完全一致（可在删除原文件前使用）')
+    parser.add_argument('original', help='原文件或原目录')
+    parser.add_argument('desensitized', help='脱敏后的文件或目录')
+    parser.add_argument('-m', '--mapping', help='映射文件路径（默认使用每个脱敏文件旁的 *_map.json）')
+    parser.add_argument('--workers', type=int, help='并行进程数（默认为CPU核数）')
+    args = parser.parse_args(argv)
+
+    if os.path.isdir(args.original):
+        results = verify_directory(args.original, args.desensitized, args.mapping, args.workers)
+    else:
+        results = [verify_file(args.original, args.desensitized, args.mapping)]
+
+    failed = [result for result in results if not result['ok']]
+    for result in failed:
+        if result['error']:
+            print(f"校验出错: {result['file']}: {result['error']}")
+        else:
+            print(f"还原结果不一致: {result['file']}（第{result['line']}行，字符偏移 {result['offset']}）")
+    print(f"已校验 {len(results)} 个文件，{len(results) - len(failed)} 个一致，{len(failed)} 个不一致或出错")
+    if failed:
+        sys.exit(1)
+
+
+def build_list_main(argv: List[str]):
+    """build-list子命令：把文本格式的取值名单转换为内存映射的二进制文件"""
+    parser = argparse.ArgumentParser(prog='advanced_desensitize_markdown.py build-list',
+                                     description='把取值名单（每行一个取值）转换为可内存映射的二进制文件')
+    parser.add_argument('inputs', nargs='+', help='文本格式的名单文件')
+    parser.add_argument('-o', '--output', required=True, help='输出的二进制名单文件路径')
+    args = parser.parse_args(argv)
+
+    for path in args.inputs:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"名单文件 {path} 不存在")
+    start_time = time.time()
+    count = build_value_list(chain.from_iterable(_iter_value_lines(path) for path in args.inputs), args.output)
+    print(f"名单文件已生成: {args.output}（{count} 个取值，耗时 {time.time() - start_time:.1f} 秒）")
+
+
+def load_placeholder_key(key_file: Optional[str] = None) -> Optional[bytes]:
+    """读取确定性占位符的密钥（密钥文件优先，其次为环境变量），都未提供时返回None"""
+    if key_file:
+        if not os.path.exists(key_file):
+            raise FileNotFoundError(f"密钥文件 {key_file} 不存在")
+        with open(key_file, 'rb') as f:
+            key = f.read().strip()
+    else:
+        key = os.environ.get('DESENSITIZE_PLACEHOLDER_KEY', '').encode('utf-8')
+    return key or None
+
+
+# 守护进程默认监听的Unix socket路径（可用环境变量DESENSITIZE_DAEMON_SOCKET修改）
+def _default_daemon_socket() -> str:
+    """默认socket路径：优先使用当前用户私有的$XDG_RUNTIME_DIR，否则使用临时目录下按用户区分的子目录"""
+    if os.environ.get('DESENSITIZE_DAEMON_SOCKET'):
+        return os.environ['DESENSITIZE_DAEMON_SOCKET']
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if not runtime_dir:
+        user = os.getuid() if hasattr(os, 'getuid') else os.environ.get('USERNAME', 'user')
+        runtime_dir = os.path.join(tempfile.gettempdir(), f'desensitize-{user}')
+    return os.path.join(runtime_dir, 'desensitize.sock')
+
+
+DEFAULT_DAEMON_SOCKET = _default_daemon_socket()
+
+
+def _check_socket_dir(socket_path: str):
+    """检查socket所在目录是当前用户所有、权限为0700的目录（不能是符号链接），否则抛出PermissionError
+
+    目录可能被其他用户抢先创建（如临时目录下的desensitize-<uid>），此时对方可以替换socket、读取或篡改任务。
+    """
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) != 0o700:
+        raise PermissionError(f"socket目录 {directory} 不是当前用户所有、权限为0700的目录，拒绝使用")
+
+
+# 守护进程工作进程中常驻的状态：脱敏器参数（规则、名单等已加载）和已加载的映射文件
+_daemon_state = {'desensitizer_options': {}, 'mappings': OrderedDict()}
+# 每个工作进程最多缓存的映射文件个数
+DAEMON_MAPPING_CACHE_SIZE = 32
+
+
+def _init_daemon_worker(desensitizer_options: dict):
+    """工作进程初始化：保存一次加载好的脱敏器参数"""
+    _daemon_state['desensitizer_options'] = desensitizer_options
+
+
+def _cached_mapping(mapping_file_path: str) -> Dict[str, str]:
+    """读取映射文件，按路径和修改时间缓存（LRU）"""
+    if not os.path.exists(mapping_file_path):
+        raise FileNotFoundError(f"映射文件 {mapping_file_path} 不存在")
+    key = (mapping_file_path, os.path.getmtime(mapping_file_path))
+    mappings = _daemon_state['mappings']
+    if key in mappings:
+        mappings.move_to_end(key)
+    else:
+        mappings[key] = TextDesensitizer().load_mapping(mapping_file_path)
+        if len(mappings) > DAEMON_MAPPING_CACHE_SIZE:
+            mappings.popitem(last=False)
+    return mappings[key]
+
+
+def run_job(job: dict, desensitizer_options: Optional[dict] = None) -> dict:
+    """执行一个任务并返回JSON可序列化的结果（守护进程和客户端的进程内回退共用）
+
+    desensitizer_options为脱敏器参数（见_engine_options），未指定时使用守护进程工作进程初始化时加载的参数。
+
+    任务格式：{"id": ..., "action": "desensitize"|"restore"|"verify"|"ping", "input": 路径, ...}
+    - desensitize: output、plain、stream、options（结构化模式参数，如include_columns）
+    - restore: mapping、output
+    - verify: desensitized、mapping
+    执行过程中的提示信息收集在结果的messages中，不写到标准输出。
+    """
+    start_time = time.time()
+    response = {'id': job.get('id'), 'ok': False}
+    messages = io.StringIO()
+    try:
+        action = job.get('action', 'desensitize')
+        with contextlib.redirect_stdout(messages):
+            if action == 'ping':
+                result = {'pid': os.getpid()}
+            elif action == 'desensitize':
+                options = dict(_daemon_state['desensitizer_options'] if desensitizer_options is None
+                               else desensitizer_options)
+                options['line_cache_size'] = 10000 if job.get('stream') else 0
+                result = desensitize_text_file(job['input'], job.get('output'), not job.get('plain', False),
+                                               options, bool(job.get('stream')), **(job.get('options') or {}))
+            elif action == 'restore':
+                if not os.path.exists(job['input']):
+                    raise FileNotFoundError(f"文件 {job['input']} 不存在")
+                mapping = _cached_mapping(job['mapping'])
+                base_name, ext = os.path.splitext(_strip_compression(job['input']))
+                output_path = job.get('output') or f"{base_name}_restored{ext}{_compression_suffix(job['input']) or ''}"
+                with open_compressed(job['input'], 'r', encoding=_detect_encoding(job['input']), newline='') as src, \
+                        open_compressed(output_path, 'w', encoding='utf-8', newline='') as dst:
+                    dst.writelines(iter_restore(src, mapping))
+                result = {'output': output_path}
+            elif action == 'verify':
+                result = verify_file(job['input'], job['desensitized'], job.get('mapping'))
+            else:
+                raise ValueError(f"不支持的任务类型: {action}")
+        response['ok'] = not (action == 'verify' and not result['ok'])
+        response['result'] = result
+    except KeyError as e:
+        response['error'] = f"任务缺少参数: {e.args[0]}"
+    except Exception as e:
+        response['error'] = str(e)
+    response['messages'] = messages.getvalue()
+    response['seconds'] = round(time.time() - start_time, 6)
+    return response
+
+
+def _parse_job(line: str) -> dict:
+    """解析一行JSON任务，格式错误时返回带错误信息的任务"""
+    try:
+        job = json.loads(line)
+        if not isinstance(job, dict):
+            raise ValueError("任务必须是JSON对象")
+        return job
+    except ValueError as e:
+        return {'action': 'invalid', 'error': f"任务格式错误: {e}"}
+
+
+def _submit_job(executor, job: dict):
+    """提交任务到进程池；格式错误的任务直接返回已完成的结果"""
+    if job.get('action') == 'invalid':
+        future = Future()
+        future.set_result({'id': None, 'ok': False, 'error': job['error']})
+        return future
+    return executor.submit(run_job, job)
+
+
+def serve(socket_path: Optional[str] = None, workers: Optional[int] = None,
+          desensitizer_options: Optional[dict] = None, src=None, dst=None):
+    """守护进程：常驻进程池处理任务，省去每个文件启动解释器、导入模块和加载规则的开销
+
+    指定socket_path时监听Unix socket，每个连接按行发送JSON任务、按行收到结果；
+    否则从src（默认标准输入）读取JSONL任务，结果按完成顺序写到dst（默认标准输出），输入结束后退出。
+    """
+    src = sys.stdin if src is None else src
+    dst = sys.stdout if dst is None else dst
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_daemon_worker,
+                             initargs=(desensitizer_options or {},)) as executor:
+        if socket_path is None:
+            lock = threading.Lock()
+
+            def write_response(future):
+                with lock:
+                    dst.write(json.dumps(future.result(), ensure_ascii=False) + '\n')
+                    dst.flush()
+
+            futures = []
+            for line in src:
+                if line.strip():
+                    future = _submit_job(executor, _parse_job(line))
+                    future.add_done_callback(write_response)
+                    futures.append(future)
+            wait(futures)
+            return
+
+        if not hasattr(socket, 'AF_UNIX'):
+            raise OSError("当前系统不支持Unix socket，请改用标准输入模式")
+
+        class JobHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    response = _submit_job(executor, _parse_job(line.decode('utf-8'))).result()
+                    self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+                    self.wfile.flush()
+
+        # socket所在目录仅当前用户可访问（已存在的目录也要检查）；已存在的路径只有是socket时才删除
+        os.makedirs(os.path.dirname(os.path.abspath(socket_path)), mode=0o700, exist_ok=True)
+        _check_socket_dir(socket_path)
+        if os.path.lexists(socket_path):
+            if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+                raise FileExistsError(f"{socket_path} 已存在且不是socket，拒绝删除")
+            os.remove(socket_path)
+        old_umask = os.umask(0o077)
+        try:
+            server = socketserver.ThreadingUnixStreamServer(socket_path, JobHandler)
+        finally:
+            os.umask(old_umask)
+        os.chmod(socket_path, 0o600)
+        server.daemon_threads = True
+        print(f"守护进程已启动，监听 {socket_path}（按Ctrl+C退出）", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if os.path.lexists(socket_path) and stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+                os.remove(socket_path)
+
+
+def daemon_main(argv: List[str]):
+    """daemon子命令：启动常驻的脱敏守护进程"""
+    parser = argparse.ArgumentParser(prog='advanced_desensitize_markdown.py daemon',
+                                     description='常驻守护进程：通过Unix socket或标准输入(JSONL)接收任务并并行处理')
+    parser.add_argument('--socket', nargs='?', const=DEFAULT_DAEMON_SOCKET,
+                        help=f'监听的Unix socket路径（不带路径时为{DEFAULT_DAEMON_SOCKET}）；不指定时从标准输入读取任务')
+    parser.add_argument('--workers', type=int, help='并行进程数（默认为CPU核数）')
+    _add_engine_arguments(parser)
+    args = parser.parse_args(argv)
+    serve(args.socket, args.workers, _engine_options(args))
+
+
+def _add_engine_arguments(parser: argparse.ArgumentParser):
+    """添加创建脱敏器所需的命令行参数（主命令和daemon子命令共用）"""
+    parser.add_argument('--skip-code-blocks', action='store_true', help='跳过Markdown围栏代码块（```或~~~）中的数字')
+    parser.add_argument('--skip-front-matter', action='store_true', help='跳过Markdown文件开头的front matter')
+    parser.add_argument('--placeholder-key-file', help='确定性占位符的密钥文件；也可通过环境变量DESENSITIZE_PLACEHOLDER_KEY提供，'
+                                                       '相同密钥下各进程对相同数字生成相同占位符，映射文件可直接合并')
+    parser.add_argument('--rules', help='自定义规则文件（.json或.toml），声明需要保留或强制脱敏的正则及优先级')
+    parser.add_argument('--keywords', help='关键词表文件（每行一个），紧跟在这些关键词后的数字保持原样')
+    parser.add_argument('--allowlist', help='白名单文件（每行一个取值，或build-list生成的二进制文件），其中的数字从不脱敏')
+    parser.add_argument('--denylist', help='黑名单文件（格式同白名单），其中的数字总是脱敏，不受保留规则限制')
+
+
+def _engine_options(args) -> dict:
+    """根据命令行参数创建脱敏器参数，规则、关键词、名单等只加载一次"""
+    return {
+        'skip_code_blocks': args.skip_code_blocks,
+        'skip_front_matter': args.skip_front_matter,
+        'placeholder_key': load_placeholder_key(args.placeholder_key_file),
+        'rules': load_rules(args.rules) if args.rules else None,
+        'keywords': load_keywords(args.keywords) if args.keywords else None,
+        'allowlist': load_value_list(args.allowlist) if args.allowlist else None,
+        'denylist': load_value_list(args.denylist) if args.denylist else None,
+    }
+
+
+# 子命令：名称 -> 入口函数(argv)
+SUBCOMMANDS = {
+    'merge-maps': merge_maps_main,
+    'build-list': build_list_main,
+    'verify': verify_main,
+    'daemon': daemon_main,
+}
+
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in SUBCOMMANDS:
+        SUBCOMMANDS[argv[0]](argv[1:])
+        return
+
+    parser = argparse.ArgumentParser(description='对文本文件进行数字脱敏处理',
+                                     epilog='子命令：merge-maps（合并映射文件）、build-list（生成二进制取值名单）、verify（校验还原结果）、daemon（常驻守护进程）')
+    parser.add_argument('input', help='输入文件、目录或ZIP/tar归档路径，"-"表示从标准输入读取并输出到标准输出')
     parser.add_argument('-o', '--output', help='输出文件或目录路径')
     parser.add_argument('-r', '--restore', action='store_true', help='还原模式（需要提供映射文件）')
-    parser.add_argument('-m', '--mapping', help='映射文件路径（用于还原模式）')
+    parser.add_argument('-m', '--mapping', help='映射文件路径（用于还原模式；管道模式脱敏时为映射文件的保存路径）')
+    parser.add_argument('--encoding', default='utf-8', help='管道模式下标准输入的编码（默认utf-8）')
+    parser.add_argument('--line-buffered', action='store_true', help='管道模式下每输出一行立即刷新')
+    parser.add_argument('--plain', action='store_true', help='按纯文本处理所有文件（关闭CSV等结构化模式）')
+    parser.add_argument('--columns', help='CSV/SQL模式下需要脱敏的列名，逗号分隔（默认自动识别；SQL模式也可用从1开始的列序号）')
+    parser.add_argument('--exclude-columns', help='CSV/SQL模式下保持原样的列名，逗号分隔')
+    parser.add_argument('--attributes', help='HTML/XML模式下需要脱敏的属性名，逗号分隔（默认只处理文本节点）')
+    parser.add_argument('--stream', action='store_true', help='逐行流式处理文本文件（适合大文件和日志）')
+    parser.add_argument('--workers', type=int, help='并行进程数：处理目录时同时处理的文件数；'
+                                                 '处理单个大文件（不小于32MB）时拆分后并行处理，结果与串行处理一致')
+    parser.add_argument('--timeout', type=float, help='处理目录时每个文件的最长耗时（秒），超时的文件改用流式模式重试')
+    parser.add_argument('--memory-budget', type=float, help='每个文件的内存预算（MB）：预计整段处理会超出预算的文件自动改用流式处理')
+    parser.add_argument('--line-cache', type=int, default=10000, help='流式处理时缓存的不同行数量，0表示关闭（默认10000）')
+    parser.add_argument('--keys', help='JSON模式下需要脱敏的键路径，逗号分隔，支持通配符（如 users.phone,*.salary）')
+    parser.add_argument('--exclude-keys', help='JSON模式下保持原样的键路径，逗号分隔，支持通配符')
+    _add_engine_arguments(parser)
+    parser.add_argument('--dry-run', action='store_true', help='试运行：只统计将被脱敏的数字个数、映射文件大小和耗时，不写任何文件')
+    parser.add_argument('--sample', type=float, help='试运行时每个文件只抽样读取的比例（如0.01），结果按比例外推')
+    parser.add_argument('--code-targets', help='Python/JavaScript/TypeScript源代码模式下的处理对象，逗号分隔，'
+                                               '可选 numbers,strings,comments（默认全部）')
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+
+    # 结构化模式的参数
+    options = {
+        'include_columns': args.columns.split(',') if args.columns else None,
+        'exclude_columns': args.exclude_columns.split(',') if args.exclude_columns else None,
+        'include_keys': args.keys.split(',') if args.keys else None,
+        'exclude_keys': args.exclude_keys.split(',') if args.exclude_keys else None,
+        'attributes': args.attributes.split(',') if args.attributes else None,
+        'code_targets': args.code_targets.split(',') if args.code_targets else None,
+    }
+    structured = not args.plain
+    memory_budget = int(args.memory_budget * 1024 * 1024) if args.memory_budget else None
+    desensitizer_options = _engine_options(args)
+    desensitizer_options['line_cache_size'] = args.line_cache if args.stream else 0
+
+    if args.dry_run:
+        dry_run(args.input, desensitizer_options, args.sample, structured, **options)
+        return
+
+    if args.input == '-':
+        # 管道模式：标准输入 -> 标准输出（或-o指定的文件），提示信息输出到标准错误
+        if not args.mapping:
+            print("错误：管道模式需要用 -m 指定映射文件路径", file=sys.stderr)
+            sys.exit(1)
+        src = io.TextIOWrapper(sys.stdin.buffer, encoding=args.encoding)
+        dst = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+        try:
+            if args.restore:
+                restore_stream(src, dst, args.mapping, args.line_buffered)
+            else:
+                desensitizer_options['line_cache_size'] = args.line_cache
+                desensitizer = desensitize_stream(src, dst, args.mapping, TextDesensitizer(**desensitizer_options),
+                                                  args.line_buffered)
+                print(f"共脱敏 {len(desensitizer.number_mapping)} 个数字，映射关系已保存至: {args.mapping}", file=sys.stderr)
+        finally:
+            if dst is not sys.stdout:
+                dst.close()
+        return
     
+    archive = os.path.isfile(args.input) and _archive_suffix(args.input) is not None
     if args.restore:
-        # 还原模式
-        if not args.mapping:
+        # 还原模式（归档文件可使用其中的映射文件成员）
+        if not args.mapping and not archive:
             print("错误：还原模式需要指定映射文件 (-m)")
             sys.exit(1)
         
-        if os.path.isfile(args.input):
+        if archive:
+            # 还原ZIP/tar归档
+            restore_archive(args.input, args.mapping, args.output)
+        elif os.path.isfile(args.input):
             # 还原单个文件
             restore_text_file(args.input, args.mapping, args.output)
         elif os.path.isdir(args.input):
@@ -457,12 +3480,17 @@ def main():
         else:
             print("错误：输入路径既不是文件也不是目录")
             sys.exit(1)
+    elif archive:
+        # 处理ZIP/tar归档，不解压
+        desensitize_archive(args.input, args.output, structured, desensitizer_options, **options)
     elif os.path.isfile(args.input):
         # 处理单个文件
-        desensitize_text_file(args.input, args.output)
+        desensitize_text_file(args.input, args.output, structured, desensitizer_options, args.stream, args.workers,
+                              memory_budget, **options)
     elif os.path.isdir(args.input):
         # 处理整个目录
-        process_directory(args.input, args.output)
+        process_directory(args.input, args.output, structured, desensitizer_options, args.stream, args.workers,
+                          args.timeout, memory_budget, **options)
     else:
         print("错误：输入路径既不是文件也不是目录")
         sys.exit(1)
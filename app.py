@@ -10,12 +10,15 @@ import json
 import zipfile
 from io import BytesIO
 from pathlib import Path
+import os
 import sys
 
 # 添加当前目录到路径
 sys.path.insert(0, str(Path(__file__).parent))
 
-from advanced_desensitize_markdown import TextDesensitizer
+from advanced_desensitize_markdown import TextDesensitizer, ARCHIVE_FORMATS, _archive_suffix
+from advanced_desensitize_markdown import COMPRESSION_OPENERS, _compression_suffix, _strip_compression, _is_supported_file
+from advanced_desensitize_markdown import desensitize_archive_stream, restore_archive_stream
 
 # 页面配置
 st.set_page_config(
@@ -48,6 +51,8 @@ with st.sidebar:
     - CSV (.csv)
     - JSON (.json)
     - 其他文本格式
+    - gzip/bz2/xz压缩的文本文件（如 .log.gz）
+    - ZIP/tar归档（直接处理其中的文本文件）
     """)
     
     st.divider()
@@ -65,7 +70,7 @@ with tab1:
     # 文件上传
     uploaded_files = st.file_uploader(
         "选择要脱敏的文件（可多选）",
-        type=['md', 'txt', 'csv', 'json', 'xml', 'html', 'py', 'js'],
+        type=['md', 'txt', 'csv', 'json', 'xml', 'html', 'py', 'js', 'zip', 'tar', 'gz', 'tgz', 'bz2', 'tbz2', 'xz', 'txz'],
         accept_multiple_files=True,
         key="desensitize_files"
     )
@@ -89,11 +94,35 @@ with tab1:
                     # 为每个文件创建新的desensitizer实例
                     desensitizer = TextDesensitizer()
 
-                    # 读取文件内容
+                    suffix = _archive_suffix(file.name)
+                    if suffix is not None:
+                        # 归档文件：逐个成员流式脱敏，直接生成同格式的归档（包含映射文件成员）
+                        archive_buffer = BytesIO()
+                        members = desensitize_archive_stream(desensitizer, file, archive_buffer, ARCHIVE_FORMATS[suffix])
+                        mapping = {v: k for k, v in desensitizer.number_mapping.items()}
+                        results.append({
+                            'filename': file.name,
+                            'suffix': suffix,
+                            'archive_data': archive_buffer.getvalue(),
+                            'original_content': f"归档文件，共 {members} 个文本文件",
+                            'desensitized_content': f"归档文件，共 {members} 个文本文件",
+                            'mapping': mapping,
+                            'count': len(mapping)
+                        })
+                        continue
+
+                    # 读取文件内容（.gz/.bz2/.xz压缩的文本文件先解压）
+                    data = file.getvalue()
+                    compression = _compression_suffix(file.name)
+                    if compression is not None:
+                        if not _is_supported_file(file.name):
+                            raise ValueError(f"不支持的压缩文件: {file.name}")
+                        with COMPRESSION_OPENERS[compression](BytesIO(data), 'rb') as f:
+                            data = f.read()
                     try:
-                        content = file.read().decode('utf-8')
+                        content = data.decode('utf-8')
                     except UnicodeDecodeError:
-                        content = file.read().decode('gbk')
+                        content = data.decode('gbk')
 
                     # 脱敏
                     desensitized_content = desensitizer.desensitize_content(content)
@@ -103,6 +132,7 @@ with tab1:
 
                     results.append({
                         'filename': file.name,
+                        'compression': compression,
                         'original_content': content,
                         'desensitized_content': desensitized_content,
                         'mapping': mapping,
@@ -142,12 +172,24 @@ with tab1:
                 zip_buffer = BytesIO()
                 with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
                     for result in results:
-                        # 添加脱敏文件
-                        desensitized_filename = f"{Path(result['filename']).stem}_desensitized{Path(result['filename']).suffix}"
-                        zip_file.writestr(desensitized_filename, result['desensitized_content'])
+                        if 'archive_data' in result:
+                            # 添加脱敏后的归档（保留原归档格式）
+                            archive_name = result['filename'][:-len(result['suffix'])]
+                            zip_file.writestr(f"{archive_name}_desensitized{result['suffix']}", result['archive_data'])
+                            continue
+
+                        # 添加脱敏文件（压缩文件按原格式压缩，如 app.log.gz -> app_desensitized.log.gz）
+                        base_name, ext = os.path.splitext(_strip_compression(result['filename']))
+                        desensitized_data = result['desensitized_content'].encode('utf-8')
+                        if result['compression'] is not None:
+                            compressed_buffer = BytesIO()
+                            with COMPRESSION_OPENERS[result['compression']](compressed_buffer, 'wb') as f:
+                                f.write(desensitized_data)
+                            desensitized_data = compressed_buffer.getvalue()
+                        zip_file.writestr(f"{base_name}_desensitized{ext}{result['compression'] or ''}", desensitized_data)
                         
                         # 添加映射文件
-                        mapping_filename = f"{Path(result['filename']).stem}_desensitized_map.json"
+                        mapping_filename = f"{base_name}_desensitized_map.json"
                         zip_file.writestr(mapping_filename, json.dumps(result['mapping'], ensure_ascii=False, indent=2))
                 
                 zip_buffer.seek(0)
@@ -174,7 +216,7 @@ with tab2:
         st.subheader("上传脱敏文件")
         desensitized_files = st.file_uploader(
             "选择脱敏后的文件",
-            type=['md', 'txt', 'csv', 'json', 'xml', 'html', 'py', 'js'],
+            type=['md', 'txt', 'csv', 'json', 'xml', 'html', 'py', 'js', 'zip', 'tar', 'gz', 'tgz', 'bz2', 'tbz2', 'xz', 'txz'],
             accept_multiple_files=True,
             key="restore_files"
         )
@@ -182,34 +224,58 @@ with tab2:
     with col2:
         st.subheader("上传映射文件")
         mapping_file = st.file_uploader(
-            "选择映射文件（JSON）",
+            "选择映射文件（JSON；归档文件可不上传，使用其中的映射文件）",
             type=['json'],
             key="mapping_file"
         )
     
     # 还原按钮
-    if st.button("🔓 开始还原", disabled=not (desensitized_files and mapping_file)):
+    # 只上传归档文件时可以不提供映射文件
+    archives_only = bool(desensitized_files) and all(_archive_suffix(file.name) for file in desensitized_files)
+    if st.button("🔓 开始还原", disabled=not (desensitized_files and (mapping_file or archives_only))):
         with st.spinner("正在还原..."):
             try:
                 # 读取映射文件
-                mapping = json.loads(mapping_file.read().decode('utf-8'))
+                mapping = json.loads(mapping_file.read().decode('utf-8')) if mapping_file else None
                 
                 desensitizer = TextDesensitizer()
                 results = []
                 
                 # 处理每个文件
                 for file in desensitized_files:
-                    # 读取文件内容
+                    suffix = _archive_suffix(file.name)
+                    if suffix is not None:
+                        # 归档文件：未上传映射文件时使用归档中的映射文件成员
+                        archive_buffer = BytesIO()
+                        members = restore_archive_stream(file, archive_buffer, ARCHIVE_FORMATS[suffix], mapping)
+                        results.append({
+                            'filename': file.name,
+                            'suffix': suffix,
+                            'archive_data': archive_buffer.getvalue(),
+                            'desensitized_content': f"归档文件，共 {members} 个文本文件",
+                            'restored_content': f"归档文件，共 {members} 个文本文件"
+                        })
+                        continue
+
+                    # 读取文件内容（.gz/.bz2/.xz压缩的文本文件先解压）
+                    data = file.getvalue()
+                    compression = _compression_suffix(file.name)
+                    if compression is not None:
+                        if not _is_supported_file(file.name):
+                            raise ValueError(f"不支持的压缩文件: {file.name}")
+                        with COMPRESSION_OPENERS[compression](BytesIO(data), 'rb') as f:
+                            data = f.read()
                     try:
-                        content = file.read().decode('utf-8')
+                        content = data.decode('utf-8')
                     except UnicodeDecodeError:
-                        content = file.read().decode('gbk')
+                        content = data.decode('gbk')
                     
                     # 还原
                     restored_content = desensitizer.restore_content(content, mapping)
                     
                     results.append({
                         'filename': file.name,
+                        'compression': compression,
                         'desensitized_content': content,
                         'restored_content': restored_content
                     })
@@ -237,9 +303,21 @@ with tab2:
                 zip_buffer = BytesIO()
                 with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
                     for result in results:
-                        # 添加还原文件
-                        restored_filename = f"{Path(result['filename']).stem}_restored{Path(result['filename']).suffix}"
-                        zip_file.writestr(restored_filename, result['restored_content'])
+                        if 'archive_data' in result:
+                            # 添加还原后的归档（保留原归档格式）
+                            archive_name = result['filename'][:-len(result['suffix'])]
+                            zip_file.writestr(f"{archive_name}_restored{result['suffix']}", result['archive_data'])
+                            continue
+
+                        # 添加还原文件（压缩文件按原格式压缩）
+                        base_name, ext = os.path.splitext(_strip_compression(result['filename']))
+                        restored_data = result['restored_content'].encode('utf-8')
+                        if result['compression'] is not None:
+                            compressed_buffer = BytesIO()
+                            with COMPRESSION_OPENERS[result['compression']](compressed_buffer, 'wb') as f:
+                                f.write(restored_data)
+                            restored_data = compressed_buffer.getvalue()
+                        zip_file.writestr(f"{base_name}_restored{ext}{result['compression'] or ''}", restored_data)
                 
                 zip_buffer.seek(0)
                 
@@ -312,6 +390,8 @@ with tab3:
     | HTML | .html, .htm | HTML网页 |
     | Python | .py | Python代码 |
     | JavaScript | .js | JavaScript代码 |
+    | 压缩文本 | .gz, .bz2, .xz（如 .log.gz） | 解压后脱敏，输出按原格式压缩 |
+    | 归档 | .zip, .tar, .tar.gz, .tgz, .tar.bz2, .tar.xz | 直接处理其中的文本文件，输出同格式归档并附带映射文件 |
     
     ### 4. 脱敏示例
     
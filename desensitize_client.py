@@ -0,0 +1,119 @@
+"""脱敏守护进程的轻量客户端
+
+只导入标准库中的少数模块，启动开销很小：连接守护进程执行任务，
+守护进程未启动或不可用时自动回退为在本进程内执行。
+"""
+import argparse
+import json
+import os
+import socket
+import stat
+import sys
+import tempfile
+from typing import Optional
+
+
+def _default_daemon_socket() -> str:
+    """默认socket路径，与advanced_desensitize_markdown.DEFAULT_DAEMON_SOCKET保持一致（不导入主模块以减少启动开销）"""
+    if os.environ.get('DESENSITIZE_DAEMON_SOCKET'):
+        return os.environ['DESENSITIZE_DAEMON_SOCKET']
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if not runtime_dir:
+        user = os.getuid() if hasattr(os, 'getuid') else os.environ.get('USERNAME', 'user')
+        runtime_dir = os.path.join(tempfile.gettempdir(), f'desensitize-{user}')
+    return os.path.join(runtime_dir, 'desensitize.sock')
+
+
+DEFAULT_DAEMON_SOCKET = _default_daemon_socket()
+
+
+def _check_socket_dir(socket_path: str):
+    """检查socket所在目录是当前用户所有、权限为0700的目录，与advanced_desensitize_markdown._check_socket_dir保持一致"""
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) != 0o700:
+        raise PermissionError(f"socket目录 {directory} 不是当前用户所有、权限为0700的目录，拒绝连接")
+
+
+def _add_engine_arguments(parser: argparse.ArgumentParser):
+    """添加脱敏器参数，与advanced_desensitize_markdown._add_engine_arguments保持一致（不导入主模块以减少启动开销）
+
+    连接守护进程时使用守护进程启动时的参数，这些参数只在回退为本进程内执行时生效，应与启动守护进程时相同。
+    """
+    parser.add_argument('--skip-code-blocks', action='store_true', help='跳过Markdown围栏代码块（```或~~~）中的数字')
+    parser.add_argument('--skip-front-matter', action='store_true', help='跳过Markdown文件开头的front matter')
+    parser.add_argument('--placeholder-key-file', help='确定性占位符的密钥文件；也可通过环境变量DESENSITIZE_PLACEHOLDER_KEY提供')
+    parser.add_argument('--rules', help='自定义规则文件（.json或.toml），声明需要保留或强制脱敏的正则及优先级')
+    parser.add_argument('--keywords', help='关键词表文件（每行一个），紧跟在这些关键词后的数字保持原样')
+    parser.add_argument('--allowlist', help='白名单文件（每行一个取值，或build-list生成的二进制文件），其中的数字从不脱敏')
+    parser.add_argument('--denylist', help='黑名单文件（格式同白名单），其中的数字总是脱敏，不受保留规则限制')
+
+
+# 脱敏器参数的默认值（键为_add_engine_arguments中各参数的dest）
+ENGINE_DEFAULTS = {'skip_code_blocks': False, 'skip_front_matter': False, 'placeholder_key_file': None,
+                   'rules': None, 'keywords': None, 'allowlist': None, 'denylist': None}
+
+
+def submit(job: dict, socket_path: str = DEFAULT_DAEMON_SOCKET, fallback: bool = True,
+           engine_args: Optional[dict] = None) -> dict:
+    """把任务发给守护进程并返回结果；连接失败且fallback为True时在本进程内执行
+
+    engine_args为回退时的脱敏器参数（键同ENGINE_DEFAULTS，如{'rules': 'rules.toml'}），
+    在本进程内按与主命令相同的方式加载，与守护进程使用相同的规则、关键词、名单和占位符密钥。
+    """
+    error = None
+    try:
+        # 不连接其他用户可以控制的socket
+        _check_socket_dir(socket_path)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+            sock.sendall(json.dumps(job, ensure_ascii=False).encode('utf-8') + b'\n')
+            with sock.makefile('rb') as reader:
+                line = reader.readline()
+        if line:
+            return json.loads(line)
+    except (OSError, AttributeError) as e:
+        # AttributeError: 当前系统没有AF_UNIX或os.getuid
+        error = e
+    if not fallback:
+        raise ConnectionError(f"无法连接守护进程 {socket_path}" + (f": {error}" if error else ''))
+    from advanced_desensitize_markdown import run_job, _engine_options
+    return run_job(job, _engine_options(argparse.Namespace(**dict(ENGINE_DEFAULTS, **(engine_args or {})))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='通过守护进程对文本文件进行数字脱敏处理（守护进程不可用时在本进程内执行）')
+    parser.add_argument('input', help='输入文件路径')
+    parser.add_argument('-o', '--output', help='输出文件路径')
+    parser.add_argument('-r', '--restore', action='store_true', help='还原模式（需要提供映射文件）')
+    parser.add_argument('-m', '--mapping', help='映射文件路径（用于还原模式）')
+    parser.add_argument('--plain', action='store_true', help='按纯文本处理（关闭CSV等结构化模式）')
+    parser.add_argument('--stream', action='store_true', help='逐行流式处理文本文件')
+    parser.add_argument('--socket', default=DEFAULT_DAEMON_SOCKET, help='守护进程的Unix socket路径')
+    parser.add_argument('--no-fallback', action='store_true', help='守护进程不可用时报错，而不是在本进程内执行')
+    _add_engine_arguments(parser)
+    args = parser.parse_args(argv)
+
+    input_path = os.path.abspath(args.input)
+    output_path = os.path.abspath(args.output) if args.output else None
+    if args.restore:
+        if not args.mapping:
+            print("错误：还原模式需要指定映射文件 (-m)")
+            sys.exit(1)
+        job = {'action': 'restore', 'input': input_path, 'output': output_path,
+               'mapping': os.path.abspath(args.mapping)}
+    else:
+        job = {'action': 'desensitize', 'input': input_path, 'output': output_path,
+               'plain': args.plain, 'stream': args.stream}
+
+    engine_args = {name: getattr(args, name) for name in ENGINE_DEFAULTS}
+    response = submit(job, args.socket, not args.no_fallback, engine_args)
+    if response.get('messages'):
+        print(response['messages'], end='')
+    if not response['ok']:
+        print(f"错误：{response.get('error')}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
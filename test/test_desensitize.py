@@ -1,12 +1,35 @@
 import unittest
+import unittest.mock
 import os
 import tempfile
 import sys
+import io
 import json
+import gzip
+import lzma
+import pickle
+import tarfile
+import zipfile
+from html.parser import HTMLParser
 # 添加当前目录到模块搜索路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from advanced_desensitize_markdown import TextDesensitizer, desensitize_text_file, restore_text_file, process_directory, process_directory_restore
+from advanced_desensitize_markdown import TextDesensitizer, ThreadSafeTextDesensitizer, desensitize_text_file, restore_text_file, process_directory, process_directory_restore
+from advanced_desensitize_markdown import desensitize_csv_stream, desensitize_json_stream, classify_markdown_lines
+from advanced_desensitize_markdown import desensitize_markup_stream, desensitize_python_stream, desensitize_script_stream
+from advanced_desensitize_markdown import desensitize_sql_stream, load_rules
+from advanced_desensitize_markdown import KeywordAutomaton, load_keywords
+from advanced_desensitize_markdown import build_value_list, load_value_list
+from advanced_desensitize_markdown import verify_file, verify_directory, scan_file, dry_run, serve
+from advanced_desensitize_markdown import desensitize_file_parallel, RuleSet, RestoreTable
+from advanced_desensitize_markdown import desensitize_archive, restore_archive, estimate_memory
+import threading
+import time
+import tracemalloc
+import desensitize_client
+import advanced_desensitize_markdown
+from advanced_desensitize_markdown import merge_mapping_files, substitute_placeholders
+from advanced_desensitize_markdown import iter_desensitize, desensitize_stream, restore_stream
 
 
 class TestTextDesensitize(unittest.TestCase):
@@ -243,5 +266,1167 @@ class TestTextDesensitize(unittest.TestCase):
             self.assertNotIn('￥', restored_content)
 
 
+class TestMarkdownBlocks(unittest.TestCase):
+    """Markdown块结构识别测试"""
+
+    markdown_content = """---
+version: 2024
+---
+# 1.1 概述
+
+- 深度500米
+| 名称 | 数值 |
+|------|------|
+| 产量 | 100 |
+
+```python
+x = 42
+```
+正文123
+"""
+
+    def test_classify_lines(self):
+        """测试每一行的块类型"""
+        kinds = [info.kind for _, info in classify_markdown_lines(self.markdown_content)]
+        self.assertEqual(kinds, [
+            'front_matter', 'front_matter', 'front_matter', 'heading', 'blank', 'list',
+            'table_header', 'table_separator', 'table_row', 'blank', 'code', 'code', 'code', 'paragraph', 'blank'])
+
+    def test_skip_code_blocks_and_front_matter(self):
+        """测试可选跳过围栏代码块和front matter"""
+        result = TextDesensitizer().desensitize_content(self.markdown_content)
+        self.assertNotIn('42', result)
+        self.assertNotIn('2024', result)
+
+        result = TextDesensitizer(skip_code_blocks=True, skip_front_matter=True).desensitize_content(self.markdown_content)
+        self.assertIn('x = 42', result)
+        self.assertIn('version: 2024', result)
+        self.assertIn('# 1.1 概述', result)
+        self.assertNotIn('500', result)
+        self.assertNotIn('123', result)
+
+
+class TestLineStreaming(unittest.TestCase):
+    """逐行流式处理和行缓存测试"""
+
+    log_lines = [
+        "2024-01-05 10:00:01 用户12345 登录成功，耗时35ms\n",
+        "2024-01-05 10:00:02 用户67890 登录失败\n",
+        "2024-01-05 10:00:01 用户12345 登录成功，耗时35ms\n",
+        "2024-01-05 10:00:01 用户12345 登录成功，耗时35ms\n",
+    ]
+
+    def test_placeholders_follow_first_occurrence(self):
+        """测试占位符按首次出现顺序分配，逐行结果与整段脱敏一致"""
+        content = ''.join(self.log_lines)
+        whole = TextDesensitizer()
+        expected = whole.desensitize_content(content)
+        self.assertEqual(whole.number_mapping['12345'], '￥1￥')
+
+        streaming = TextDesensitizer(line_cache_size=100)
+        self.assertEqual(''.join(streaming.desensitize_lines(self.log_lines)), expected)
+        self.assertEqual(streaming.number_mapping, whole.number_mapping)
+
+    def test_line_cache_hits_and_eviction(self):
+        """测试重复行命中缓存，缓存大小有上限"""
+        desensitizer = TextDesensitizer(line_cache_size=1)
+        list(desensitizer.desensitize_lines(self.log_lines))
+        info = desensitizer.line_cache_info()
+        self.assertEqual(info['hits'], 1)
+        self.assertEqual(info['misses'], 3)
+        self.assertEqual(info['size'], 1)
+
+    def test_stream_file_matches_whole_file(self):
+        """测试文件流式模式与整体读取模式输出一致"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_file = os.path.join(temp_dir, 'app.log')
+            with open(input_file, 'w', encoding='utf-8') as f:
+                f.writelines(self.log_lines)
+            desensitize_text_file(input_file, os.path.join(temp_dir, 'whole.log'))
+            desensitize_text_file(input_file, os.path.join(temp_dir, 'stream.log'),
+                                  desensitizer_options={'line_cache_size': 10}, stream=True)
+            for name in ('whole.log', 'whole_map.json'):
+                with open(os.path.join(temp_dir, name), 'r', encoding='utf-8') as f1, \
+                        open(os.path.join(temp_dir, name.replace('whole', 'stream')), 'r', encoding='utf-8') as f2:
+                    self.assertEqual(f1.read(), f2.read())
+
+
+class TestPipeMode(unittest.TestCase):
+    """管道模式和逐行生成器测试"""
+
+    def test_iter_desensitize_is_lazy(self):
+        """测试生成器处理完一行立即产出，不需要读完整个输入"""
+        def endless_lines():
+            count = 0
+            while True:
+                count += 1
+                yield f"第{count}条记录 数值{count * 100}\n"
+
+        desensitizer = TextDesensitizer()
+        generator = iter_desensitize(endless_lines(), desensitizer)
+        self.assertEqual(next(generator), "第￥1￥条记录 数值￥2￥\n")
+        self.assertEqual(next(generator), "第￥3￥条记录 数值￥4￥\n")
+        self.assertEqual(desensitizer.number_mapping['200'], '￥4￥')
+
+    def test_stream_round_trip(self):
+        """测试流式脱敏写出映射文件，再用流式还原得到原文"""
+        content = "深度500米\n宽度80米，深度500米\n"
+        with tempfile.TemporaryDirectory() as temp_dir:
+            mapping_file = os.path.join(temp_dir, 'pipe_map.json')
+            desensitized = io.StringIO()
+            desensitize_stream(io.StringIO(content), desensitized, mapping_file)
+            self.assertEqual(desensitized.getvalue(), "深度￥1￥米\n宽度￥2￥米，深度￥1￥米\n")
+
+            restored = io.StringIO()
+            restore_stream(io.StringIO(desensitized.getvalue()), restored, mapping_file)
+            self.assertEqual(restored.getvalue(), content)
+
+
+class TestKeyedPlaceholders(unittest.TestCase):
+    """确定性（密钥）占位符测试"""
+
+    def test_independent_workers_agree(self):
+        """测试相同密钥的不同实例对相同数字生成相同占位符，映射可直接合并"""
+        worker1 = TextDesensitizer(placeholder_key=b'secret')
+        worker2 = TextDesensitizer(placeholder_key=b'secret')
+        result1 = worker1.desensitize_content("产量500吨，深度1200米")
+        result2 = worker2.desensitize_content("深度1200米，宽度80米")
+        self.assertEqual(worker1.number_mapping['1200'], worker2.number_mapping['1200'])
+        self.assertRegex(worker1.number_mapping['500'], r'^￥[a-z2-7]{13}￥$')
+        self.assertNotEqual(TextDesensitizer(placeholder_key=b'other').add_to_mapping('1200'),
+                            worker1.number_mapping['1200'])
+
+        merged = {v: k for k, v in worker1.number_mapping.items()}
+        merged.update({v: k for k, v in worker2.number_mapping.items()})
+        self.assertEqual(worker1.restore_content(result1, merged), "产量500吨，深度1200米")
+        self.assertEqual(worker1.restore_content(result2, merged), "深度1200米，宽度80米")
+
+    def test_collision_detection(self):
+        """测试占位符过短导致冲突时报错"""
+        desensitizer = TextDesensitizer(placeholder_key=b'secret', placeholder_length=1)
+        with self.assertRaises(ValueError):
+            for i in range(100):
+                desensitizer.add_to_mapping(str(i))
+
+
+class TestMergeMaps(unittest.TestCase):
+    """映射文件合并与重编号测试"""
+
+    def test_substitute_placeholders(self):
+        """测试单遍占位符替换不受相邻￥符号影响"""
+        lookup = {'￥1￥': '500', '￥2￥': '80'}
+        self.assertEqual(substitute_placeholders('价格￥￥1￥，￥RMB￥2￥，￥1￥￥2￥', lookup), '价格￥500，￥RMB80，50080')
+
+    def test_merge_and_rewrite(self):
+        """测试合并重叠编号的映射文件，并重写脱敏文件后用合并映射还原"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            originals = {'a.txt': '深度500米，产量80吨\n', 'b.log.gz': '产量80吨，宽度1200米\n'}
+            map_files = []
+            for name, content in originals.items():
+                input_file = os.path.join(temp_dir, name)
+                with advanced_desensitize_markdown.open_compressed(input_file, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                desensitize_text_file(input_file)
+                map_files.append(os.path.join(temp_dir, f"{name.partition('.')[0]}_desensitized_map.json"))
+
+            merged_file = os.path.join(temp_dir, 'merged_map.json')
+            rewrite_dir = os.path.join(temp_dir, 'rewritten')
+            tables = merge_mapping_files(map_files, merged_file, rewrite_dir, workers=2)
+            self.assertEqual(tables[map_files[1]], {'￥1￥': '￥2￥', '￥2￥': '￥3￥'})
+            self.assertTrue(os.path.exists(os.path.join(temp_dir, 'merged_renumber.json')))
+
+            with open(merged_file, 'r', encoding='utf-8') as f:
+                self.assertEqual(json.load(f), {'￥1￥': '500', '￥2￥': '80', '￥3￥': '1200'})
+            for name, content in originals.items():
+                # 压缩的脱敏文件（b_desensitized.log.gz）也能按映射文件名找到并重写
+                stem, _, ext = name.partition('.')
+                rewritten = os.path.join(rewrite_dir, f"{stem}_desensitized.{ext}")
+                restored = os.path.join(temp_dir, name + '.restored')
+                restore_text_file(rewritten, merged_file, restored)
+                with open(restored, 'r', encoding='utf-8') as f:
+                    self.assertEqual(f.read(), content)
+
+
+class StreamModeTestCase(unittest.TestCase):
+    """结构化流式模式测试的基类"""
+
+    handler = None
+
+    def run_stream(self, content, handler=None, **options):
+        """用新的脱敏器以handler（默认为类的handler）处理content，返回(脱敏器, 输出文本)"""
+        desensitizer = TextDesensitizer()
+        dst = io.StringIO()
+        (handler or self.handler)(desensitizer, io.StringIO(content, newline=''), dst, **options)
+        return desensitizer, dst.getvalue()
+
+
+class TestCsvMode(StreamModeTestCase):
+    """CSV按列脱敏模式测试"""
+
+    handler = staticmethod(desensitize_csv_stream)
+
+    csv_content = "姓名,年龄,工资,工号,入职日期,备注\n张三,25,8500.50,1001,2020-01-05,电话13812345678\n李四,-30,9200.75,1002,2021-03-09,无\n"
+
+    def test_numeric_id_and_date_columns(self):
+        """测试数值列整列脱敏，编号列和日期列原样保留"""
+        desensitizer, result = self.run_stream(self.csv_content)
+        lines = result.splitlines()
+        self.assertEqual(lines[0], "姓名,年龄,工资,工号,入职日期,备注")
+        self.assertEqual(lines[1], "张三,￥1￥,￥2￥,1001,2020-01-05,电话￥3￥")
+        self.assertEqual(lines[2], "李四,-￥4￥,￥5￥,1002,2021-03-09,无")
+        restored = desensitizer.restore_content(result, {v: k for k, v in desensitizer.number_mapping.items()})
+        self.assertEqual(restored, self.csv_content)
+
+    def test_include_and_exclude_columns(self):
+        """测试按列名指定需要脱敏和保留的列"""
+        _, result = self.run_stream(self.csv_content, include_columns=['工号'])
+        self.assertEqual(result.splitlines()[1], "张三,25,8500.50,￥1￥,2020-01-05,电话13812345678")
+
+        _, result = self.run_stream(self.csv_content, exclude_columns=['工资', '备注'])
+        self.assertEqual(result.splitlines()[1], "张三,￥1￥,8500.50,1001,2020-01-05,电话13812345678")
+
+    def test_quoted_fields_kept(self):
+        """测试字段的引号、转义、引号内换行和CRLF换行符原样保留，还原后逐字节一致"""
+        content = 'name,score,note\r\n"Alice",100,"他说""共12人""\r\n第2行"\r\n"Bob","200",\r\n'
+        desensitizer, result = self.run_stream(content)
+        self.assertEqual(result, 'name,score,note\r\n"Alice",￥1￥,"他说""共￥2￥人""\r\n第￥3￥行"\r\n"Bob","￥4￥",\r\n')
+        restored = desensitizer.restore_content(result, {v: k for k, v in desensitizer.number_mapping.items()})
+        self.assertEqual(restored, content)
+
+    def test_cells_are_fragments(self):
+        """测试单元格开头的数字不按Markdown行首编号或标题保留"""
+        _, result = self.run_stream("name,note\nA,13800138000 张三\nB,# 12 号\n")
+        self.assertEqual(result, "name,note\nA,￥1￥ 张三\nB,# ￥2￥ 号\n")
+
+    def test_headerless_first_row(self):
+        """测试无表头的CSV首行也按数据行脱敏"""
+        _, result = self.run_stream("张三,25,8500.50\n李四,30,9200.75\n")
+        self.assertEqual(result, "张三,￥1￥,￥2￥\n李四,￥3￥,￥4￥\n")
+
+    def test_date_like_column_names(self):
+        """测试只有完整的date/time词才视为日期列，candidate、runtime等列名照常脱敏"""
+        content = "candidate_score,validated_amount,runtime_ms,lifetime_value,created_at,updateTime\n88,1200,35,9900,1700000000,1700000001\n"
+        _, result = self.run_stream(content)
+        self.assertEqual(result.splitlines()[1], "￥1￥,￥2￥,￥3￥,￥4￥,1700000000,1700000001")
+
+    def test_csv_file_uses_column_mode(self):
+        """测试.csv文件默认使用CSV模式，--plain时按纯文本处理"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_file = os.path.join(temp_dir, 'data.csv')
+            with open(input_file, 'w', encoding='utf-8', newline='') as f:
+                f.write(self.csv_content)
+
+            output_file = os.path.join(temp_dir, 'data_out.csv')
+            desensitize_text_file(input_file, output_file)
+            with open(output_file, 'r', encoding='utf-8') as f:
+                self.assertIn('1001', f.read())
+
+            plain_file = os.path.join(temp_dir, 'data_plain.csv')
+            desensitize_text_file(input_file, plain_file, structured=False)
+            with open(plain_file, 'r', encoding='utf-8') as f:
+                self.assertNotIn('1001', f.read())
+
+
+class TestJsonMode(StreamModeTestCase):
+    """JSON结构化流式脱敏测试"""
+
+    handler = staticmethod(desensitize_json_stream)
+
+    def test_only_values_are_desensitized(self):
+        """测试只替换数值和字符串值，键名和转义序列保持不变"""
+        content = '{"key2019": 12345, "list": [1.5, -7, true, null], "text": "\\u0031号 电话13812345678"}'
+        desensitizer, result = self.run_stream(content)
+        self.assertEqual(result, '{"key2019": ￥1￥, "list": [￥2￥, -￥3￥, true, null], "text": "\\u0031号 电话￥4￥"}')
+        restored = desensitizer.restore_content(result, {v: k for k, v in desensitizer.number_mapping.items()})
+        self.assertEqual(restored, content)
+
+    def test_string_values_are_fragments(self):
+        """测试字符串值开头的数字不按Markdown行首编号或标题保留"""
+        _, result = self.run_stream('{"note": "13800138000 张三", "title": "# 12 号"}')
+        self.assertEqual(result, '{"note": "￥1￥ 张三", "title": "# ￥2￥ 号"}')
+
+    def test_key_path_rules_and_ndjson(self):
+        """测试键路径包含/排除规则以及NDJSON多文档输入"""
+        content = '{"user": {"id": 1, "age": 30}}\n{"user": {"id": 2, "age": 40}, "total": 9}\n'
+        _, result = self.run_stream(content, exclude_keys=['*.id'])
+        self.assertEqual(result, '{"user": {"id": 1, "age": ￥1￥}}\n{"user": {"id": 2, "age": ￥2￥}, "total": ￥3￥}\n')
+
+        _, result = self.run_stream(content, include_keys=['user'], exclude_keys=['user.age'])
+        self.assertEqual(result, '{"user": {"id": ￥1￥, "age": 30}}\n{"user": {"id": ￥2￥, "age": 40}, "total": 9}\n')
+
+    def test_small_chunks(self):
+        """测试词法单元跨越读取分块时仍能正确解析"""
+        from advanced_desensitize_markdown import _iter_json_tokens
+        content = '{"a": "很长的字符串12345", "b": 123456789}'
+        tokens = list(_iter_json_tokens(io.StringIO(content), chunk_size=3))
+        self.assertEqual(''.join(text for _, text in tokens), content)
+        self.assertIn(('number', '123456789'), tokens)
+
+
+class TestMarkupMode(StreamModeTestCase):
+    """HTML/XML文本节点模式测试"""
+
+    handler = staticmethod(desensitize_markup_stream)
+
+    html_content = """<html><head><style>.a{width:100px}</style><script>var x = 42;</script></head>
+<body width="100"><p title="共12人">产量 500 吨 &#49; 深度1200米</p><!-- 99 --></body></html>
+"""
+
+    def test_only_text_nodes(self):
+        """测试只替换文本节点中的数字，标签、属性、实体、脚本和注释保持不变"""
+        desensitizer, result = self.run_stream(self.html_content)
+        self.assertEqual(result, self.html_content.replace('500', '￥1￥').replace('1200', '￥2￥'))
+
+    def test_attribute_allowlist_and_small_chunks(self):
+        """测试白名单属性值脱敏，且读取分块很小时结果不变"""
+        _, expected = self.run_stream(self.html_content, attributes=['title'])
+        self.assertIn('title="共￥1￥人"', expected)
+        self.assertIn('width="100"', expected)
+        _, result = self.run_stream(self.html_content, attributes=['title'], chunk_size=5)
+        self.assertEqual(result, expected)
+
+    def test_text_nodes_are_fragments(self):
+        """测试文本节点开头的数字不按Markdown行首编号保留"""
+        _, result = self.run_stream('<td>13800138000 张三</td><td>5000 元</td>')
+        self.assertEqual(result, '<td>￥1￥ 张三</td><td>￥2￥ 元</td>')
+
+    def test_cdata_desensitized(self):
+        """测试CDATA段内的数字按文本脱敏，CDATA标记原样保留"""
+        content = '<note><![CDATA[价格12元 <b>粗体</b>]]>共3人</note>\n'
+        for chunk_size in (65536, 4):
+            _, result = self.run_stream(content, chunk_size=chunk_size)
+            self.assertEqual(result, '<note><![CDATA[价格￥1￥元 <b>粗体</b>]]>共￥2￥人</note>\n')
+
+    def test_parser_positions_cover_input(self):
+        """测试HTMLParser.updatepos（未公开的内部接口）报告的各段覆盖全部输入：
+
+        各种标记都应原样输出；解析器不再回调updatepos时应报错而不是丢失内容。
+        """
+        content = ('<!DOCTYPE note [<!ENTITY a "x"> <!-- c -->]>\n<?xml-stylesheet href="a.css"?>\n'
+                   '<a href="/p?x=1&amp;y=2" data-x=3>文字&#49;&nbsp;&amp;</a><br/><!-- 注释 -->\n'
+                   '<![if !IE]><style>.a{width:1px}</style><script>if (a < 2) {}</script></ >\n')
+        for chunk_size in (65536, 7, 1):
+            desensitizer, result = self.run_stream(content.replace('文字', '文字500'), chunk_size=chunk_size)
+            self.assertEqual(result, content.replace('文字', '文字￥1￥'))
+
+        with unittest.mock.patch.object(advanced_desensitize_markdown._MarkupTextParser, 'updatepos',
+                                        HTMLParser.updatepos):
+            with self.assertRaises(RuntimeError):
+                self.run_stream(content)
+
+
+class TestCodeMode(StreamModeTestCase):
+    """Python/JavaScript源代码模式测试"""
+
+    def test_python_literals_and_comments(self):
+        """测试只替换十进制数值、字符串和注释，代码、bytes、f-string替换字段和shebang保持不变"""
+        content = ('#!/usr/bin/env python3\n'
+                   'depth = 1200 + 0x1F + 2e5  # 井深 800 米\n'
+                   'note = "产量500吨\\x41"\n'
+                   'raw = b"123"\n'
+                   'msg = f"{rate:.2f} 共12人"\n')
+        desensitizer, result = self.run_stream(content, desensitize_python_stream)
+        self.assertEqual(result, content.replace('1200', '￥1￥').replace('800', '￥2￥')
+                         .replace('500', '￥3￥').replace('共12', '共￥4￥'))
+
+        _, result = self.run_stream(content, desensitize_python_stream, code_targets=['comments'])
+        self.assertEqual(result, content.replace('800', '￥1￥'))
+
+    def test_strings_and_comments_are_fragments(self):
+        """测试字符串、f-string片段和注释开头的数字不按Markdown行首编号或标题保留"""
+        content = 's = "13800138000 张三"\nmsg = f"{x} 456 {y:.2f}"\n# 12 号\n'
+        _, result = self.run_stream(content, desensitize_python_stream)
+        self.assertEqual(result, 's = "￥1￥ 张三"\nmsg = f"{x} ￥2￥ {y:.2f}"\n# ￥3￥ 号\n')
+
+        _, result = self.run_stream("const s = '13800138000 张三'; // 12 号\n", desensitize_script_stream)
+        self.assertEqual(result, "const s = '￥1￥ 张三'; // ￥2￥ 号\n")
+
+    def test_python_invalid_source_kept(self):
+        """测试无法解析的Python源代码其余部分原样输出"""
+        content = 'if 1:\n    x = 5\n  y = 6\n'
+        _, result = self.run_stream(content, desensitize_python_stream)
+        self.assertTrue(result.endswith('  y = 6\n'))
+
+    def test_script_lexer(self):
+        """测试JavaScript词法分析：区分除号和正则字面量，保留转义和模板表达式，且分块很小时结果不变"""
+        content = ('// 价格 99\n'
+                   'let a = 10 / 2 / x; const r = /\\d{3}/g;\n'
+                   "const s = 'a12' + `t56 ${i + 78}` + 0xFF;\n")
+        desensitizer, result = self.run_stream(content, desensitize_script_stream)
+        self.assertEqual(result, '// 价格 ￥1￥\n'
+                                 'let a = ￥2￥ / ￥3￥ / x; const r = /\\d{3}/g;\n'
+                                 "const s = 'a￥4￥' + `t￥5￥ ${i + 78}` + 0xFF;\n")
+        _, small = self.run_stream(content, desensitize_script_stream, chunk_size=3)
+        self.assertEqual(small, result)
+
+
+class TestSqlMode(StreamModeTestCase):
+    """SQL导出文件模式测试"""
+
+    handler = staticmethod(desensitize_sql_stream)
+
+    sql_content = """-- MySQL dump 10.13
+/*!40101 SET NAMES utf8mb4 */;
+CREATE TABLE `users` (
+  `id` int(11) NOT NULL,
+  `name` varchar(64) DEFAULT '0',
+  `salary` decimal(10,2),
+  `created_at` datetime,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB AUTO_INCREMENT=42;
+INSERT INTO `users` VALUES (1,'手机13800138000',8500.50,'2023-01-02'),(2,'it''s 3',-120,NULL);
+INSERT INTO t (a, b) VALUES (5, X'0A12') ON DUPLICATE KEY UPDATE a=99;
+"""
+
+    def test_values_by_column(self):
+        """测试只替换VALUES中的值，DDL、注释、编号列、日期列和十六进制字符串保持不变"""
+        desensitizer, result = self.run_stream(self.sql_content)
+        expected = self.sql_content.replace(
+            "(1,'手机13800138000',8500.50,'2023-01-02'),(2,'it''s 3',-120,NULL)",
+            "(1,'手机￥1￥',￥2￥,'2023-01-02'),(2,'it''s ￥3￥',-￥4￥,NULL)").replace("(5, X'0A12')", "(￥5￥, X'0A12')")
+        self.assertEqual(result, expected)
+
+        _, small = self.run_stream(self.sql_content, chunk_size=4)
+        self.assertEqual(small, expected)
+
+    def test_string_literals_are_fragments(self):
+        """测试字符串字面量开头的数字不按Markdown行首编号保留"""
+        _, result = self.run_stream("INSERT INTO t VALUES ('13800138000 张三', '# 12 号');")
+        self.assertEqual(result, "INSERT INTO t VALUES ('￥1￥ 张三', '# ￥2￥ 号');")
+
+    def test_column_selection(self):
+        """测试按列名和列序号指定脱敏列"""
+        desensitizer, result = self.run_stream(self.sql_content, include_columns=['salary', '1'])
+        self.assertIn("VALUES (￥1￥,'手机13800138000',￥2￥,'2023-01-02')", result)
+        self.assertIn("VALUES (￥5￥, X'0A12')", result)
+
+        _, result = self.run_stream("INSERT INTO t (candidate_score, runtime_ms, created_at) VALUES (88, 35, 1700000000);")
+        self.assertEqual(result, "INSERT INTO t (candidate_score, runtime_ms, created_at) VALUES (￥1￥, ￥2￥, 1700000000);")
+
+        _, result = self.run_stream(self.sql_content, exclude_columns=['salary', 'a'])
+        self.assertIn("(1,'手机￥1￥',8500.50,'2023-01-02')", result)
+        self.assertIn("VALUES (5, X'0A12')", result)
+
+
+class TestRules(unittest.TestCase):
+    """自定义规则文件测试"""
+
+    toml_rules = """
+[[preserve]]
+name = "standard"
+pattern = "GB/T\\\\s*\\\\d+"
+priority = 5
+
+[[desensitize]]
+name = "contract"
+pattern = "(?i)contract-\\\\d+"
+
+[[desensitize]]
+name = "standard_year"
+pattern = "GB/T\\\\s*\\\\d+-(?P<year>\\\\d{4})"
+priority = 10
+"""
+
+    def test_preserve_force_and_priority(self):
+        """测试保留规则、强制脱敏规则（优先于内置的工作面编号保留）和优先级，并生成编译缓存"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            rules_file = os.path.join(temp_dir, 'rules.toml')
+            with open(rules_file, 'w', encoding='utf-8') as f:
+                f.write(self.toml_rules)
+            cache_dir = os.path.join(temp_dir, 'cache')
+            rules = load_rules(rules_file, cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            desensitizer = TextDesensitizer(rules=rules)
+            result = desensitizer.desensitize_content("依据GB/T 50215规范，GB/T 8-2015，CONTRACT-77 金额300元")
+            self.assertEqual(result, "依据GB/T 50215规范，GB/T ￥1￥-￥2￥，CONTRACT-￥3￥ 金额￥4￥元")
+
+            # 从缓存加载的规则与直接编译的结果一致
+            cached = load_rules(rules_file, cache_dir=cache_dir)
+            self.assertEqual(cached.source, rules.source)
+
+    def test_corrupted_cache_is_rebuilt(self):
+        """测试缓存中的正则无法编译或JSON被截断时重新编译并覆盖缓存"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            rules_file = os.path.join(temp_dir, 'rules.toml')
+            with open(rules_file, 'w', encoding='utf-8') as f:
+                f.write(self.toml_rules)
+            cache_dir = os.path.join(temp_dir, 'cache')
+            rules = load_rules(rules_file, cache_dir=cache_dir)
+            cache_path = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+
+            for corrupted in ('{"pattern": "(\\\\d+", "groups": {}}', '{"pattern": "GB'):
+                with open(cache_path, 'w', encoding='utf-8') as f:
+                    f.write(corrupted)
+                self.assertEqual(load_rules(rules_file, cache_dir=cache_dir).source, rules.source)
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    self.assertEqual(json.load(f)['pattern'], rules.source)
+
+    def test_json_rules_and_invalid_pattern(self):
+        """测试JSON规则文件和无效正则的报错"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            rules_file = os.path.join(temp_dir, 'rules.json')
+            with open(rules_file, 'w', encoding='utf-8') as f:
+                json.dump({'preserve': ['井号\\d+']}, f, ensure_ascii=False)
+            desensitizer = TextDesensitizer(rules=load_rules(rules_file, cache_dir=temp_dir))
+            self.assertEqual(desensitizer.desensitize_content("井号12 深度300"), "井号12 深度￥1￥")
+
+            with open(rules_file, 'w', encoding='utf-8') as f:
+                json.dump({'desensitize': [{'pattern': '(\\d+'}]}, f)
+            with self.assertRaises(ValueError):
+                load_rules(rules_file, cache_dir=temp_dir)
+
+
+class TestKeywords(unittest.TestCase):
+    """关键词保留测试"""
+
+    def test_automaton_matches(self):
+        """测试自动机找出所有相互重叠的关键词，且pickle后结果不变"""
+        automaton = KeywordAutomaton(['he', 'she', 'hers', 'his'])
+        expected = [(1, 4, 1), (2, 4, 1), (2, 6, 1)]
+        self.assertEqual(list(automaton.iter_matches('ushers')), expected)
+        restored = pickle.loads(pickle.dumps(automaton))
+        self.assertEqual(list(restored.iter_matches('ushers')), expected)
+
+    def test_keyword_windows(self):
+        """测试前缀关键词后、后缀关键词前的数字保持原样，其余数字照常脱敏"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            keywords_file = os.path.join(temp_dir, 'keywords.txt')
+            with open(keywords_file, 'w', encoding='utf-8') as f:
+                f.write("# 领域术语\nGB\n工作面\n煤层\tsuffix\n")
+            desensitizer = TextDesensitizer(keywords=load_keywords(keywords_file))
+        result = desensitizer.desensitize_content("GB 50215规范，3煤层厚度2米，工作面:1203推进100米")
+        self.assertEqual(result, "GB 50215规范，3煤层厚度￥1￥米，工作面:1203推进￥2￥米")
+
+
+class TestValueLists(unittest.TestCase):
+    """白名单/黑名单测试"""
+
+    def test_allowlist_and_denylist(self):
+        """测试白名单中的数字不替换（含结构化模式），黑名单中的数字即使在保留规则内也替换"""
+        desensitizer = TextDesensitizer(allowlist={'110', '3.14'}, denylist={'2023'})
+        result = desensitizer.desensitize_content("报警110，圆周率3.14，日期2023-01-02，产量500吨")
+        self.assertEqual(result, "报警110，圆周率3.14，日期￥1￥-01-02，产量￥2￥吨")
+        self.assertEqual(desensitizer.add_to_mapping('110'), '110')
+
+    def test_mapped_value_list(self):
+        """测试二进制名单文件的查询、文本名单的读取以及pickle后重新映射"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            list_path = os.path.join(temp_dir, 'allow.bin')
+            values = [str(13800000000 + i * 7) for i in range(1000)]
+            self.assertEqual(build_value_list(values + values[:10], list_path), 1000)
+
+            allowlist = load_value_list(list_path)
+            restored = pickle.loads(pickle.dumps(allowlist))
+            try:
+                self.assertEqual(len(allowlist), 1000)
+                self.assertTrue(all(value in allowlist for value in values))
+                self.assertNotIn('13800000001', allowlist)
+                self.assertIn(values[500], restored)
+            finally:
+                allowlist.close()
+                restored.close()
+
+            text_path = os.path.join(temp_dir, 'deny.txt')
+            with open(text_path, 'w', encoding='utf-8') as f:
+                f.write("# 黑名单\n42\n\n7\n")
+            self.assertEqual(load_value_list(text_path), frozenset({'42', '7'}))
+
+
+class TestVerify(unittest.TestCase):
+    """还原校验测试"""
+
+    def test_verify_directory(self):
+        """测试目录树中各文件还原一致，且能定位被改动文件的第一处不一致"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_dir = os.path.join(temp_dir, 'input')
+            output_dir = os.path.join(temp_dir, 'output')
+            os.makedirs(input_dir)
+            with open(os.path.join(input_dir, 'a.md'), 'w', encoding='utf-8') as f:
+                f.write("# 1 标题\n产量500吨，深度1200米\n")
+            with open(os.path.join(input_dir, 'b.csv'), 'w', encoding='utf-8', newline='') as f:
+                f.write('id,name,value\n1,"a,b",3.5\n')
+            process_directory(input_dir, output_dir)
+
+            results = verify_directory(input_dir, output_dir, workers=2)
+            self.assertEqual(len(results), 2)
+            self.assertTrue(all(result['ok'] for result in results))
+
+            with open(os.path.join(output_dir, 'a.md'), 'r', encoding='utf-8') as f:
+                content = f.read()
+            with open(os.path.join(output_dir, 'a.md'), 'w', encoding='utf-8') as f:
+                f.write(content.replace('吨', 't'))
+            failed = [result for result in verify_directory(input_dir, output_dir, workers=2) if not result['ok']]
+            self.assertEqual(len(failed), 1)
+            self.assertEqual((failed[0]['line'], failed[0]['offset']), (2, 12))
+
+    def test_process_directory_keeps_crlf(self):
+        """测试批量处理保留CRLF换行：整段和逐行模式的输出都能通过校验，还原后与原文逐字节一致"""
+        text = "# 1 标题\r\n产量500吨，深度1200米\r\n- 第2项 价格99元\r\n"
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_dir = os.path.join(temp_dir, 'input')
+            os.makedirs(input_dir)
+            for name in ('a.md', 'b.txt'):
+                with open(os.path.join(input_dir, name), 'w', encoding='utf-8', newline='') as f:
+                    f.write(text)
+            for stream in (False, True):
+                output_dir = os.path.join(temp_dir, f'output_{stream}')
+                process_directory(input_dir, output_dir, stream=stream)
+                results = verify_directory(input_dir, output_dir)
+                self.assertEqual(len(results), 2)
+                self.assertTrue(all(result['ok'] for result in results))
+
+                restored_path = os.path.join(temp_dir, f'a_{stream}.md')
+                restore_text_file(os.path.join(output_dir, 'a.md'), os.path.join(output_dir, 'a_map.json'), restored_path)
+                with open(restored_path, 'rb') as f:
+                    self.assertEqual(f.read(), text.encode('utf-8'))
+
+    def test_verify_crlf(self):
+        """测试换行符按原样比较：还原结果丢失了CRLF中的\\r时校验不通过"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            original = os.path.join(temp_dir, 'data.csv')
+            with open(original, 'w', encoding='utf-8', newline='') as f:
+                f.write('name,value\r\nA,100\r\nB,200\r\n')
+            output = os.path.join(temp_dir, 'data_out.csv')
+            desensitize_text_file(original, output)
+            self.assertTrue(verify_file(original, output)['ok'])
+
+            with open(output, 'r', encoding='utf-8', newline='') as f:
+                content = f.read()
+            with open(output, 'w', encoding='utf-8', newline='') as f:
+                f.write(content.replace('\r\n', '\n'))
+            result = verify_file(original, output)
+            self.assertFalse(result['ok'])
+            self.assertEqual((result['line'], result['offset']), (1, 10))
+
+
+class TestDryRun(unittest.TestCase):
+    """试运行测试"""
+
+    def test_scan_matches_real_run(self):
+        """测试完整扫描的统计与实际脱敏一致，抽样扫描按比例外推，且不生成任何文件"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, 'app.log')
+            with open(file_path, 'w', encoding='utf-8') as f:
+                for i in range(5000):
+                    f.write(f"2024-01-01 订单{i % 700} 金额{i % 300}.5 元\n")
+
+            result = scan_file(file_path)
+            desensitizer = TextDesensitizer()
+            with open(file_path, 'r', encoding='utf-8') as f:
+                numbers = desensitizer.extract_numbers(f.read())
+            self.assertFalse(result['sampled'])
+            self.assertEqual(result['numbers'], len(numbers))
+            self.assertEqual(result['unique_numbers'], len({number for number, _, _ in numbers}))
+
+            sampled = scan_file(file_path, sample=0.2)
+            self.assertTrue(sampled['sampled'])
+            self.assertLess(sampled['scanned_bytes'], result['scanned_bytes'])
+            self.assertAlmostEqual(sampled['numbers'], result['numbers'], delta=result['numbers'] * 0.1)
+
+            dry_run(temp_dir)
+            self.assertEqual(os.listdir(temp_dir), ['app.log'])
+
+    def test_scan_uses_structured_mode(self):
+        """测试结构化格式按实际处理时的模式统计：CSV的工号列保持原样，不计入将被替换的数字"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, 'data.csv')
+            with open(file_path, 'w', encoding='utf-8', newline='') as f:
+                f.write('姓名,年龄,工资,工号\n')
+                for i in range(20):
+                    f.write(f'员工{i},{20 + i},{8000 + i * 100}.5,{1001 + i}\n')
+
+            output_path = os.path.join(temp_dir, 'out', 'data.csv')
+            os.makedirs(os.path.dirname(output_path))
+            real = desensitize_text_file(file_path, output_path)
+            with open(output_path, 'r', encoding='utf-8') as f:
+                replaced = f.read().count('￥') // 2
+            result = scan_file(file_path)
+            self.assertEqual(result['numbers'], replaced)
+            self.assertEqual(result['unique_numbers'], real['numbers'])
+            # 纯文本模式会把姓名中的序号和工号也算进去
+            self.assertGreater(scan_file(file_path, structured=False)['numbers'], replaced)
+            self.assertEqual(scan_file(file_path, include_columns=['年龄'])['numbers'], 20)
+
+
+class TestDaemon(unittest.TestCase):
+    """守护进程和客户端测试"""
+
+    def test_serve_jsonl_jobs(self):
+        """测试从JSONL读取任务并行处理，每个任务返回一行JSON结果，提示信息不混入输出"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, 'a.md')
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write("产量500吨 深度1200米\n")
+            output_path = os.path.join(temp_dir, 'out.md')
+            jobs = [
+                {'id': 1, 'action': 'desensitize', 'input': file_path, 'output': output_path},
+                {'id': 2, 'action': 'unknown'},
+            ]
+            src = io.StringIO(''.join(json.dumps(job) + '\n' for job in jobs) + 'not json\n')
+            dst = io.StringIO()
+            serve(workers=2, src=src, dst=dst)
+
+            responses = [json.loads(line) for line in dst.getvalue().splitlines()]
+            self.assertEqual(len(responses), 3)
+            by_id = {response['id']: response for response in responses}
+            self.assertTrue(by_id[1]['ok'])
+            self.assertEqual(by_id[1]['result']['numbers'], 2)
+            self.assertFalse(by_id[2]['ok'])
+            self.assertFalse(by_id[None]['ok'])
+            with open(output_path, 'r', encoding='utf-8') as f:
+                self.assertEqual(f.read(), "产量￥1￥吨 深度￥2￥米\n")
+
+    def test_client_fallback(self):
+        """测试守护进程不可用时客户端在本进程内执行任务"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, 'a.txt')
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write("温度36度\n")
+            job = {'action': 'desensitize', 'input': file_path}
+            response = desensitize_client.submit(job, os.path.join(temp_dir, 'missing.sock'))
+            self.assertTrue(response['ok'])
+            self.assertTrue(os.path.exists(response['result']['output']))
+            with self.assertRaises(ConnectionError):
+                desensitize_client.submit(job, os.path.join(temp_dir, 'missing.sock'), fallback=False)
+
+    def test_client_fallback_engine_options(self):
+        """测试客户端接受与主命令相同的脱敏器参数，回退执行时规则、关键词和占位符密钥都生效"""
+        parsers = []
+        for add_arguments in (advanced_desensitize_markdown._add_engine_arguments, desensitize_client._add_engine_arguments):
+            parser = advanced_desensitize_markdown.argparse.ArgumentParser()
+            add_arguments(parser)
+            parsers.append({action.dest: action.default for action in parser._actions if action.dest != 'help'})
+        self.assertEqual(parsers[0], parsers[1])
+        self.assertEqual(parsers[1], desensitize_client.ENGINE_DEFAULTS)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, 'a.txt')
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write("编号 x123 温度36度 型号 750\n")
+            rules_path = os.path.join(temp_dir, 'rules.json')
+            with open(rules_path, 'w', encoding='utf-8') as f:
+                json.dump({'preserve': [r'编号\s+x\d+']}, f)
+            keywords_path = os.path.join(temp_dir, 'keywords.txt')
+            with open(keywords_path, 'w', encoding='utf-8') as f:
+                f.write("型号\n")
+            key_path = os.path.join(temp_dir, 'key')
+            with open(key_path, 'wb') as f:
+                f.write(b'secret')
+            output_path = os.path.join(temp_dir, 'out.txt')
+            with unittest.mock.patch('sys.stdout', io.StringIO()):
+                desensitize_client.main([file_path, '-o', output_path, '--socket', os.path.join(temp_dir, 'missing.sock'),
+                                         '--rules', rules_path, '--keywords', keywords_path,
+                                         '--placeholder-key-file', key_path])
+            with open(output_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            # 规则保留编号、关键词保留型号后的数字，密钥生成的占位符不是顺序编号
+            self.assertRegex(content, r'^编号 x123 温度￥[0-9a-z]{2,}￥度 型号 750\n$')
+
+
+    def test_socket_path_and_permissions(self):
+        """测试默认socket路径与客户端一致且不在公共临时目录下，socket权限为0600，不删除非socket文件"""
+        self.assertEqual(advanced_desensitize_markdown.DEFAULT_DAEMON_SOCKET, desensitize_client.DEFAULT_DAEMON_SOCKET)
+        self.assertNotEqual(os.path.dirname(desensitize_client.DEFAULT_DAEMON_SOCKET), tempfile.gettempdir())
+        if not hasattr(advanced_desensitize_markdown.socket, 'AF_UNIX'):
+            self.skipTest("当前系统不支持Unix socket")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, 'not_a_socket')
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write("keep")
+            with self.assertRaises(FileExistsError):
+                serve(file_path, workers=1)
+            with open(file_path, 'r', encoding='utf-8') as f:
+                self.assertEqual(f.read(), "keep")
+
+            socket_path = os.path.join(temp_dir, 'run', 'd.sock')
+            servers = []
+            server_class = advanced_desensitize_markdown.socketserver.ThreadingUnixStreamServer
+
+            class ImmediateServer(server_class):
+                def serve_forever(self, poll_interval=0.5):
+                    servers.append(os.stat(self.server_address).st_mode)
+
+            advanced_desensitize_markdown.socketserver.ThreadingUnixStreamServer = ImmediateServer
+            try:
+                serve(socket_path, workers=1)
+            finally:
+                advanced_desensitize_markdown.socketserver.ThreadingUnixStreamServer = server_class
+            self.assertEqual(servers[0] & 0o777, 0o600)
+            self.assertEqual(os.stat(os.path.dirname(socket_path)).st_mode & 0o777, 0o700)
+            self.assertFalse(os.path.exists(socket_path))
+
+    def test_socket_dir_must_be_private(self):
+        """测试socket目录已存在但其他用户可访问或是符号链接时，守护进程拒绝启动，客户端拒绝连接"""
+        if not hasattr(advanced_desensitize_markdown.socket, 'AF_UNIX'):
+            self.skipTest("当前系统不支持Unix socket")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            shared_dir = os.path.join(temp_dir, 'shared')
+            os.makedirs(shared_dir)
+            os.chmod(shared_dir, 0o755)
+            private_dir = os.path.join(temp_dir, 'private')
+            os.makedirs(private_dir, mode=0o700)
+            link_dir = os.path.join(temp_dir, 'link')
+            os.symlink(private_dir, link_dir)
+            for directory in (shared_dir, link_dir):
+                socket_path = os.path.join(directory, 'd.sock')
+                with self.assertRaises(PermissionError):
+                    serve(socket_path, workers=1)
+                self.assertFalse(os.path.lexists(socket_path))
+                with self.assertRaisesRegex(ConnectionError, '0700'):
+                    desensitize_client.submit({'action': 'ping'}, socket_path, fallback=False)
+
+
+class TestParallelFile(unittest.TestCase):
+    """单个大文件多进程处理测试"""
+
+    def test_parallel_matches_serial(self):
+        """测试拆分并行处理的输出和映射与串行处理逐字节一致（含CRLF、CR换行和GBK编码）"""
+        lines = ["# 1.2 标题 3\n", "| a | 12 |\n", "|---|---|\n", "产量{}吨，深度1200米 2024-01-02\r\n",
+                 "IP 10.0.0.1 温度3.5\r", "- 第3项 价格99元\n", "GB 50215 表4-1 图3 2-1-1\n"]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for encoding in ('utf-8', 'gbk'):
+                file_path = os.path.join(temp_dir, f'{encoding}.log')
+                with open(file_path, 'w', encoding=encoding, newline='') as f:
+                    for i in range(3000):
+                        f.write(lines[i % len(lines)].format(i % 997))
+                    f.write("末行没有换行 42")
+
+                serial = TextDesensitizer()
+                with open(file_path, 'r', encoding=encoding, newline='') as f:
+                    expected = serial.desensitize_content(f.read())
+
+                output_path = os.path.join(temp_dir, f'{encoding}_out.log')
+                parallel = desensitize_file_parallel(file_path, output_path, workers=2, block_size=4096)
+                with open(output_path, 'r', encoding='utf-8', newline='') as f:
+                    self.assertEqual(f.read(), expected)
+                self.assertEqual(list(parallel.number_mapping.items()), list(serial.number_mapping.items()))
+
+    def test_rules_spanning_lines(self):
+        """测试自定义规则可以跨行匹配时不拆分处理，结果仍与串行一致"""
+        rules = RuleSet.compile([{'name': 'serial', 'action': 'preserve', 'pattern': r'编号\s+x\d+', 'priority': 0}])
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, 'data.log')
+            with open(file_path, 'w', encoding='utf-8', newline='') as f:
+                for i in range(1000):
+                    f.write(f"第{i}行 编号\nx{i} 产量{i % 97}吨\n")
+            with open(file_path, 'r', encoding='utf-8', newline='') as f:
+                serial = TextDesensitizer(rules=rules)
+                expected = serial.desensitize_content(f.read())
+
+            output_path = os.path.join(temp_dir, 'data_out.log')
+            parallel = desensitize_file_parallel(file_path, output_path, workers=2,
+                                                 desensitizer_options={'rules': rules}, block_size=4096)
+            with open(output_path, 'r', encoding='utf-8', newline='') as f:
+                self.assertEqual(f.read(), expected)
+            self.assertEqual(list(parallel.number_mapping.items()), list(serial.number_mapping.items()))
+            self.assertIn('编号\nx123 ', expected)
+
+
+class TestBatchScheduling(unittest.TestCase):
+    """目录批量处理的调度和超时测试"""
+
+    def write_files(self, input_dir, contents):
+        os.makedirs(input_dir)
+        for filename, content in contents.items():
+            with open(os.path.join(input_dir, filename), 'w', encoding='utf-8') as f:
+                f.write(content)
+
+    def test_largest_first(self):
+        """测试文件按大小从大到小处理"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_dir = os.path.join(temp_dir, 'input')
+            self.write_files(input_dir, {'a.txt': '1\n', 'b.txt': '产量500吨\n' * 50, 'c.txt': '深度1200米\n' * 5})
+            report = process_directory(input_dir, os.path.join(temp_dir, 'output'))
+            self.assertEqual(report['processed'], ['b.txt', 'c.txt', 'a.txt'])
+
+    def test_timeout_and_retry(self):
+        """测试超时的文件被终止并用流式模式重试，其他文件不受影响"""
+        # 灾难性回溯的规则：含长串a的文件无论哪种模式都无法在时限内完成
+        rules = RuleSet.compile([{'name': 'slow', 'action': 'preserve', 'pattern': '(?:a+)+$', 'priority': 0}])
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_dir = os.path.join(temp_dir, 'input')
+            output_dir = os.path.join(temp_dir, 'output')
+            self.write_files(input_dir, {'slow.txt': 'a' * 40 + '! 12\n', 'ok.txt': '产量500吨\n'})
+            start_time = time.time()
+            report = process_directory(input_dir, output_dir, desensitizer_options={'rules': rules},
+                                       workers=2, timeout=1)
+            self.assertLess(time.time() - start_time, 30)
+            self.assertEqual(report['processed'], ['ok.txt'])
+            self.assertEqual(report['timed_out'], ['slow.txt'])
+            self.assertEqual(report['failed'], ['slow.txt'])
+            with open(os.path.join(output_dir, 'ok.txt'), 'r', encoding='utf-8') as f:
+                self.assertEqual(f.read(), '产量￥1￥吨\n')
+
+
+class TestArchives(unittest.TestCase):
+    """ZIP/tar归档直接处理测试"""
+
+    members = {
+        'docs/a.txt': '价格500元\n电话13812345678\n'.encode('utf-8'),
+        'b.csv': 'id,amount\n1,500\n2,123\n'.encode('utf-8'),
+        'c.png': b'\x89PNG 123',
+    }
+
+    def test_zip(self):
+        """测试ZIP归档：成员名不变，共用映射，非文本成员原样保留，可还原"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_path = os.path.join(temp_dir, 'in.zip')
+            with zipfile.ZipFile(input_path, 'w') as archive:
+                for name, data in self.members.items():
+                    archive.writestr(name, data)
+            result = desensitize_archive(input_path)
+            self.assertEqual(result['members'], 2)
+            with zipfile.ZipFile(result['output']) as archive:
+                self.assertEqual(archive.namelist(), list(self.members) + ['desensitize_map.json'])
+                self.assertEqual(archive.read('docs/a.txt').decode('utf-8'), '价格￥1￥元\n电话￥2￥\n')
+                self.assertEqual(archive.read('b.csv').decode('utf-8'), 'id,amount\n1,￥1￥\n2,￥3￥\n')
+                self.assertEqual(archive.read('c.png'), self.members['c.png'])
+                self.assertEqual(json.loads(archive.read('desensitize_map.json'))['￥3￥'], '123')
+
+            restored = restore_archive(result['output'])['output']
+            with zipfile.ZipFile(restored) as archive:
+                self.assertEqual({name: archive.read(name) for name in archive.namelist()}, self.members)
+
+    def test_tar_gz(self):
+        """测试tar.gz归档的脱敏和使用外部映射文件还原"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_path = os.path.join(temp_dir, 'in.tar.gz')
+            with tarfile.open(input_path, 'w:gz') as archive:
+                for name, data in self.members.items():
+                    info = tarfile.TarInfo(name)
+                    info.size = len(data)
+                    archive.addfile(info, io.BytesIO(data))
+            output_path = os.path.join(temp_dir, 'out.tar.gz')
+            desensitize_archive(input_path, output_path)
+            with tarfile.open(output_path, 'r:gz') as archive:
+                self.assertEqual(archive.getnames(), list(self.members) + ['desensitize_map.json'])
+                self.assertEqual(archive.extractfile('docs/a.txt').read().decode('utf-8'), '价格￥1￥元\n电话￥2￥\n')
+                mapping_path = os.path.join(temp_dir, 'map.json')
+                with open(mapping_path, 'wb') as f:
+                    f.write(archive.extractfile('desensitize_map.json').read())
+
+            restored = restore_archive(output_path, mapping_path)['output']
+            with tarfile.open(restored, 'r:gz') as archive:
+                self.assertEqual({name: archive.extractfile(name).read() for name in archive.getnames()}, self.members)
+
+    def test_compressed_members(self):
+        """测试归档中压缩的文本成员（如 .log.gz、.csv.xz）解压后脱敏并按原格式压缩写回"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_path = os.path.join(temp_dir, 'in.zip')
+            with zipfile.ZipFile(input_path, 'w') as archive:
+                archive.writestr('logs/app.log.gz', gzip.compress('耗时1500ms\n'.encode('utf-8')))
+                archive.writestr('b.csv.xz', lzma.compress('id,amount\n1,500\n'.encode('utf-8')))
+            result = desensitize_archive(input_path)
+            self.assertEqual(result['members'], 2)
+            with zipfile.ZipFile(result['output']) as archive:
+                self.assertEqual(gzip.decompress(archive.read('logs/app.log.gz')).decode('utf-8'), '耗时￥1￥ms\n')
+                self.assertEqual(lzma.decompress(archive.read('b.csv.xz')).decode('utf-8'), 'id,amount\n1,￥2￥\n')
+
+            restored = restore_archive(result['output'])['output']
+            with zipfile.ZipFile(restored) as archive:
+                self.assertEqual(gzip.decompress(archive.read('logs/app.log.gz')).decode('utf-8'), '耗时1500ms\n')
+                self.assertEqual(lzma.decompress(archive.read('b.csv.xz')).decode('utf-8'), 'id,amount\n1,500\n')
+
+
+class TestCompressedFiles(unittest.TestCase):
+    """gzip/bz2/xz压缩文件透明读写测试"""
+
+    def test_gzip_round_trip(self):
+        """测试.log.gz文件脱敏后仍为压缩文件，映射文件名不含压缩后缀，还原后与原文一致"""
+        content = '2024-01-01 订单987654321 金额500\n' * 3
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_path = os.path.join(temp_dir, 'app.log.gz')
+            with gzip.open(input_path, 'wt', encoding='utf-8') as f:
+                f.write(content)
+            result = desensitize_text_file(input_path, stream=True)
+            self.assertEqual(result['output'], os.path.join(temp_dir, 'app_desensitized.log.gz'))
+            self.assertEqual(result['mapping'], os.path.join(temp_dir, 'app_desensitized_map.json'))
+            with gzip.open(result['output'], 'rt', encoding='utf-8') as f:
+                self.assertNotIn('987654321', f.read())
+
+            restored_path = os.path.join(temp_dir, 'restored.log')
+            restore_text_file(result['output'], result['mapping'], restored_path)
+            with open(restored_path, 'r', encoding='utf-8') as f:
+                self.assertEqual(f.read(), content)
+
+    def test_directory_with_compressed_csv(self):
+        """测试目录批量处理识别.csv.xz文件并按CSV模式处理"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_dir = os.path.join(temp_dir, 'input')
+            os.makedirs(input_dir)
+            with lzma.open(os.path.join(input_dir, 'data.csv.xz'), 'wt', encoding='utf-8', newline='') as f:
+                f.write('id,amount\n1001,500\n')
+            output_dir = os.path.join(temp_dir, 'output')
+            report = process_directory(input_dir, output_dir)
+            self.assertEqual(report['processed'], ['data.csv.xz'])
+            with lzma.open(os.path.join(output_dir, 'data.csv.xz'), 'rt', encoding='utf-8', newline='') as f:
+                self.assertEqual(f.read(), 'id,amount\n1001,￥1￥\n')
+
+
+class TestMemoryBudget(unittest.TestCase):
+    """内存预算和自动流式处理测试"""
+
+    def test_fallback_to_streaming(self):
+        """测试估算超出预算时改用流式处理，结果与整段处理一致，并记录内存峰值"""
+        content = ''.join(f'订单{100000 + i} 金额{i * 7}.5元\n' for i in range(2000))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_path = os.path.join(temp_dir, 'orders.txt')
+            with open(input_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            self.assertGreater(estimate_memory(input_path), len(content.encode('utf-8')))
+
+            whole = desensitize_text_file(input_path, os.path.join(temp_dir, 'whole.txt'), memory_budget=1 << 30)
+            self.assertFalse(whole['streamed'])
+            tracemalloc.start()
+            try:
+                streamed = desensitize_text_file(input_path, os.path.join(temp_dir, 'streamed.txt'), memory_budget=1024)
+            finally:
+                tracemalloc.stop()
+            self.assertTrue(streamed['streamed'])
+            self.assertEqual(streamed['peak_memory_source'], 'tracemalloc')
+            self.assertGreater(streamed['peak_memory'], 0)
+            with open(whole['output'], 'r', encoding='utf-8') as f1, open(streamed['output'], 'r', encoding='utf-8') as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+    def test_directory_stats(self):
+        """测试目录处理报告中包含每个文件的统计信息"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_dir = os.path.join(temp_dir, 'input')
+            os.makedirs(input_dir)
+            with open(os.path.join(input_dir, 'a.txt'), 'w', encoding='utf-8') as f:
+                f.write('产量500吨\n')
+            with open(os.path.join(input_dir, 'b.txt'), 'w', encoding='utf-8') as f:
+                f.write(''.join(f'订单{100000 + i} 金额{i * 7}元\n' for i in range(30000)))
+            report = process_directory(input_dir, os.path.join(temp_dir, 'output'), memory_budget=1)
+            self.assertTrue(report['stats']['a.txt']['streamed'])
+            self.assertEqual(report['stats']['a.txt']['numbers'], 1)
+
+            # 未跟踪tracemalloc时读取峰值RSS；能按文件重置时，先处理的大文件的峰值不会计入小文件
+            report = process_directory(input_dir, os.path.join(temp_dir, 'whole'), memory_budget=1 << 40)
+            stats = report['stats']
+            self.assertFalse(tracemalloc.is_tracing())
+            self.assertIn(stats['a.txt']['peak_memory_source'], ('rss', 'max_rss', None))
+            if stats['a.txt']['peak_memory_source'] == 'rss':
+                self.assertLess(stats['a.txt']['peak_memory'], stats['b.txt']['peak_memory'])
+
+
+class TestNumberSearch(unittest.TestCase):
+    """数字串查找测试（正则和NumPy两种实现）"""
+
+    samples = ['1.2.3.4 版本5.6.', '.5 和 12. 以及 ３.１４', '价格１２３元，٣٤ 和 𝟘𝟙', 'a1b22c333', '', '无数字']
+
+    def test_regex_matches_two_pass_result(self):
+        """测试单个正则的结果与先匹配小数、再匹配整数并去掉重叠部分的结果一致"""
+        desensitizer = TextDesensitizer()
+        numbers = [number for number, _, _ in desensitizer.extract_numbers('版本1.2.3.4 和 5.6. 共 ３.１４ 元')]
+        self.assertEqual(numbers, ['1.2', '3.4', '5.6', '３.１４'])
+
+    @unittest.skipIf(advanced_desensitize_markdown.np is None, '未安装NumPy')
+    def test_numpy_matches_regex(self):
+        """测试NumPy向量化查找与正则逐个匹配的结果完全一致"""
+        pattern = advanced_desensitize_markdown.NUMBER_PATTERN
+        for text in self.samples + [''.join(self.samples) * 500]:
+            expected = [(match.group(), match.start(), match.end()) for match in pattern.finditer(text)]
+            self.assertEqual(advanced_desensitize_markdown._find_numbers_numpy(text), expected)
+
+
+class TestThreadSafeDesensitizer(unittest.TestCase):
+    """多线程共享脱敏器测试"""
+
+    def setUp(self):
+        self.switch_interval = sys.getswitchinterval()
+        # 频繁切换线程，尽量制造竞争
+        sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        sys.setswitchinterval(self.switch_interval)
+
+    def run_threads(self, target, count=8):
+        threads = [threading.Thread(target=target, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_unique_sequential_placeholders(self):
+        """测试多个线程同时分配时，每个数字只分配一次，占位符序号连续且不重复"""
+        desensitizer = ThreadSafeTextDesensitizer(lock_stripes=4)
+        results = [{} for _ in range(8)]
+
+        def work(i):
+            for n in range(2000):
+                number = str((n * (i + 1)) % 1500)
+                results[i][number] = desensitizer.add_to_mapping(number)
+
+        self.run_threads(work)
+        mapping = desensitizer.number_mapping
+        self.assertEqual(len(mapping), 1500)
+        self.assertEqual(sorted(mapping.values(), key=lambda p: int(p.strip('￥'))),
+                         [f"￥{i}￥" for i in range(1, 1501)])
+        for result in results:
+            for number, placeholder in result.items():
+                self.assertEqual(mapping[number], placeholder)
+
+    def test_shared_line_cache(self):
+        """测试多个线程共用行缓存逐行脱敏，结果都能用同一份映射还原"""
+        desensitizer = ThreadSafeTextDesensitizer(line_cache_size=50)
+        lines = [f'第{i % 80}批 产量{i * 3}吨\n' for i in range(400)]
+        outputs = [None] * 6
+
+        def work(i):
+            outputs[i] = ''.join(desensitizer.desensitize_lines(lines))
+
+        self.run_threads(work, 6)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            mapping_path = os.path.join(temp_dir, 'map.json')
+            desensitizer.save_mapping(mapping_path)
+            mapping = desensitizer.load_mapping(mapping_path)
+        for output in outputs:
+            self.assertEqual(desensitizer.restore_content(output, mapping), ''.join(lines))
+        info = desensitizer.line_cache_info()
+        self.assertEqual(info['hits'] + info['misses'], 6 * len(lines))
+
+
+class TestCompactMapping(unittest.TestCase):
+    """映射关系的紧凑存储测试"""
+
+    def test_mapping_view(self):
+        """测试映射视图与原来的字典行为一致，实例没有__dict__"""
+        desensitizer = TextDesensitizer()
+        for number in ['500', '1200', '500', '3.14']:
+            desensitizer.add_to_mapping(number)
+        self.assertEqual(desensitizer.number_mapping, {'500': '￥1￥', '1200': '￥2￥', '3.14': '￥3￥'})
+        self.assertEqual(list(desensitizer.number_mapping), ['500', '1200', '3.14'])
+        self.assertIn('1200', desensitizer.number_mapping)
+        self.assertNotIn('7', desensitizer.number_mapping)
+        self.assertEqual(desensitizer.placeholder_counter, 4)
+        self.assertFalse(hasattr(desensitizer, '__dict__'))
+
+    def test_save_format_and_restore_table(self):
+        """测试保存格式与json.dump相同，加载得到的还原表按序号查找"""
+        desensitizer = TextDesensitizer()
+        for number in ['500', '１２', '9876.54']:
+            desensitizer.add_to_mapping(number)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            mapping_path = os.path.join(temp_dir, 'map.json')
+            desensitizer.save_mapping(mapping_path)
+            with open(mapping_path, 'r', encoding='utf-8') as f:
+                expected = {'￥1￥': '500', '￥2￥': '１２', '￥3￥': '9876.54'}
+                self.assertEqual(f.read(), json.dumps(expected, ensure_ascii=False, indent=2))
+            table = desensitizer.load_mapping(mapping_path)
+        self.assertIsInstance(table, RestoreTable)
+        self.assertEqual(table, expected)
+        self.assertEqual(desensitizer.restore_content('￥3￥和￥1￥，￥4￥', table), '9876.54和500，￥4￥')
+
+    def test_restore_table_mixed_placeholders(self):
+        """测试还原表中的确定性占位符、不连续序号和带前导零的占位符"""
+        table = RestoreTable({'￥2￥': '20', '￥k3f2￥': '7', '￥5000￥': '5', '￥1￥': '10'})
+        self.assertEqual(len(table), 4)
+        self.assertEqual(table['￥5000￥'], '5')
+        self.assertEqual(dict(table), {'￥1￥': '10', '￥2￥': '20', '￥k3f2￥': '7', '￥5000￥': '5'})
+        self.assertEqual(substitute_placeholders('￥1￥￥01￥￥k3f2￥￥5000￥￥3￥', table), '10￥01￥75￥3￥')
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file